@@ -0,0 +1,219 @@
+import numpy as np
+
+from tf_agents.trajectories import time_step
+from tf_agents.environments import py_environment
+from tf_agents.specs import array_spec
+
+from catalog import load_catalog
+from environment import (action_count, player_hand_size, card_observation_length, board_length, deal_wonder_sides,
+                         new_episode_seed, observation_buffers, seat_order, shuffle_wonders, shuffle_age_structures,
+                         split_action)
+from rules import RulesKernel, load_tables, wonder_sides
+
+# Indexes the empty hand slot row of Catalog.structure_features
+EMPTY_SLOT = -1
+
+
+class BatchedGameEnvironment(py_environment.PyEnvironment):
+    # Steps `batch_size` independent games at once, the acting seat of every game plays one action per step.
+    # The games live in a rules.RulesKernel: legal actions, plays, end of turn and age resolution and scores are array
+    # operations over the games, only the deals and the resets are per game.
+    # Every game deals like GameEnvironment from its own episode seed, so any game can be replayed by a GameEnvironment
+    # from (episode_seeds[game], actions of the game).
+    # Observations are written into reused buffers, set_observation_buffers points them at rows of a larger array.
+
+    def __init__(self, batch_size=8, player_count=3, seed=None, observe=True, board_observations=False,
+                 wonder_side='A'):
+        super().__init__()
+        self.observe = observe
+        self.wonder_side = wonder_side
+        self.board_observations = board_observations
+
+        self.catalog = load_catalog()
+        self.kernel = RulesKernel(batch_size, player_count, load_tables())
+        self._batch_size = batch_size
+        self.player_count = player_count
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.episode_seeds = np.zeros(batch_size, dtype=np.uint64)
+        self.randoms = [None] * batch_size
+
+        self.age = np.ones(batch_size, dtype=np.int32)
+        self.turn = np.ones(batch_size, dtype=np.int32)
+        self.current_player_index = np.zeros(batch_size, dtype=np.int32)
+        self.player_deck_offset = np.zeros(batch_size, dtype=np.int32)
+        self.episode_ended = np.zeros(batch_size, dtype=bool)
+
+        self.hands = np.full((batch_size, player_count, player_hand_size), EMPTY_SLOT, dtype=np.int32)
+        self.hand_sizes = np.zeros((batch_size, player_count), dtype=np.int32)
+        self.scores = np.zeros((batch_size, player_count), dtype=np.int32)
+        self.wonder_ids = np.zeros((batch_size, player_count), dtype=np.int32)
+
+        self._action_spec = array_spec.BoundedArraySpec(
+            shape=(), dtype=np.int32, minimum=0, maximum=action_count - 1, name='action')
+        self._observation_spec = {
+            'age': array_spec.ArraySpec((), np.float32),
+            'turn': array_spec.ArraySpec((), np.float32),
+            'players_coins': array_spec.ArraySpec((self.player_count,), np.float32),
+            'player_hand': array_spec.ArraySpec((player_hand_size, card_observation_length), np.float32),
+            'legal_actions': array_spec.BoundedArraySpec((action_count,), np.float32, minimum=0, maximum=1),
+            'action_costs': array_spec.ArraySpec((action_count,), np.float32),
+        }
+        if board_observations:
+            self._observation_spec['players_board'] = array_spec.ArraySpec(
+                (player_count, board_length(self.catalog)), np.float32)
+        self.observation = observation_buffers(self._observation_spec, (batch_size,))
+
+        for game_index in range(batch_size):
+            self.reset_game(game_index)
+
+    @property
+    def batched(self):
+        return True
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def coins(self):
+        return self.kernel.coins
+
+    @property
+    def discarded_structures(self):
+        return self.kernel.discard_pile
+
+    @property
+    def boards(self):
+        # game.Player.board of every seat, None without board observations
+        if not self.board_observations:
+            return None
+        return self.kernel.boards()
+
+    def action_spec(self):
+        return self._action_spec
+
+    def observation_spec(self):
+        return self._observation_spec
+
+    def set_observation_buffers(self, buffers):
+        # Arrays of observation_spec shapes with a leading batch_size axis, views into a caller's array included
+        self.observation = buffers
+
+    def step_observation(self):
+        return self.to_observation() if self.observe else None
+
+    def to_observation(self, out=None):
+        observation = self.observation if out is None else out
+        games = np.arange(self._batch_size)
+        decks = (self.current_player_index + self.player_deck_offset) % self.player_count
+        hands = self.hands[games, decks]
+
+        observation['legal_actions'][:], observation['action_costs'][:] = self.kernel.legal_actions(
+            games, self.current_player_index, hands)
+        observation['age'][:] = self.age
+        observation['turn'][:] = self.turn
+        observation['players_coins'][:] = self.kernel.coins
+        np.take(self.catalog.structure_features, hands, axis=0, out=observation['player_hand'])
+        if self.board_observations:
+            observation['players_board'][:] = self.boards[
+                games[:, None], seat_order(self.current_player_index[:, None], self.player_count)]
+        return observation
+
+    def _reset(self):
+        for game_index in range(self._batch_size):
+            self.reset_game(game_index)
+        return time_step.restart(self.step_observation(), batch_size=self._batch_size)
+
+    def _step(self, action):
+        actions, structure_indexes = split_action(np.asarray(action, dtype=np.int32).reshape(self._batch_size))
+
+        step_types = np.full(self._batch_size, time_step.StepType.MID, dtype=np.int32)
+        rewards = np.zeros(self._batch_size, dtype=np.float32)
+        discounts = np.ones(self._batch_size, dtype=np.float32)
+
+        ended = np.flatnonzero(self.episode_ended)
+        for game_index in ended:
+            self.reset_game(game_index)
+        step_types[ended] = time_step.StepType.FIRST
+
+        games = np.flatnonzero(step_types != time_step.StepType.FIRST)
+        if len(games):
+            players = self.current_player_index[games]
+            rewards[games] = self.play(games, actions[games], structure_indexes[games])
+            self.finish_player_turn(games)
+            rewards[games] += self.calculate_score_difference(games, players)
+
+            last = games[self.episode_ended[games]]
+            step_types[last] = time_step.StepType.LAST
+            discounts[last] = 0
+
+        return time_step.TimeStep(step_types, rewards, discounts, self.step_observation())
+
+    def play(self, games, actions, structure_indexes):
+        players = self.current_player_index[games]
+        decks = (players + self.player_deck_offset[games]) % self.player_count
+
+        # Remove the played structure, the rest of the hand moves up a slot
+        hands = self.hands[games, decks]
+        structure_indexes = np.minimum(structure_indexes, self.hand_sizes[games, decks] - 1)
+        structures = hands[np.arange(len(games)), structure_indexes]
+        slots = np.arange(player_hand_size)
+        shifted = np.minimum(slots + (slots >= structure_indexes[:, None]), player_hand_size)
+        self.hands[games, decks] = np.take_along_axis(
+            np.concatenate([hands, np.full((len(games), 1), EMPTY_SLOT, dtype=np.int32)], axis=1), shifted, axis=1)
+        self.hand_sizes[games, decks] -= 1
+
+        return self.kernel.play(games, players, actions, structures)
+
+    def finish_player_turn(self, games):
+        self.current_player_index[games] = (self.current_player_index[games] + 1) % self.player_count
+        games = games[self.current_player_index[games] == 0]
+        self.turn[games] += 1
+
+        self.kernel.finish_turn(games[self.turn[games] != 7])
+        self.finish_age(games[self.turn[games] == 7])
+        self.episode_ended[games] = self.age[games] == 4
+
+    def finish_age(self, games):
+        decks = (np.arange(self.player_count) + self.player_deck_offset[games, None]) % self.player_count
+        self.kernel.finish_age(games, self.age[games] + 1, self.hands[games[:, None], decks, 0])
+        self.age[games] += 1
+        self.turn[games] = 1
+        self.player_deck_offset[games] += np.where(self.age[games] == 2, -1, 1)
+
+        for game_index in games:
+            self.deal_age_structures(game_index)
+
+    def reset_game(self, game_index):
+        self.episode_seeds[game_index] = new_episode_seed(self.seed_sequence)
+        self.randoms[game_index] = np.random.default_rng(int(self.episode_seeds[game_index]))
+        self.age[game_index] = 1
+        self.turn[game_index] = 1
+        self.current_player_index[game_index] = 0
+        self.player_deck_offset[game_index] = 0
+        self.episode_ended[game_index] = False
+        self.scores[game_index] = 0
+
+        wonder_ids = shuffle_wonders(self.randoms[game_index], self.catalog)[:self.player_count]
+        sides = deal_wonder_sides(self.randoms[game_index], self.player_count, self.wonder_side)
+        self.wonder_ids[game_index] = wonder_ids
+        self.kernel.reset([game_index], [[wonder_id * len(wonder_sides) + wonder_sides.index(side)
+                                          for wonder_id, side in zip(wonder_ids, sides)]])
+        self.deal_age_structures(game_index)
+
+    def deal_age_structures(self, game_index):
+        self.hands[game_index] = EMPTY_SLOT
+        self.hand_sizes[game_index] = 0
+        if self.age[game_index] > 3:
+            return
+
+        decks = shuffle_age_structures(self.randoms[game_index], self.catalog, self.age[game_index], self.player_count)
+        for deck, deck_structures in enumerate(decks):
+            self.hands[game_index, deck, :len(deck_structures)] = deck_structures
+            self.hand_sizes[game_index, deck] = len(deck_structures)
+
+    def calculate_score_difference(self, games, players):
+        new_scores = self.kernel.scores(games)[np.arange(len(games)), players]
+        rewards = new_scores - self.scores[games, players]
+        self.scores[games, players] = new_scores
+        return rewards
@@ -0,0 +1,221 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from batched_environment import BatchedGameEnvironment
+from environment import GameEnvironment
+from game import payment_cache_hit_rate, payment_cost
+from replay_log import ReplayReader, ReplayWriter
+from rules import RulesKernel, play_random_games
+
+# A metric regresses when it is worse than the baseline by more than this fraction
+default_threshold = 0.2
+
+
+def random_legal_action(observation, rng):
+    return int(rng.choice(np.flatnonzero(observation['legal_actions'])))
+
+
+def play_random_game(env, rng, steps=None):
+    # Plays random legal actions until the end of the game, or for `steps` actions
+    time_step = env.reset()
+    step = 0
+    while not time_step.is_last() and (steps is None or step < steps):
+        time_step = env.step(random_legal_action(time_step.observation, rng))
+        step += 1
+    return step
+
+
+def metric(value, unit, higher_is_better):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def episodes_per_second(player_count, episodes, seed, wonder_side='A'):
+    rng = random.Random(seed)
+    env = GameEnvironment(player_count, seed, wonder_side=wonder_side)
+    start_time = time.perf_counter()
+    for _ in range(episodes):
+        play_random_game(env, rng)
+    return episodes / (time.perf_counter() - start_time)
+
+
+def batched_episodes_per_second(player_count, episodes, seed, batch_size=8):
+    # Random legal episodes on BatchedGameEnvironment, whose games run on the rules kernel
+    rng = np.random.default_rng(seed)
+    env = BatchedGameEnvironment(batch_size, player_count, seed)
+    time_step = env.reset()
+    finished = 0
+    start_time = time.perf_counter()
+    while finished < episodes:
+        # The hands of the games that just ended are empty, any action starts their next episode
+        legal_actions = time_step.observation['legal_actions']
+        time_step = env.step(np.argmax(rng.random(legal_actions.shape) * legal_actions, axis=1))
+        finished += int(np.sum(time_step.is_last()))
+    return finished / (time.perf_counter() - start_time)
+
+
+def kernel_episodes_per_second(player_count, episodes, seed, batch_size=64, random_sides=False):
+    # Random legal games on the NumPy rules kernel, `batch_size` games at a time
+    rng = np.random.default_rng(seed)
+    kernel = RulesKernel(batch_size, player_count)
+    batches = -(-episodes // batch_size)
+    start_time = time.perf_counter()
+    for _ in range(batches):
+        play_random_games(kernel, rng, random_sides=random_sides)
+    return batches * batch_size / (time.perf_counter() - start_time)
+
+
+def replay_episodes_per_second(player_count, episodes, seed, batch_size=64):
+    # Random legal episodes logged by ReplayWriter, then read back as training batches: decompression and the replay
+    # of the observations and rewards on the rules kernel
+    rng = random.Random(seed)
+    env = GameEnvironment(player_count, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'games.7wrl')
+        with ReplayWriter(file_path, player_count) as writer:
+            for _ in range(episodes):
+                play_random_game(env, rng)
+                writer.add_episode(env)
+        reader = ReplayReader(file_path)
+        try:
+            replayed = 0
+            start_time = time.perf_counter()
+            for batch in reader.batches(batch_size):
+                replayed += len(batch['reward'])
+            return replayed / (time.perf_counter() - start_time)
+        finally:
+            reader.close()
+
+
+def peak_memory_per_game(player_count, seed):
+    rng = random.Random(seed)
+    tracemalloc.start()
+    try:
+        env = GameEnvironment(player_count, seed)
+        play_random_game(env, rng)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def seconds_per_call(function, number, setup='pass'):
+    # Best of three repeats, the least disturbed by the rest of the machine
+    return min(timeit.repeat(function, setup=setup, number=number, repeat=3)) / number
+
+
+def mid_game_environment(player_count, seed):
+    # An environment in the middle of age 2, where players have productions, chains and neighbors worth trading with
+    rng = random.Random(seed)
+    env = GameEnvironment(player_count, seed)
+    play_random_game(env, rng, steps=9 * player_count)
+    return env
+
+
+def call_benchmarks(player_count, number, seed):
+    env = mid_game_environment(player_count, seed)
+    player = env.players[env.current_player_index]
+    costs = [structure['cost'] for structure in env.catalog.structures]
+    next_cost = itertools.cycle(costs).__next__
+
+    def build_cost():
+        player.build_cost(next_cost())
+
+    results = {}
+    results['build_cost_cold'] = metric(
+        seconds_per_call(build_cost, len(costs), setup=payment_cost.cache_clear), 's/call', False)
+    results['build_cost'] = metric(seconds_per_call(build_cost, number), 's/call', False)
+    results['payment_cache_hit_rate'] = metric(payment_cache_hit_rate(), 'ratio', True)
+    results['score'] = metric(seconds_per_call(player.score, number), 's/call', False)
+    results['science_score'] = metric(seconds_per_call(player.science_score, number), 's/call', False)
+    results['full_score'] = metric(seconds_per_call(player.full_score, number), 's/call', False)
+    results['to_observation'] = metric(seconds_per_call(env.to_observation, number), 's/call', False)
+    results['shuffle_age_structures'] = metric(
+        seconds_per_call(env.shuffle_age_structures, number), 's/call', False)
+    return results
+
+
+def run(player_counts=(3, 4, 5, 6, 7), episodes=20, number=1000, seed=0):
+    results = {}
+    for player_count in player_counts:
+        results['episodes_per_second/%d' % player_count] = metric(
+            episodes_per_second(player_count, episodes, seed), 'episodes/s', True)
+        results['batched_episodes_per_second/%d' % player_count] = metric(
+            batched_episodes_per_second(player_count, episodes, seed), 'episodes/s', True)
+        # The kernel pays a fixed cost per step, wide batches spread it
+        results['batched_64_episodes_per_second/%d' % player_count] = metric(
+            batched_episodes_per_second(player_count, episodes, seed, batch_size=64), 'episodes/s', True)
+        results['kernel_episodes_per_second/%d' % player_count] = metric(
+            kernel_episodes_per_second(player_count, episodes, seed), 'episodes/s', True)
+        results['replay_episodes_per_second/%d' % player_count] = metric(
+            replay_episodes_per_second(player_count, episodes, seed), 'episodes/s', True)
+        # Side B boards exercise the wonder actions: free builds, discarded and last card plays, copied guilds
+        results['random_side_episodes_per_second/%d' % player_count] = metric(
+            episodes_per_second(player_count, episodes, seed, 'random'), 'episodes/s', True)
+        results['kernel_random_side_episodes_per_second/%d' % player_count] = metric(
+            kernel_episodes_per_second(player_count, episodes, seed, random_sides=True), 'episodes/s', True)
+        results['peak_memory_per_game/%d' % player_count] = metric(
+            peak_memory_per_game(player_count, seed), 'bytes', False)
+    for name, result in call_benchmarks(min(player_counts), number, seed).items():
+        results['%s/%d' % (name, min(player_counts))] = result
+    return results
+
+
+def compare(results, baseline, threshold=default_threshold):
+    # Returns (name, baseline value, value, relative change) for every metric that regressed beyond the threshold
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        baseline_value = baseline[name]['value']
+        value = result['value']
+        if not baseline_value:
+            continue
+        change = (value - baseline_value) / baseline_value
+        if (-change if result['higher_is_better'] else change) > threshold:
+            regressions.append((name, baseline_value, value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the throughput of the game engine.')
+    parser.add_argument('--output', default='bench_output.json', help='where to write the JSON results')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=default_threshold,
+                        help='fail when a metric is worse than the baseline by more than this fraction')
+    parser.add_argument('--players', type=int, nargs='+', default=[3, 4, 5, 6, 7])
+    parser.add_argument('--episodes', type=int, default=20)
+    parser.add_argument('--number', type=int, default=1000, help='calls per micro benchmark repeat')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = run(args.players, args.episodes, args.number, args.seed)
+    with open(args.output, 'w') as file:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'metrics': results},
+                  file, indent=2, sort_keys=True)
+
+    for name, result in sorted(results.items()):
+        print('%-40s %14.6g %s' % (name, result['value'], result['unit']))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['metrics']
+        regressions = compare(results, baseline, args.threshold)
+        for name, baseline_value, value, change in regressions:
+            print('REGRESSION %s: %.6g -> %.6g (%+.1f%%)' % (name, baseline_value, value, change * 100))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
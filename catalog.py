@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import numpy as np
+from functools import lru_cache
+from os import path
+
+from game import GameDataJsonDecoder, Resource, Science, Type
+
+game_data_dir = path.join(path.dirname(__file__), 'game-data')
+ages = (1, 2, 3)
+min_player_count = 3
+max_player_count = 7
+
+# type (7), gold, resources (7), production (7), points, military, science (3)
+card_observation_length = 7 + 1 + 7 + 7 + 1 + 1 + 3
+gold_offset = len(Type)
+resources_offset = gold_offset + 1
+production_offset = resources_offset + len(Resource)
+points_offset = production_offset + len(Resource)
+military_offset = points_offset + 1
+science_offset = military_offset + 1
+science_symbols = (Science.WHEEL, Science.COMPASS, Science.TABLET)
+
+
+class FrozenDict(dict):
+    # A dict that refuses changes. Pickles and copies rebuild it from its items, the process pools and the search
+    # snapshots copy players holding catalog records.
+
+    def immutable(self, *args, **kwargs):
+        raise TypeError('catalog records are immutable')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = immutable
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    # Game data as FrozenDict and tuples all the way down
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class Catalog:
+    # Records are shared by every environment of the process, they are frozen: FrozenDict and tuples.
+
+    def __init__(self, data_dir=game_data_dir):
+        self.digest = catalog_digest(data_dir)
+        structures = []
+        self.age_structure_ids = {}
+        for age in ages:
+            ids = self.compile_structures(
+                structures, self.load(data_dir, 'age-' + str(age) + '-structures.json'), age)
+            self.age_structure_ids[age] = dict(
+                (player_count, tuple(i for i in ids if structures[i]['minPlayerCount'] <= player_count))
+                for player_count in range(min_player_count, max_player_count + 1))
+        self.guild_ids = self.compile_structures(structures, self.load(data_dir, 'guild-structures.json'), 3)
+        self.structures = tuple(freeze(structure) for structure in structures)
+        self.structure_names = tuple(sorted(set(s['name'] for s in self.structures)))
+
+        # The last row encodes an empty hand slot so that a -1 structure id gathers zeros
+        self.structure_features = np.zeros((len(self.structures) + 1, card_observation_length), dtype=np.float32)
+        for structure in self.structures:
+            self.structure_features[structure['id']] = encode_structure(structure)
+        self.structure_features.setflags(write=False)
+        # The heuristic worth of a structure, points, military and science, as policies.HeuristicPolicy counts it
+        features = self.structure_features[:-1]
+        self.structure_values = (features[:, points_offset] + features[:, military_offset]
+                                 + features[:, science_offset:].sum(axis=1))
+        self.structure_values.setflags(write=False)
+
+        wonders = self.load(data_dir, 'wonders.json')
+        stage_count = 0
+        for wonder_id, wonder in enumerate(wonders):
+            wonder['id'] = wonder_id
+            for side in wonder['sides'].values():
+                for stage in side['stages']:
+                    stage['id'] = stage_count
+                    stage['wonder'] = wonder_id
+                    stage_count += 1
+        self.wonders = freeze(wonders)
+        self.wonder_stages = tuple(stage for wonder in self.wonders for side in wonder['sides'].values()
+                                   for stage in side['stages'])
+
+    @staticmethod
+    def load(data_dir, file_name):
+        with open(path.join(data_dir, file_name)) as data_file:
+            return json.load(data_file, cls=GameDataJsonDecoder)
+
+    @staticmethod
+    def compile_structures(structures, loaded, age):
+        ids = []
+        for structure in loaded:
+            structure['id'] = len(structures)
+            structure['age'] = age
+            structures.append(structure)
+            ids.append(structure['id'])
+        return tuple(ids)
+
+    def age_structures(self, age, player_count):
+        return self.age_structure_ids[age][player_count]
+
+    def structure(self, structure_id):
+        return self.structures[structure_id]
+
+    def wonder_side(self, wonder_id, side='A'):
+        return self.wonders[wonder_id]['sides'][side]
+
+
+def catalog_digest(data_dir=game_data_dir):
+    # Identifies the game data, structure and wonder ids are only meaningful within the same data
+    digest = hashlib.sha1()
+    for file_name in sorted(os.listdir(data_dir)):
+        if file_name.endswith('.json'):
+            digest.update(file_name.encode())
+            with open(path.join(data_dir, file_name), 'rb') as data_file:
+                digest.update(data_file.read())
+    return digest.digest()
+
+
+def encode_structure(structure):
+    features = np.zeros(card_observation_length, dtype=np.float32)
+    features[structure['type'].value - 1] = 1
+    features[gold_offset] = structure['cost']['gold']
+    for resource, quantity in structure['cost']['resources'].items():
+        features[resources_offset + Resource[resource].value - 1] = quantity
+
+    effect = structure['effect']
+    for resource, quantity in effect.get('production', {}).items():
+        features[production_offset + Resource[resource].value - 1] = quantity
+    features[points_offset] = effect.get('points', 0)
+    features[military_offset] = effect.get('military', 0)
+    if 'science' in effect:
+        for index, symbol in enumerate(science_symbols):
+            if effect['science'] in (symbol, Science.ANY):
+                features[science_offset + index] = 1
+
+    return features
+
+
+@lru_cache(maxsize=None)
+def load_catalog(data_dir=game_data_dir):
+    return Catalog(data_dir)
@@ -0,0 +1,93 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import tensorflow as tf
+
+from tf_agents.utils import common
+
+# save() and write() copy the variables to host memory and return, a TensorFlow thread writes the files
+async_options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+latest_file_name = 'latest'
+
+
+class AsyncCheckpointer(common.Checkpointer):
+    # common.Checkpointer writing in the background, reads and writes the same checkpoints. The manager still rotates
+    # the old checkpoints out. A save waits for the previous one, so at most one interval of progress is in flight.
+
+    def save(self, global_step, options=None):
+        super().save(global_step, options or async_options)
+
+    def sync(self):
+        self._checkpoint.sync()
+
+
+def policy_checkpoint_name(step):
+    return 'policy_' + ('%d' % step).zfill(9)
+
+
+def latest_policy(export_dir):
+    # (saved model path, checkpoint path of the latest published version or None), the pair policy_loader.load and
+    # SavedPolicy take
+    saved_model_path = os.path.join(export_dir, 'saved_model')
+    try:
+        with open(os.path.join(export_dir, latest_file_name)) as file:
+            name = file.read().strip()
+    except FileNotFoundError:
+        return saved_model_path, None
+    return saved_model_path, os.path.join(export_dir, 'checkpoints', name)
+
+
+class PolicyPublisher:
+    # Exports the full saved model of the policy once, then only its variables, in the layout of
+    # PolicySaver.save_checkpoint. A version becomes visible when its write has completed: a background thread then
+    # replaces the `latest` file with a rename and removes the oldest versions, unless max_to_keep is None.
+
+    def __init__(self, saver, export_dir, train_step, max_to_keep=5):
+        self.export_dir = export_dir
+        self.checkpoint_dir = os.path.join(export_dir, 'checkpoints')
+        self.max_to_keep = max_to_keep
+        self.saved_model_path = os.path.join(export_dir, 'saved_model')
+        if not tf.io.gfile.exists(os.path.join(self.saved_model_path, tf.saved_model.SAVED_MODEL_FILENAME_PB)):
+            saver.save(self.saved_model_path)
+        tf.io.gfile.makedirs(self.checkpoint_dir)
+
+        self.checkpoint = tf.train.Checkpoint(
+            policy=saver.policy, model_variables=saver.policy.model_variables, train_step=train_step)
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = None
+        self.last_name = None
+        self.published = []
+        self.latest_published = latest_policy(export_dir)[1]
+
+    def publish(self, step):
+        name = policy_checkpoint_name(step)
+        checkpoint_path = os.path.join(self.checkpoint_dir, name)
+        if name == self.last_name:
+            return checkpoint_path
+        self.last_name = name
+        file_prefix = os.path.join(checkpoint_path, tf.saved_model.VARIABLES_DIRECTORY,
+                                   tf.saved_model.VARIABLES_FILENAME)
+        self.checkpoint.write(file_prefix, options=async_options)
+        self.pending = self.executor.submit(self.finish, name)
+        return checkpoint_path
+
+    def finish(self, name):
+        self.checkpoint.sync()
+        latest_path = os.path.join(self.export_dir, latest_file_name)
+        with open(latest_path + '.tmp', 'w') as file:
+            file.write(name)
+        os.replace(latest_path + '.tmp', latest_path)
+        self.latest_published = os.path.join(self.checkpoint_dir, name)
+
+        self.published.append(name)
+        while self.max_to_keep is not None and len(self.published) > self.max_to_keep:
+            shutil.rmtree(os.path.join(self.checkpoint_dir, self.published.pop(0)), ignore_errors=True)
+
+    def sync(self):
+        if self.pending is not None:
+            self.pending.result()
+
+    def close(self):
+        self.sync()
+        self.executor.shutdown()
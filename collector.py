@@ -0,0 +1,356 @@
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tf_agents.trajectories import time_step, trajectory
+
+from batched_environment import BatchedGameEnvironment
+from environment import action_count
+import profiling
+
+# Turns of an age times ages, every seat plays once per turn
+turns_per_age = 6
+
+
+def episode_length(player_count):
+    return turns_per_age * 3 * player_count
+
+
+episode_fields = [
+    ('step_type', np.int32),
+    ('next_step_type', np.int32),
+    ('reward', np.float32),
+    ('discount', np.float32),
+    ('action', np.int32),
+    ('action_logits', np.float32),
+]
+episode_field_shapes = {
+    'action_logits': (action_count,),
+}
+
+
+class SharedArrays:
+    # NumPy arrays carved out of one shared memory block, attachable from other processes by (name, layout)
+
+    def __init__(self, layout, name=None):
+        offsets = []
+        size = 0
+        for field, shape, dtype in layout:
+            size = -(-size // 8) * 8
+            offsets.append(size)
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        self.layout = layout
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+        self.arrays = dict((field, np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset))
+                           for (field, shape, dtype), offset in zip(layout, offsets))
+        if name is None:
+            for array in self.arrays.values():
+                array.fill(0)
+
+    def spec(self):
+        return self.memory.name, self.layout
+
+    @classmethod
+    def attach(cls, spec):
+        name, layout = spec
+        return cls(layout, name)
+
+    def close(self):
+        self.arrays = None
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+class EpisodeRing(SharedArrays):
+    # Single producer / single consumer ring of whole episodes. The worker only advances the written counter and the
+    # learner only advances the read counter, so no lock is needed.
+
+    @staticmethod
+    def create_layout(capacity, length, observation_spec):
+        layout = [('counters', (2,), np.int64), ('policy_version', (capacity,), np.int64)]
+        for key, spec in sorted(observation_spec.items()):
+            layout.append(('observation/' + key, (capacity, length) + spec.shape, spec.dtype))
+        for field, dtype in episode_fields:
+            layout.append((field, (capacity, length) + episode_field_shapes.get(field, ()), dtype))
+        return layout
+
+    @property
+    def capacity(self):
+        return self.arrays['policy_version'].shape[0]
+
+    def available(self):
+        counters = self.arrays['counters']
+        return int(counters[0] - counters[1])
+
+    def put(self, episodes, game_index, policy_version, stop_event):
+        counters = self.arrays['counters']
+        while counters[0] - counters[1] >= self.capacity:
+            if stop_event.is_set():
+                return False
+            time.sleep(0.001)
+
+        slot = counters[0] % self.capacity
+        for field, array in episodes.items():
+            self.arrays[field][slot] = array[game_index]
+        self.arrays['policy_version'][slot] = policy_version
+        counters[0] += 1
+        return True
+
+    def get(self, count, out, offset):
+        counters = self.arrays['counters']
+        for i in range(count):
+            slot = (counters[1] + i) % self.capacity
+            for field, array in out.items():
+                array[offset + i] = self.arrays[field][slot]
+        counters[1] += count
+
+
+class PolicyStore(SharedArrays):
+    # Latest policy weights behind a sequence counter: odd while the learner writes, readers retry on a change
+
+    @staticmethod
+    def create_layout(weight_shapes):
+        size = sum(int(np.prod(shape)) for shape in weight_shapes)
+        return [('version', (1,), np.int64), ('weights', (size,), np.float32)]
+
+    def publish(self, weights):
+        version = self.arrays['version']
+        version[0] += 1
+        offset = 0
+        for w in weights:
+            w = np.asarray(w, dtype=np.float32).ravel()
+            self.arrays['weights'][offset:offset + w.size] = w
+            offset += w.size
+        version[0] += 1
+        return int(version[0]) // 2
+
+    def read(self, weight_shapes, known_version):
+        while True:
+            version = int(self.arrays['version'][0])
+            if version % 2 == 1:
+                time.sleep(0.0001)
+                continue
+            if version // 2 == known_version:
+                return None, known_version
+            flat = self.arrays['weights'].copy()
+            if int(self.arrays['version'][0]) == version:
+                break
+
+        weights = []
+        offset = 0
+        for shape in weight_shapes:
+            size = int(np.prod(shape))
+            weights.append(flat[offset:offset + size].reshape(shape))
+            offset += size
+        return weights, version // 2
+
+
+def episode_arrays(count, length, observation_spec):
+    # Arrays of `count` episodes in the EpisodeRing layout, without the ring counters and the policy versions
+    return dict((field, np.zeros(shape, dtype))
+                for field, shape, dtype in EpisodeRing.create_layout(count, length, observation_spec)
+                if field not in ('counters', 'policy_version'))
+
+
+def episode_observation_views(env, episodes, length):
+    return [dict((key, episodes['observation/' + key][:, t]) for key in env.observation_spec()) for t in range(length)]
+
+
+def play_episodes(env, policy, episodes, observation_views):
+    # One episode of every game of the batched env into the episode arrays. The environment writes every observation
+    # straight into its step of the episode arrays.
+    length = len(observation_views)
+    env.set_observation_buffers(observation_views[0])
+    current_time_step = env.reset()
+    for t in range(length):
+        episodes['step_type'][:, t] = current_time_step.step_type
+
+        actions, action_logits = policy.action(current_time_step.observation)
+        episodes['action'][:, t] = actions
+        episodes['action_logits'][:, t] = action_logits
+
+        if t < length - 1:
+            env.set_observation_buffers(observation_views[t + 1])
+            current_time_step = env.step(actions)
+            episodes['next_step_type'][:, t] = current_time_step.step_type
+            episodes['reward'][:, t] = current_time_step.reward
+            episodes['discount'][:, t] = current_time_step.discount
+        else:
+            # Boundary transition into the next episode, as recorded by the tf_agents drivers
+            episodes['next_step_type'][:, t] = time_step.StepType.FIRST
+            episodes['reward'][:, t] = 0
+            episodes['discount'][:, t] = 1
+
+
+def collect_worker(ring_spec, store_spec, weight_shapes, policy_factory, player_count, batch_size, seed,
+                   stop_event, board_observations=False, wonder_side='A', profile_path=None):
+    # With profile_path the worker times its hot paths and writes its stats there
+    stats_writer = None
+    if profile_path is not None:
+        profiling.enable()
+        stats_writer = profiling.StatsWriter(profile_path)
+    ring = EpisodeRing.attach(ring_spec)
+    store = PolicyStore.attach(store_spec)
+    env = BatchedGameEnvironment(batch_size, player_count, seed, board_observations=board_observations,
+                                 wonder_side=wonder_side)
+    policy = policy_factory()
+    policy_version = 0
+
+    length = episode_length(player_count) + 1
+    episodes = episode_arrays(batch_size, length, env.observation_spec())
+    observation_views = episode_observation_views(env, episodes, length)
+
+    while not stop_event.is_set():
+        weights, version = store.read(weight_shapes, policy_version)
+        if weights is not None:
+            policy.load(weights)
+            policy_version = version
+        if policy.weights_required and policy_version == 0:
+            time.sleep(0.01)
+            continue
+
+        start_time = time.perf_counter()
+        play_episodes(env, policy, episodes, observation_views)
+        profiling.record('play_episodes', time.perf_counter() - start_time)
+        profiling.count('episodes', batch_size)
+        if stats_writer is not None:
+            stats_writer.update()
+        for game_index in range(batch_size):
+            if not ring.put(episodes, game_index, policy_version, stop_event):
+                break
+
+    if stats_writer is not None:
+        stats_writer.close()
+    ring.close()
+    store.close()
+
+
+class SelfPlayCollector:
+    # Runs `num_workers` processes, each playing `envs_per_worker` games with the latest published policy weights
+    # and writing whole episodes into its own shared memory ring. The learner drains the rings between train steps
+    # while the workers keep playing. With inference_batch_size the workers share an InferenceServer, which evaluates
+    # the policy for the games of all workers in batches of up to that size. With profile_dir every worker profiles
+    # itself into profile_dir/profile_stats_worker_<index>.json.
+
+    def __init__(self, policy_factory, weight_shapes=(), player_count=3, num_workers=2, envs_per_worker=4,
+                 ring_capacity=64, seed=None, inference_batch_size=0, inference_latency=0.002,
+                 board_observations=False, wonder_side='A', profile_dir=None):
+        self.policy_factory = policy_factory
+        self.weight_shapes = [tuple(shape) for shape in weight_shapes]
+        self.player_count = player_count
+        self.num_workers = num_workers
+        self.envs_per_worker = envs_per_worker
+        self.seeds = np.random.SeedSequence(seed).spawn(num_workers)
+        self.board_observations = board_observations
+        self.wonder_side = wonder_side
+        self.profile_dir = profile_dir
+
+        self.observation_spec = BatchedGameEnvironment(
+            1, player_count, board_observations=board_observations).observation_spec()
+        self.length = episode_length(player_count) + 1
+        self.rings = [EpisodeRing(EpisodeRing.create_layout(ring_capacity, self.length, self.observation_spec))
+                      for _ in range(num_workers)]
+        self.store = PolicyStore(PolicyStore.create_layout(self.weight_shapes))
+        self.policy_version = 0
+
+        self.server = None
+        if inference_batch_size > 0:
+            # Imported here, inference_server builds on this module
+            from inference_server import InferenceServer
+            self.server = InferenceServer(policy_factory, num_workers * envs_per_worker, player_count,
+                                          inference_batch_size, inference_latency, self.store.spec(),
+                                          self.weight_shapes, board_observations)
+
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = self.context.Event()
+        self.workers = []
+        self.next_ring = 0
+        self.collected_episodes = 0
+        self.collected_steps = 0
+        self.last_policy_lag = 0.0
+
+    def start(self, weights=None):
+        if weights is not None:
+            self.publish(weights)
+        if self.server is not None:
+            self.server.start()
+        for index, (ring, seed) in enumerate(zip(self.rings, self.seeds)):
+            policy_factory = self.policy_factory
+            if self.server is not None:
+                policy_factory = self.server.client_factory(self.envs_per_worker)
+            profile_path = None
+            if self.profile_dir is not None:
+                profile_path = os.path.join(self.profile_dir, 'profile_stats_worker_%d.json' % index)
+            worker = self.context.Process(
+                target=collect_worker,
+                args=(ring.spec(), self.store.spec(), self.weight_shapes, policy_factory, self.player_count,
+                      self.envs_per_worker, int(seed.generate_state(1)[0]), self.stop_event,
+                      self.board_observations, self.wonder_side, profile_path),
+                daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def publish(self, weights):
+        self.policy_version = self.store.publish(weights)
+        return self.policy_version
+
+    def collect(self, num_episodes, timeout=None):
+        out = dict((field, np.zeros((num_episodes,) + array.shape[1:], array.dtype))
+                   for field, array in self.rings[0].arrays.items() if field != 'counters')
+        start_time = time.time()
+        collected = 0
+        while collected < num_episodes:
+            ring = self.rings[self.next_ring]
+            self.next_ring = (self.next_ring + 1) % len(self.rings)
+            count = min(ring.available(), num_episodes - collected)
+            if count:
+                ring.get(count, out, collected)
+                collected += count
+            elif self.next_ring == 0:
+                if timeout is not None and time.time() - start_time > timeout:
+                    raise TimeoutError('collected %d of %d episodes' % (collected, num_episodes))
+                if not any(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError('all collect workers exited')
+                time.sleep(0.001)
+
+        self.collected_episodes += num_episodes
+        self.collected_steps += num_episodes * (self.length - 1)
+        self.last_policy_lag = float(np.mean(self.policy_version - out['policy_version']))
+        return out
+
+    @staticmethod
+    def average_return(episodes):
+        return float(np.mean(np.sum(episodes['reward'], axis=1)))
+
+    @staticmethod
+    def to_trajectory(episodes):
+        observation = dict((field[len('observation/'):], array) for field, array in episodes.items()
+                           if field.startswith('observation/'))
+        return trajectory.Trajectory(
+            step_type=episodes['step_type'],
+            observation=observation,
+            action=episodes['action'],
+            policy_info={'dist_params': {'logits': episodes['action_logits']}},
+            next_step_type=episodes['next_step_type'],
+            reward=episodes['reward'],
+            discount=episodes['discount'])
+
+    def close(self):
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for shared in self.rings + [self.store]:
+            shared.close()
+            shared.unlink()
@@ -0,0 +1,458 @@
+import argparse
+import hmac
+import io
+import multiprocessing
+import os
+import queue
+import secrets
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from batched_environment import BatchedGameEnvironment
+from collector import (PolicyStore, SelfPlayCollector, episode_arrays, episode_length, episode_observation_views,
+                       play_episodes)
+import profiling
+
+# Messages: a 4 byte kind and the payload size, then the payload. Arrays travel as .npy files in an uncompressed
+# .npz archive, read back without pickle. An upload starts with the actor id and the sequence number of the batch.
+# A connection starts with HELLO and the shared token, the learner closes it on a wrong token or an oversized message.
+message_header = struct.Struct('<4sQ')
+version_header = struct.Struct('<q')
+upload_header = struct.Struct('<QQ')
+max_hello_size = 1024
+default_max_message_size = 1 << 28
+HELLO = b'HELO'
+EPISODES = b'EPIS'
+RECEIVED = b'RCVD'
+WEIGHTS = b'WGHT'
+SAME_WEIGHTS = b'SAME'
+
+
+def encode_arrays(arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_arrays(payload):
+    with np.load(io.BytesIO(payload), allow_pickle=False) as archive:
+        return dict((name, archive[name]) for name in archive.files)
+
+
+def encode_weights(version, weights):
+    return version_header.pack(version) + encode_arrays(dict(('%d' % index, np.asarray(w, dtype=np.float32))
+                                                             for index, w in enumerate(weights)))
+
+
+def decode_weights(payload):
+    arrays = decode_arrays(payload[version_header.size:])
+    return [arrays['%d' % index] for index in range(len(arrays))], version_header.unpack_from(payload)[0]
+
+
+def send_message(connection, kind, payload=b''):
+    connection.sendall(message_header.pack(kind, len(payload)))
+    if payload:
+        connection.sendall(payload)
+
+
+def receive_exactly(connection, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError('connection closed')
+        received += count
+    return bytes(buffer)
+
+
+def receive_message(connection, max_size=default_max_message_size):
+    kind, size = message_header.unpack(receive_exactly(connection, message_header.size))
+    if size > max_size:
+        raise ConnectionError('message of %d bytes, at most %d allowed' % (size, max_size))
+    return kind, receive_exactly(connection, size)
+
+
+class TcpLearnerTransport:
+    # The learner end: accepts any number of actors, one thread per connection. Received episodes wait in a bounded
+    # queue; while it is full an actor's upload blocks, the learner never waits on an actor. port 0 picks a free port,
+    # see address. Actors must know token, a random one when None; there is no encryption, listen on other hosts
+    # than 127.0.0.1 only on trusted networks.
+
+    def __init__(self, host='127.0.0.1', port=0, max_pending=64, token=None, max_message_size=default_max_message_size):
+        self.token = token if token is not None else secrets.token_hex(16)
+        self.max_message_size = max_message_size
+        self.episodes = queue.Queue(max_pending)
+        self.weights_lock = threading.Lock()
+        self.weights_payload = None
+        self.version = 0
+        # Last sequence number taken from every actor, a batch sent again after a reconnect is acknowledged only
+        self.sequences_lock = threading.Lock()
+        self.sequences = {}
+        self.stop_event = threading.Event()
+        self.connections = set()
+        self.listener = socket.create_server((host, port))
+        self.address = self.listener.getsockname()[:2]
+        self.accept_thread = threading.Thread(target=self.accept, daemon=True)
+        self.accept_thread.start()
+
+    def accept(self):
+        while not self.stop_event.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.add(connection)
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        try:
+            kind, payload = receive_message(connection, max_hello_size)
+            if kind != HELLO or not hmac.compare_digest(payload, self.token.encode()):
+                raise ConnectionError('wrong token')
+            send_message(connection, RECEIVED)
+            while not self.stop_event.is_set():
+                kind, payload = receive_message(connection, self.max_message_size)
+                if kind == EPISODES:
+                    actor_id, sequence = upload_header.unpack_from(payload)
+                    with self.sequences_lock:
+                        duplicate = sequence <= self.sequences.get(actor_id, -1)
+                        if not duplicate:
+                            self.sequences[actor_id] = sequence
+                    if not duplicate:
+                        episodes = decode_arrays(payload[upload_header.size:])
+                        while not self.stop_event.is_set():
+                            try:
+                                self.episodes.put(episodes, timeout=0.1)
+                                break
+                            except queue.Full:
+                                pass
+                    send_message(connection, RECEIVED)
+                elif kind == WEIGHTS:
+                    known_version = version_header.unpack(payload)[0]
+                    with self.weights_lock:
+                        version, weights_payload = self.version, self.weights_payload
+                    if weights_payload is None or version == known_version:
+                        send_message(connection, SAME_WEIGHTS)
+                    else:
+                        send_message(connection, WEIGHTS, weights_payload)
+                else:
+                    raise ConnectionError('unknown message %r' % kind)
+        except OSError:
+            pass
+        finally:
+            self.connections.discard(connection)
+            connection.close()
+
+    def publish(self, weights):
+        # Encoded once, every actor downloads the same payload
+        with self.weights_lock:
+            self.version += 1
+            self.weights_payload = encode_weights(self.version, weights)
+            return self.version
+
+    def receive(self, timeout=None):
+        try:
+            return self.episodes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def actor_factory(self):
+        return TcpActorFactory(self.address, self.token, self.max_message_size)
+
+    def close(self):
+        self.stop_event.set()
+        self.listener.close()
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.accept_thread.join(timeout=10)
+
+
+class TcpActorTransport:
+    # The actor end of TcpLearnerTransport. Every error is an OSError, ConnectionError included, after which the
+    # actor connects again. A reply that times out is no loss: the learner takes each (actor id, sequence) once.
+
+    def __init__(self, address, actor_id, token, timeout=60, max_message_size=default_max_message_size):
+        self.actor_id = actor_id
+        self.max_message_size = max_message_size
+        self.connection = socket.create_connection(tuple(address), timeout)
+        try:
+            send_message(self.connection, HELLO, token.encode())
+            self.expect(RECEIVED)
+        except OSError:
+            self.connection.close()
+            raise
+
+    def expect(self, expected_kind):
+        kind, _ = receive_message(self.connection, self.max_message_size)
+        if kind != expected_kind:
+            raise ConnectionError('unexpected reply %r' % kind)
+
+    def send(self, episodes, sequence):
+        send_message(self.connection, EPISODES, upload_header.pack(self.actor_id, sequence) + encode_arrays(episodes))
+        self.expect(RECEIVED)
+
+    def weights(self, known_version):
+        send_message(self.connection, WEIGHTS, version_header.pack(known_version))
+        kind, payload = receive_message(self.connection, self.max_message_size)
+        if kind == SAME_WEIGHTS:
+            return None, known_version
+        return decode_weights(payload)
+
+    def close(self):
+        self.connection.close()
+
+
+class TcpActorFactory:
+
+    def __init__(self, address, token, max_message_size=default_max_message_size):
+        self.address = tuple(address)
+        self.token = token
+        self.max_message_size = max_message_size
+
+    def __call__(self, actor_id):
+        return TcpActorTransport(self.address, actor_id, self.token, max_message_size=self.max_message_size)
+
+
+class QueueLearnerTransport:
+    # Single host stand in for TcpLearnerTransport: episodes through a multiprocessing queue, weights through a
+    # collector PolicyStore. Only actors started by this process can use it.
+
+    def __init__(self, weight_shapes, max_pending=64):
+        self.weight_shapes = [tuple(shape) for shape in weight_shapes]
+        self.episodes = multiprocessing.get_context('spawn').Queue(max_pending)
+        self.store = PolicyStore(PolicyStore.create_layout(self.weight_shapes))
+
+    def publish(self, weights):
+        return self.store.publish(weights)
+
+    def receive(self, timeout=None):
+        try:
+            return self.episodes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def actor_factory(self):
+        return QueueActorFactory(self.episodes, self.store.spec(), self.weight_shapes)
+
+    def close(self):
+        self.episodes.cancel_join_thread()
+        self.episodes.close()
+        self.store.close()
+        self.store.unlink()
+
+
+class QueueActorTransport:
+
+    def __init__(self, episodes, store_spec, weight_shapes):
+        self.episodes = episodes
+        self.store = PolicyStore.attach(store_spec)
+        self.weight_shapes = weight_shapes
+
+    def send(self, episodes, sequence):
+        self.episodes.put(episodes)
+
+    def weights(self, known_version):
+        return self.store.read(self.weight_shapes, known_version)
+
+    def close(self):
+        self.store.close()
+
+
+class QueueActorFactory:
+
+    def __init__(self, episodes, store_spec, weight_shapes):
+        self.episodes = episodes
+        self.store_spec = store_spec
+        self.weight_shapes = weight_shapes
+
+    def __call__(self, actor_id):
+        return QueueActorTransport(self.episodes, self.store_spec, self.weight_shapes)
+
+
+def actor_worker(transport_factory, policy_factory, player_count, batch_size, seed, stop_event,
+                 board_observations=False, wonder_side='A', retry_interval=1.0, profile_path=None):
+    # Plays batches of episodes with the latest weights and uploads them. The actor keeps no state the learner needs:
+    # after a transport error it connects again and first uploads the batch that failed, with the same sequence
+    # number, so the learner drops it when the first upload did arrive. With profile_path the actor times its hot
+    # paths and writes its stats there.
+    stats_writer = None
+    if profile_path is not None:
+        profiling.enable()
+        stats_writer = profiling.StatsWriter(profile_path)
+    env = BatchedGameEnvironment(batch_size, player_count, seed, board_observations=board_observations,
+                                 wonder_side=wonder_side)
+    policy = policy_factory()
+    policy_version = 0
+    length = episode_length(player_count) + 1
+    episodes = episode_arrays(batch_size, length, env.observation_spec())
+    episodes['policy_version'] = np.zeros(batch_size, dtype=np.int64)
+    observation_views = episode_observation_views(env, episodes, length)
+
+    actor_id = int.from_bytes(os.urandom(8), 'little')
+    sequence = 0
+    transport = None
+    unsent = False
+    while not stop_event.is_set():
+        try:
+            if transport is None:
+                transport = transport_factory(actor_id)
+            if unsent:
+                transport.send(episodes, sequence)
+                unsent = False
+                sequence += 1
+
+            weights, version = transport.weights(policy_version)
+            if weights is not None:
+                policy.load(weights)
+                policy_version = version
+            if policy.weights_required and policy_version == 0:
+                time.sleep(0.01)
+                continue
+
+            start_time = time.perf_counter()
+            play_episodes(env, policy, episodes, observation_views)
+            profiling.record('play_episodes', time.perf_counter() - start_time)
+            profiling.count('episodes', batch_size)
+            if stats_writer is not None:
+                stats_writer.update()
+            episodes['policy_version'][:] = policy_version
+            unsent = True
+            transport.send(episodes, sequence)
+            unsent = False
+            sequence += 1
+        except OSError:
+            if transport is not None:
+                transport.close()
+                transport = None
+            stop_event.wait(retry_interval)
+
+    if stats_writer is not None:
+        stats_writer.close()
+    if transport is not None:
+        transport.close()
+
+
+class DistributedCollector:
+    # The learner side of actor-learner training, with the interface of SelfPlayCollector. Actors run actor_worker
+    # anywhere that reaches the transport: num_actors of them are started here, more can be started on other hosts
+    # with `python distributed.py --address host:port --token token`. Each upload holds the episodes of one actor batch.
+    # With profile_dir the actors started here profile themselves into profile_dir/profile_stats_actor_<index>.json.
+
+    average_return = staticmethod(SelfPlayCollector.average_return)
+    to_trajectory = staticmethod(SelfPlayCollector.to_trajectory)
+
+    def __init__(self, transport, policy_factory, player_count=3, num_actors=2, envs_per_actor=4, seed=None,
+                 board_observations=False, wonder_side='A', profile_dir=None):
+        self.transport = transport
+        self.policy_factory = policy_factory
+        self.player_count = player_count
+        self.envs_per_actor = envs_per_actor
+        self.seeds = np.random.SeedSequence(seed).spawn(num_actors)
+        self.board_observations = board_observations
+        self.wonder_side = wonder_side
+        self.profile_dir = profile_dir
+        self.length = episode_length(player_count) + 1
+
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = self.context.Event()
+        self.workers = []
+        self.pending = []
+        self.pending_count = 0
+        self.policy_version = 0
+        self.collected_episodes = 0
+        self.collected_steps = 0
+        self.last_policy_lag = 0.0
+
+    def start(self, weights=None):
+        if weights is not None:
+            self.publish(weights)
+        for index, seed in enumerate(self.seeds):
+            profile_path = None
+            if self.profile_dir is not None:
+                profile_path = os.path.join(self.profile_dir, 'profile_stats_actor_%d.json' % index)
+            worker = self.context.Process(
+                target=actor_worker,
+                args=(self.transport.actor_factory(), self.policy_factory, self.player_count, self.envs_per_actor,
+                      int(seed.generate_state(1)[0]), self.stop_event, self.board_observations, self.wonder_side),
+                kwargs={'profile_path': profile_path},
+                daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def publish(self, weights):
+        self.policy_version = self.transport.publish(weights)
+        return self.policy_version
+
+    def collect(self, num_episodes, timeout=None):
+        start_time = time.time()
+        while self.pending_count < num_episodes:
+            if timeout is not None and time.time() - start_time > timeout:
+                raise TimeoutError('collected %d of %d episodes' % (self.pending_count, num_episodes))
+            episodes = self.transport.receive(0.1)
+            if episodes is not None:
+                self.pending.append(episodes)
+                self.pending_count += len(episodes['reward'])
+
+        pending = dict((field, np.concatenate([episodes[field] for episodes in self.pending]))
+                       for field in self.pending[0])
+        out = dict((field, array[:num_episodes]) for field, array in pending.items())
+        self.pending_count -= num_episodes
+        self.pending = [dict((field, array[num_episodes:]) for field, array in pending.items())]
+        if not self.pending_count:
+            self.pending = []
+
+        self.collected_episodes += num_episodes
+        self.collected_steps += num_episodes * (self.length - 1)
+        self.last_policy_lag = float(np.mean(self.policy_version - out['policy_version']))
+        return out
+
+    def close(self):
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.transport.close()
+
+
+def main(argv=None):
+    # A remote actor of a learner listening with TcpLearnerTransport, playing with the numpy policy of main.py
+    from policies import MlpPolicy
+
+    parser = argparse.ArgumentParser(description='Play self-play episodes for a distributed learner.')
+    parser.add_argument('--address', required=True, help='host:port of the learner')
+    parser.add_argument('--token', default=os.environ.get('DISTRIBUTED_TOKEN'),
+                        help='token of the learner, DISTRIBUTED_TOKEN by default')
+    parser.add_argument('--players', type=int, default=3)
+    parser.add_argument('--envs', type=int, default=4, help='games played in lockstep')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--board-observations', action='store_true')
+    parser.add_argument('--wonder-side', default='A', choices=['A', 'B', 'random'])
+    parser.add_argument('--profile', help='time the hot paths of the actor and write its stats to this JSON file')
+    args = parser.parse_args(argv)
+    if args.token is None:
+        parser.error('the learner token is required, --token or DISTRIBUTED_TOKEN')
+
+    host, port = args.address.rsplit(':', 1)
+    stop_event = threading.Event()
+    try:
+        actor_worker(TcpActorFactory((host, int(port)), args.token), MlpPolicy, args.players, args.envs, args.seed,
+                     stop_event, args.board_observations, args.wonder_side, profile_path=args.profile)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
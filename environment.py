@@ -1,14 +1,11 @@
-import json
-import random
 import numpy as np
-from os import path
 
-from tensorflow.python.keras.utils.np_utils import to_categorical
 from tf_agents.trajectories import time_step
 from tf_agents.environments import py_environment
 from tf_agents.specs import array_spec
 
-from game import GameDataJsonDecoder, Player, ImpossibleBuildException, Resource, Type
+from catalog import load_catalog, card_observation_length
+from game import Player, ImpossibleBuildException, board_structures
 from enum import Enum
 
 
@@ -19,17 +16,239 @@ class Action(Enum):
 
 
 player_hand_size = 7
-# type (7), gold, resources (7), production (7), points, military, science (3)
-card_observation_length = 7 + 1 + 7 + 7 + 1 + 1 + 3
+# The actions of the action spec, one per (Action, card index)
+action_count = len(Action) * player_hand_size
+
+
+def action_index(player_action, structure_index):
+    # The action of the action spec for an Action value and a card index, arrays included
+    return player_action * player_hand_size + structure_index
+
+
+def split_action(action):
+    # (Action value, card index) of an action of the action spec, arrays included
+    return action // player_hand_size, action % player_hand_size
+
+
+def legal_actions(player, hand, mask=None, costs=None):
+    # One pass over the hand, returns the legality mask of the action_count actions and the gold each legal action
+    # costs, written into mask and costs when given. A structure whose name the player already built is illegal.
+    if mask is None:
+        mask = np.zeros(action_count, dtype=np.float32)
+        costs = np.zeros(action_count, dtype=np.float32)
+    else:
+        mask.fill(0)
+        costs.fill(0)
+    if not hand:
+        return mask, costs
+
+    cards = np.arange(len(hand))
+    mask[action_index(Action.DISCARD.value, cards)] = 1
+    wonder_stage_cost = player.wonder_stage_cost()
+    if wonder_stage_cost is not None:
+        mask[action_index(Action.BUILD_WONDER_STAGE.value, cards)] = 1
+        costs[action_index(Action.BUILD_WONDER_STAGE.value, cards)] = wonder_stage_cost
+    build_costs = player.build_costs([structure['cost'] for structure in hand])
+    affordable = (build_costs <= player.coins) & np.array(
+        [structure['name'] not in player.construction_names for structure in hand])
+    mask[action_index(Action.BUILD_STRUCTURE.value, cards)] = affordable
+    costs[action_index(Action.BUILD_STRUCTURE.value, cards)] = np.where(affordable, build_costs, 0)
+
+    return mask, costs
+
+
+def resolve_action(player, player_action, structure):
+    # Returns the reward modifier, an impossible build discards the structure instead
+    try:
+        if player_action == Action.BUILD_STRUCTURE:
+            player.build_structure(structure)
+        elif player_action == Action.BUILD_WONDER_STAGE:
+            player.build_wonder_stage()
+        elif player_action == Action.DISCARD:
+            player.discard_structure()
+    except ImpossibleBuildException:
+        player.discard_structure()
+        return -3
+    return 0
+
+
+def resolve_simultaneous_actions(players, player_actions, structures):
+    # The actions of a turn played at once, as RulesKernel.play: every cost and trade is computed against the state
+    # at the start of the turn, then every build is counted on the boards, then the effects are applied. Returns the
+    # reward modifiers of resolve_action.
+    costs = []
+    for player, player_action, structure in zip(players, player_actions, structures):
+        if player_action == Action.BUILD_STRUCTURE:
+            costs.append(player.structure_cost(structure))
+        elif player_action == Action.BUILD_WONDER_STAGE and player.wonder_stage < len(player.wonder['stages']):
+            costs.append(player.wonder_stage_cost())
+        else:
+            costs.append(None)
+
+    modifiers = [0] * len(players)
+    built = []
+    for index, (player, player_action, structure, cost) in enumerate(zip(players, player_actions, structures, costs)):
+        try:
+            if player_action == Action.BUILD_STRUCTURE:
+                player.pay_structure(structure, cost)
+                player.place_structure(structure)
+            elif player_action == Action.BUILD_WONDER_STAGE:
+                player.pay_wonder_stage(cost)
+                player.place_wonder_stage()
+            else:
+                player.discard_structure()
+                continue
+        except ImpossibleBuildException:
+            player.discard_structure()
+            modifiers[index] = -3
+            continue
+        built.append((player, player_action, structure))
+
+    for player, player_action, structure in built:
+        if player_action == Action.BUILD_STRUCTURE:
+            player.apply_effect(structure['effect'], structure['type'])
+        else:
+            player.apply_wonder_stage_effects()
+    return modifiers
+
+
+def discards(player_action, success_reward_modifier):
+    # Whether the structure of a resolved action went to the discard pile
+    return player_action == Action.DISCARD or success_reward_modifier < 0
+
+
+def play_last_card(player, structure, discard_pile):
+    # Babylon B: the structure left at the end of an age is built if possible, else used for the next wonder stage,
+    # else sold, instead of being discarded. A deliberate simplification: the rules leave the play to the player, here
+    # it is this fixed order and not a decision of the agent, so the action spec stays one play per turn.
+    mask, _ = legal_actions(player, [structure])
+    if mask[action_index(Action.BUILD_STRUCTURE.value, 0)]:
+        player_action = Action.BUILD_STRUCTURE
+    elif mask[action_index(Action.BUILD_WONDER_STAGE.value, 0)]:
+        player_action = Action.BUILD_WONDER_STAGE
+    else:
+        player_action = Action.DISCARD
+    if discards(player_action, resolve_action(player, player_action, structure)):
+        discard_pile[structure['id']] += 1
+
+
+def finish_age_hands(players, hands, discard_pile, catalog):
+    # hands[player_index] lists the structure ids the player holds at the end of the age
+    for player, hand in zip(players, hands):
+        for structure_id in hand:
+            if player.play_last_card:
+                play_last_card(player, catalog.structures[structure_id], discard_pile)
+            else:
+                discard_pile[structure_id] += 1
+
+
+def resolve_discarded_plays(players, discard_pile, catalog):
+    # Halikarnassus: at the end of the turn a wonder stage was built in, the player builds the discarded structure of
+    # the highest Catalog.structure_values, lowest id first, among the ones it has not built yet, for free. A
+    # deliberate simplification: the rules let the player pick any of them, here the pick is this heuristic and not
+    # a decision of the agent, so the action spec stays one play per turn.
+    for player in players:
+        while player.discarded_plays:
+            player.discarded_plays -= 1
+            candidates = np.flatnonzero(discard_pile)
+            values = np.array([-np.inf if catalog.structures[structure_id]['name'] in player.construction_names
+                               else catalog.structure_values[structure_id] for structure_id in candidates])
+            if not np.isfinite(values).any():
+                continue
+            structure_id = candidates[np.argmax(values)]
+            discard_pile[structure_id] -= 1
+            player.build_structure(catalog.structures[structure_id], free=True)
+
+
+def board_length(catalog):
+    return board_structures + len(catalog.structures)
+
+
+def seat_order(current_player_index, player_count):
+    # Rows of the players_board observation: the acting seat, then the seats to its right around the table, so the
+    # right neighbor comes second and the left neighbor last
+    return (current_player_index + np.arange(player_count)) % player_count
+
+
+def observation_buffers(observation_spec, batch_shape=()):
+    return dict((key, np.zeros(batch_shape + spec.shape, dtype=spec.dtype)) for key, spec in observation_spec.items())
+
+
+def copy_time_step(step):
+    return step._replace(observation=dict((key, np.copy(value)) for key, value in step.observation.items()))
+
+
+def new_episode_seed(seed_sequence):
+    # Every episode gets its own seed, so that it can be replayed from (episode seed, actions) alone
+    return int(seed_sequence.spawn(1)[0].generate_state(1, np.uint64)[0])
+
+
+def shuffle_wonders(rng, catalog):
+    wonder_ids = list(range(len(catalog.wonders)))
+    rng.shuffle(wonder_ids)
+    return wonder_ids
+
+
+def deal_wonder_sides(rng, player_count, wonder_side='A'):
+    # 'A' or 'B' for every seat, or 'random' to draw the side of each seat
+    if wonder_side == 'random':
+        return ['AB'[side] for side in rng.integers(2, size=player_count)]
+    if wonder_side not in ('A', 'B'):
+        raise ValueError('unknown wonder side %s' % wonder_side)
+    return [wonder_side] * player_count
+
+
+def shuffle_age_structures(rng, catalog, age, player_count):
+    structures = list(catalog.age_structures(age, player_count))
+
+    if age == 3:
+        guilds = list(catalog.guild_ids)
+        rng.shuffle(guilds)
+        structures.extend(guilds[:player_count + 2])
+
+    rng.shuffle(structures)
+    return [structures[i::player_count] for i in range(player_count)]
+
+
+def episode_deals(catalog, player_count, episode_seed, wonder_side='A'):
+    # The wonders, their sides and the age decks a GameEnvironment deals from an episode seed, in the order it draws
+    # them
+    rng = np.random.default_rng(episode_seed)
+    wonder_ids = shuffle_wonders(rng, catalog)[:player_count]
+    sides = deal_wonder_sides(rng, player_count, wonder_side)
+    decks = [shuffle_age_structures(rng, catalog, age, player_count) for age in (1, 2, 3)]
+    return wonder_ids, sides, decks
+
+
+def replay_episode(env, episode_seed, actions):
+    # Regenerates the time steps of a recorded episode (env.episode_seed, env.episode_actions)
+    env.next_episode_seed = episode_seed
+    time_steps = [copy_time_step(env.reset())]
+    for action in actions:
+        time_steps.append(copy_time_step(env.step(action)))
+    return time_steps
 
 
 class GameEnvironment(py_environment.PyEnvironment):
+    # Observations are written into the same buffers every step, callers keeping one past the next step copy it.
+    # With observe=False the time steps carry no observation, to_observation() builds it on request.
+    # board_observations adds players_board, the Player.board of every seat in seat_order.
+    # wonder_side is the side of every wonder, 'A', 'B' or 'random'.
 
-    def __init__(self, player_count=7):
+    def __init__(self, player_count=7, seed=None, observe=True, board_observations=False, wonder_side='A'):
         super().__init__()
 
+        self.catalog = load_catalog()
         self.player_count = player_count
+        self.observe = observe
+        self.wonder_side = wonder_side
+        self.boards = None
+        if board_observations:
+            self.boards = np.zeros((player_count, board_length(self.catalog)), dtype=np.float32)
         self.current_player_index = 0
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.next_episode_seed = None
+        self.start_episode()
 
         self.age = 1
         self.turn = 1
@@ -37,37 +256,51 @@ class GameEnvironment(py_environment.PyEnvironment):
         self.current_player_scores = [0 for _ in range(self.player_count)]
         self.player_decks = self.shuffle_age_structures()
         self.player_deck_offset = 0
-        self.discarded_structures = []
+        # Discard pile, the number of copies of every structure id
+        self.discarded_structures = np.zeros(len(self.catalog.structures), dtype=np.int32)
         self._episode_ended = False
+        self.hand_structure_ids = np.full(player_hand_size, -1, dtype=np.int64)
 
-        # noinspection PyTypeChecker
-        self._action_spec = [
-            array_spec.BoundedArraySpec(
-                shape=(), dtype=np.int32, minimum=0, maximum=len(Action) - 1, name='action'),
-            array_spec.BoundedArraySpec(
-                shape=(), dtype=np.int32, minimum=0, maximum=player_hand_size - 1, name='card')
-        ]
+        self._action_spec = array_spec.BoundedArraySpec(
+            shape=(), dtype=np.int32, minimum=0, maximum=action_count - 1, name='action')
         self._observation_spec = {
             'age': array_spec.ArraySpec((), np.float32),
             'turn': array_spec.ArraySpec((), np.float32),
             'players_coins': array_spec.ArraySpec((self.player_count,), np.float32),
             'player_hand': array_spec.ArraySpec((player_hand_size, card_observation_length), np.float32),
+            'legal_actions': array_spec.BoundedArraySpec((action_count,), np.float32, minimum=0, maximum=1),
+            'action_costs': array_spec.ArraySpec((action_count,), np.float32),
         }
-
-    def to_observation(self):
-        observation = {
-            'age': np.float32(self.age),
-            'turn': np.float32(self.turn),
-            'players_coins': np.array(self.players_coins(), dtype=np.float32),
-            # 'player_hand': []
-        }
-
-        player_hand = []
-        for card in self.player_deck(self.current_player_index):
-            player_hand.append(self.card_to_observation(card))
-        while len(player_hand) < player_hand_size:
-            player_hand.append(np.zeros(card_observation_length, dtype=np.float32))
-        observation['player_hand'] = np.array(player_hand)
+        if self.boards is not None:
+            self._observation_spec['players_board'] = array_spec.ArraySpec(self.boards.shape, np.float32)
+        self.observation = observation_buffers(self.observation_spec(), self.observation_batch_shape())
+
+    def observation_batch_shape(self):
+        return ()
+
+    def step_observation(self):
+        return self.to_observation() if self.observe else None
+
+    def to_observation(self, out=None):
+        # Writes into out, or the buffers of the environment, and returns it
+        observation = self.observation if out is None else out
+        observation['age'][...] = self.age
+        observation['turn'][...] = self.turn
+        players_coins = observation['players_coins']
+        for player_index, player in enumerate(self.players):
+            players_coins[player_index] = player.coins
+
+        player_deck = self.player_deck(self.current_player_index)
+        self.hand_structure_ids[:len(player_deck)] = player_deck
+        self.hand_structure_ids[len(player_deck):] = -1
+        np.take(self.catalog.structure_features, self.hand_structure_ids, axis=0, out=observation['player_hand'])
+
+        hand = [self.catalog.structures[structure_id] for structure_id in player_deck]
+        legal_actions(self.players[self.current_player_index], hand, observation['legal_actions'],
+                      observation['action_costs'])
+        if self.boards is not None:
+            np.take(self.boards, seat_order(self.current_player_index, self.player_count), axis=0,
+                    out=observation['players_board'])
 
         return observation
 
@@ -77,24 +310,9 @@ class GameEnvironment(py_environment.PyEnvironment):
             player_coins.append(player.coins)
         return player_coins
 
-    # noinspection PyTypeChecker
     @staticmethod
     def card_to_observation(card):
-        # type (7), gold, resources (7), production (7), points, military, science (3)
-        observation = []
-        observation.extend(to_categorical(card['type'].value, num_classes=len(Type)))
-        observation.append(card['cost']['gold'])
-        for resource in Resource:
-            if resource.name in card['cost']['resources']:
-                observation.append(card['cost']['resources'][resource.name])
-            else:
-                observation.append(0)
-        for resource in Resource:
-            if resource.name in card['cost']['resources']:
-                observation.append(card['cost']['resources'][resource.name])
-            else:
-                observation.append(0)
-        return np.array(observation, dtype=np.float32)
+        return load_catalog().structure_features[card['id']]
 
     def action_spec(self):
         return self._action_spec
@@ -102,49 +320,66 @@ class GameEnvironment(py_environment.PyEnvironment):
     def observation_spec(self):
         return self._observation_spec
 
+    def snapshot(self):
+        return (self.age, self.turn, self.current_player_index, self.player_deck_offset,
+                tuple(tuple(player_deck) for player_deck in self.player_decks), self.discarded_structures.tobytes(),
+                tuple(self.current_player_scores), self._episode_ended,
+                tuple(player.snapshot() for player in self.players), self.random.bit_generator.state,
+                len(self.episode_actions))
+
+    def restore(self, snapshot):
+        (self.age, self.turn, self.current_player_index, self.player_deck_offset, player_decks,
+         discarded_structures, current_player_scores, self._episode_ended, players, random_state,
+         episode_action_count) = snapshot
+        self.random.bit_generator.state = random_state
+        del self.episode_actions[episode_action_count:]
+        self.player_decks = [list(player_deck) for player_deck in player_decks]
+        self.discarded_structures[:] = np.frombuffer(discarded_structures, dtype=self.discarded_structures.dtype)
+        self.current_player_scores = list(current_player_scores)
+        for player, player_snapshot in zip(self.players, players):
+            player.restore(player_snapshot)
+
+    def get_state(self):
+        return self.snapshot()
+
+    def set_state(self, state):
+        self.restore(state)
+
     def _reset(self):
+        self.new_game()
+        return time_step.restart(self.step_observation())
+
+    def start_episode(self):
+        if self.next_episode_seed is not None:
+            self.episode_seed = self.next_episode_seed
+            self.next_episode_seed = None
+        else:
+            self.episode_seed = new_episode_seed(self.seed_sequence)
+        self.random = np.random.default_rng(self.episode_seed)
+        self.episode_actions = []
+
+    def new_game(self):
+        self.start_episode()
         self.age = 1
         self.turn = 1
+        self.current_player_index = 0
+        self.current_player_scores = [0 for _ in range(self.player_count)]
         self.players = self.create_players()
         self.player_decks = self.shuffle_age_structures()
         self.player_deck_offset = 0
-        self.discarded_structures = []
+        self.discarded_structures.fill(0)
         self._episode_ended = False
-        return time_step.restart(self.to_observation())
 
-    def _step(self, player_actions):
+    def _step(self, action):
         if self._episode_ended:
             # print("game already ended resetting")
             return self.reset()
 
         player_index = self.current_player_index
+        player_action, structure_index = split_action(int(action))
+        success_reward_modifier = self.play(Action(player_action), structure_index)
 
-        player_action = Action(int(player_actions[0]))
-        structure_index = int(player_actions[1])
-
-        player = self.players[player_index]
-        player_deck = self.player_deck(player_index)
-
-        success_reward_modifier = 0
-        if structure_index >= len(player_deck):
-            structure_index = len(player_deck) - 1
-
-        structure = player_deck.pop(structure_index)
-        try:
-            if player_action == Action.BUILD_STRUCTURE:
-                player.build_structure(structure)
-            elif player_action == Action.BUILD_WONDER_STAGE:
-                player.build_wonder_stage()
-            elif player_action == Action.DISCARD:
-                player.discard_structure()
-            # print("Player " + str(player_index) + " choose to " + player_action.name + " " + structure['name'])
-        except ImpossibleBuildException:
-            player.discard_structure()
-            success_reward_modifier = -3
-
-        self.finish_player_turn()
-
-        observation = self.to_observation()
+        observation = self.step_observation()
         reward = self.calculate_score_difference(player_index) + success_reward_modifier
 
         if self._episode_ended:
@@ -155,21 +390,43 @@ class GameEnvironment(py_environment.PyEnvironment):
             #      + " turn " + str(self.turn) + " age " + str(self.age) + " reward " + str(reward))
             return time_step.transition(observation, reward)
 
+    def play(self, player_action, structure_index):
+        player = self.players[self.current_player_index]
+        player_deck = self.player_deck(self.current_player_index)
+
+        if structure_index >= len(player_deck):
+            structure_index = len(player_deck) - 1
+
+        self.episode_actions.append(action_index(player_action.value, structure_index))
+        structure = self.catalog.structures[player_deck.pop(structure_index)]
+        # print("Player " + str(self.current_player_index) + " choose to " + player_action.name + " " + structure['name'])
+        success_reward_modifier = resolve_action(player, player_action, structure)
+        if discards(player_action, success_reward_modifier):
+            self.discarded_structures[structure['id']] += 1
+
+        self.finish_player_turn()
+        return success_reward_modifier
+
     def finish_player_turn(self):
         self.current_player_index = (self.current_player_index + 1) % self.player_count
         if self.current_player_index == 0:
             self.finish_turn()
 
-        if self.turn == 7:
-            self.finish_age()
-
         if self.age == 4:
             self._episode_ended = True
 
     def finish_turn(self):
         self.turn += 1
+        if self.turn == 7:
+            self.finish_age()
+        else:
+            resolve_discarded_plays(self.players, self.discarded_structures, self.catalog)
 
     def finish_age(self):
+        finish_age_hands(self.players, [self.player_deck(player_index) for player_index in range(self.player_count)],
+                         self.discarded_structures, self.catalog)
+        # The plays of the last turn choose among the structures discarded at the end of the age too
+        resolve_discarded_plays(self.players, self.discarded_structures, self.catalog)
         self.age += 1
         self.turn = 1
 
@@ -182,17 +439,16 @@ class GameEnvironment(py_environment.PyEnvironment):
             self.player_deck_offset += 1
 
         for player in self.players:
-            player.resolve_military_conflicts(self.age)
+            player.finish_age(self.age)
 
     def create_players(self):
-        with open(path.join(path.dirname(__file__), 'game-data/wonders.json')) as wonders_data_file:
-            wonders = json.load(wonders_data_file, cls=GameDataJsonDecoder)
-        random.shuffle(wonders)
+        wonder_ids = shuffle_wonders(self.random, self.catalog)
+        sides = deal_wonder_sides(self.random, self.player_count, self.wonder_side)
 
         players = []
         for i in range(self.player_count):
-            # TODO choose A or B
-            player = Player(wonders[i]['sides']['A'])
+            player = Player(self.catalog.wonder_side(wonder_ids[i], sides[i]),
+                            None if self.boards is None else self.boards[i])
             players.append(player)
         for i in range(len(players)):
             players[i].with_neighbor(players[i - 1], players[(i + 1) % self.player_count])
@@ -200,20 +456,7 @@ class GameEnvironment(py_environment.PyEnvironment):
         return players
 
     def shuffle_age_structures(self):
-        with open(path.join(path.dirname(__file__),
-                            'game-data/age-' + str(self.age) + '-structures.json')) as structures_data_file:
-            structures = [s for s in json.load(structures_data_file, cls=GameDataJsonDecoder) if s['minPlayerCount'] <= self.player_count]
-
-        if self.age == 3:
-            with open(path.join(path.dirname(__file__),
-                                'game-data/guild-structures.json')) as guilds_data_file:
-                guilds = json.load(guilds_data_file, cls=GameDataJsonDecoder)
-
-            random.shuffle(guilds)
-            structures.extend(guilds[:self.player_count + 2])
-
-        random.shuffle(structures)
-        return [structures[i::self.player_count] for i in range(self.player_count)]
+        return shuffle_age_structures(self.random, self.catalog, self.age, self.player_count)
 
     def player_deck(self, player_index):
         if self.age > 3:
@@ -226,3 +469,133 @@ class GameEnvironment(py_environment.PyEnvironment):
         reward = new_player_score - self.current_player_scores[player_index]
         self.current_player_scores[player_index] = new_player_score
         return reward
+
+
+class SimultaneousGameEnvironment(GameEnvironment):
+    # Every seat plays one action per step as in the real game: the environment is batched over the seats, so one
+    # forward pass of the policy acts for the whole table and an episode takes 18 steps instead of 18 * player_count.
+    # Hands are rows of an array of structure ids and are passed to the neighbors with one rotation per turn.
+
+    def __init__(self, player_count=7, seed=None, observe=True, board_observations=False, wonder_side='A'):
+        self.hands = np.full((player_count, player_hand_size), -1, dtype=np.int64)
+        self.hand_sizes = np.zeros(player_count, dtype=np.int64)
+        self.seat_orders = seat_order(np.arange(player_count)[:, None], player_count)
+        super().__init__(player_count, seed, observe, board_observations, wonder_side)
+        self.deal_age_structures()
+
+    @property
+    def batched(self):
+        return True
+
+    @property
+    def batch_size(self):
+        return self.player_count
+
+    def observation_batch_shape(self):
+        return (self.player_count,)
+
+    def to_observation(self, out=None):
+        observation = self.observation if out is None else out
+        mask = observation['legal_actions']
+        costs = observation['action_costs']
+        for player_index, player in enumerate(self.players):
+            hand = [self.catalog.structures[structure_id] for structure_id in self.player_deck(player_index)]
+            legal_actions(player, hand, mask[player_index], costs[player_index])
+
+        observation['age'][:] = self.age
+        observation['turn'][:] = self.turn
+        observation['players_coins'][:] = self.players_coins()
+        np.take(self.catalog.structure_features, self.hands, axis=0, out=observation['player_hand'])
+        if self.boards is not None:
+            np.take(self.boards, self.seat_orders, axis=0, out=observation['players_board'])
+        return observation
+
+    def snapshot(self):
+        return super().snapshot(), self.hands.tobytes(), tuple(self.hand_sizes)
+
+    def restore(self, snapshot):
+        snapshot, hands, hand_sizes = snapshot
+        super().restore(snapshot)
+        self.hands[:] = np.frombuffer(hands, dtype=self.hands.dtype).reshape(self.hands.shape)
+        self.hand_sizes[:] = hand_sizes
+
+    def _reset(self):
+        self.new_game()
+        return time_step.restart(self.step_observation(), batch_size=self.player_count)
+
+    def new_game(self):
+        super().new_game()
+        self.deal_age_structures()
+
+    def _step(self, action):
+        if self._episode_ended:
+            return self.reset()
+
+        action = np.asarray(action, dtype=np.int32).reshape(self.player_count)
+        actions, structure_indexes = split_action(action)
+        self.episode_actions.append(action.tolist())
+
+        # Every seat picks from the hand it held at the start of the turn before any structure is resolved
+        structures = [self.catalog.structures[self.take_structure(player_index, structure_indexes[player_index])]
+                      for player_index in range(self.player_count)]
+
+        player_actions = [Action(int(action)) for action in actions]
+        rewards = np.array(resolve_simultaneous_actions(self.players, player_actions, structures), dtype=np.float32)
+        for player_action, structure, reward in zip(player_actions, structures, rewards):
+            if discards(player_action, reward):
+                self.discarded_structures[structure['id']] += 1
+
+        self.finish_turn()
+        for player_index in range(self.player_count):
+            rewards[player_index] += self.calculate_score_difference(player_index)
+
+        step_type = time_step.StepType.LAST if self._episode_ended else time_step.StepType.MID
+        return time_step.TimeStep(
+            np.full(self.player_count, step_type, dtype=np.int32),
+            rewards,
+            np.full(self.player_count, 0 if self._episode_ended else 1, dtype=np.float32),
+            self.step_observation())
+
+    def take_structure(self, player_index, structure_index):
+        hand = self.hands[player_index]
+        hand_size = self.hand_sizes[player_index]
+        structure_index = min(structure_index, hand_size - 1)
+        structure_id = hand[structure_index]
+        hand[structure_index:hand_size - 1] = hand[structure_index + 1:hand_size]
+        hand[hand_size - 1] = -1
+        self.hand_sizes[player_index] -= 1
+        return structure_id
+
+    def finish_turn(self):
+        self.turn += 1
+        if self.turn == 7:
+            self.finish_age()
+            if self.age == 4:
+                self._episode_ended = True
+        else:
+            resolve_discarded_plays(self.players, self.discarded_structures, self.catalog)
+            self.pass_hands()
+
+    def pass_hands(self):
+        # Ages 1 and 3 pass to the left neighbor (player_index - 1), age 2 to the right one
+        shift = 1 if self.age == 2 else -1
+        self.hands = np.roll(self.hands, shift, axis=0)
+        self.hand_sizes = np.roll(self.hand_sizes, shift)
+
+    def finish_age(self):
+        super().finish_age()
+        self.player_deck_offset = 0
+        if self.age <= 3:
+            self.deal_age_structures()
+
+    def deal_age_structures(self):
+        self.hands[:] = -1
+        for player_index, player_deck in enumerate(self.player_decks):
+            self.hands[player_index, :len(player_deck)] = player_deck
+            self.hand_sizes[player_index] = len(player_deck)
+
+    def player_deck(self, player_index):
+        if self.age > 3:
+            return []
+
+        return list(self.hands[player_index, :self.hand_sizes[player_index]])
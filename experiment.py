@@ -0,0 +1,490 @@
+import functools
+import json
+import os
+import time
+
+from absl import logging
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.agents.ppo import ppo_agent
+from tf_agents.drivers import dynamic_episode_driver
+from tf_agents.environments import tf_py_environment
+from tf_agents.eval import metric_utils
+from tf_agents.metrics import tf_metrics
+from tf_agents.networks import actor_distribution_network, value_network
+from tf_agents.policies import policy_saver
+from tf_agents.replay_buffers import tf_uniform_replay_buffer
+from tf_agents.utils import common
+
+from batched_environment import BatchedGameEnvironment
+from checkpointing import AsyncCheckpointer, PolicyPublisher, latest_policy
+from collector import SelfPlayCollector
+from distributed import DistributedCollector, QueueLearnerTransport, TcpLearnerTransport
+from environment import GameEnvironment
+from policies import HeuristicPolicy, MlpPolicy, RandomPolicy
+import profiling
+from tournament import SavedPolicy, Tournament
+
+default_config = {
+    # Names the run in the results and, unless root_dir is set, its log directory logs/<name>
+    'name': 'default',
+    'root_dir': None,
+    'number_of_players': 3,
+    # Adds players_board, the productions, military, wonder stages, science and built structures of every seat
+    'board_observations': False,
+    # Side of the wonder boards, 'A', 'B' or 'random'
+    'wonder_side': 'A',
+    'actor_fc_layers': (200, 100),
+    'value_fc_layers': (200, 100),
+    # Params for collect
+    'num_environment_steps': 25000000,
+    # Stops after this many iterations even if num_environment_steps are not reached, for throughput sweeps
+    'num_iterations': None,
+    'collect_episodes_per_iteration': 30,
+    'num_parallel_environments': 8,
+    # > 0 collects in worker processes with SelfPlayCollector, overlapping collection with training
+    'num_collect_workers': 0,
+    'envs_per_collect_worker': 4,
+    # > 0 evaluates the policy of all collect workers on one inference server, in batches of up to this many games
+    'collect_inference_batch_size': 0,
+    # 'tcp' or 'queue' collects with num_collect_workers actor processes of DistributedCollector instead. With 'tcp'
+    # more actors can join: python distributed.py --address host:port --token token. Listening on other hosts than
+    # 127.0.0.1 lets remote actors join, unencrypted, trusted networks only. A None token is generated and logged
+    'distributed_transport': None,
+    'distributed_address': ('127.0.0.1', 7777),
+    'distributed_token': None,
+    'replay_buffer_capacity': 1001,  # Per-environment
+    # Params for train
+    'num_epochs': 25,
+    'learning_rate': 1e-3,
+    # Params for eval, 0 episodes disables it
+    'num_eval_episodes': 30,
+    'eval_interval': 500,
+    # Params for summaries and logging
+    # Checkpoints and policy versions are written in the background, training goes on meanwhile
+    'train_checkpoint_interval': 500,
+    'policy_checkpoint_interval': 500,
+    'train_checkpoints_to_keep': 3,
+    # None keeps every policy version, the league plays against all of them
+    'policy_versions_to_keep': None,
+    'log_interval': 50,
+    'summary_interval': 50,
+    'summaries_flush_secs': 1,
+    'use_tf_functions': True,
+    # Timers around the environment, rules and policy hot paths, written with the train summaries every log_interval
+    'profile': False,
+    # (first, last) iteration to record with the TensorFlow profiler, or None
+    'profile_iterations': None,
+    # Every tournament_interval steps the saved policy joins a league against the scripted baselines and earlier
+    # policies, played by tournament_workers background processes (0 disables)
+    'tournament_interval': 0,
+    'tournament_games': 300,
+    'tournament_workers': 1,
+    'debug_summaries': False,
+    'summarize_grads_and_vars': False,
+}
+
+
+def make_config(overrides=None):
+    config = dict(default_config)
+    for key, value in (overrides or {}).items():
+        if key not in config:
+            raise ValueError('unknown config key %s' % key)
+        config[key] = value
+    if config['root_dir'] is None:
+        default_name = config['name'] == default_config['name']
+        config['root_dir'] = 'logs' if default_name else os.path.join('logs', config['name'])
+    return config
+
+
+def load_configs(path, overrides=None):
+    # A JSON object of overrides, or a list of them run one after the other. overrides apply to all of them. Unnamed
+    # configs of a list are named after their index, every run logs to its own directory.
+    with open(path) as file:
+        data = json.load(file)
+    if not isinstance(data, list):
+        return [make_config(dict(data, **(overrides or {})))]
+    configs = []
+    for index, config in enumerate(data):
+        config = dict(config, **(overrides or {}))
+        config.setdefault('name', '%s-%d' % (default_config['name'], index))
+        configs.append(make_config(config))
+    return configs
+
+
+def parse_overrides(assignments):
+    # key=value pairs of the command line, values in JSON and plain strings otherwise
+    overrides = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition('=')
+        if not separator:
+            raise ValueError('expected key=value, got %s' % assignment)
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def preprocessing_layers(prefix, board_observations):
+    player_hand = tf.keras.Sequential(name=prefix + '/player_hand')
+    player_hand.add(tf.keras.layers.Flatten(name=prefix + '/player_hand/flatten'))
+    layers = {
+        'age': tf.keras.layers.Reshape((1,), name=prefix + '/age'),
+        'turn': tf.keras.layers.Reshape((1,), name=prefix + '/turn'),
+        'players_coins': tf.keras.layers.Flatten(name=prefix + '/players_coins'),
+        'player_hand': player_hand,
+        'legal_actions': tf.keras.layers.Flatten(name=prefix + '/legal_actions'),
+        'action_costs': tf.keras.layers.Flatten(name=prefix + '/action_costs')
+    }
+    if board_observations:
+        layers['players_board'] = tf.keras.layers.Flatten(name=prefix + '/players_board')
+    return layers
+
+
+class MaskedActorNetwork(actor_distribution_network.ActorDistributionNetwork):
+    # PPOAgent takes no observation_and_action_constraint_splitter, so the actor masks its own logits with the
+    # legal_actions observation: illegal actions get the lowest logit and are never sampled
+
+    def call(self, observations, step_type, network_state, training=False, mask=None):
+        if mask is None:
+            mask = tf.cast(observations['legal_actions'], tf.bool)
+        return super().call(observations, step_type, network_state, training=training, mask=mask)
+
+
+class Experiment:
+    # Environments, networks, PPO agent, drivers and metrics of one config. Several experiments run one after the
+    # other in a process share the imports and the game caches, each has its own global step and log directory.
+
+    def __init__(self, config):
+        # config as returned by make_config
+        self.config = config
+        build_start_time = time.time()
+        self.train_dir = os.path.join(config['root_dir'], 'train')
+        self.eval_dir = os.path.join(config['root_dir'], 'eval')
+        self.saved_model_dir = os.path.join(config['root_dir'], 'policy_saved_model')
+        player_count = config['number_of_players']
+        batch_size = config['num_parallel_environments']
+
+        self.train_summary_writer = tf.compat.v2.summary.create_file_writer(
+            self.train_dir, flush_millis=config['summaries_flush_secs'] * 1000)
+        self.eval_summary_writer = tf.compat.v2.summary.create_file_writer(
+            self.eval_dir, flush_millis=config['summaries_flush_secs'] * 1000)
+        self.eval_metrics = [
+            tf_metrics.AverageReturnMetric(buffer_size=max(config['num_eval_episodes'], 1)),
+            tf_metrics.AverageEpisodeLengthMetric(buffer_size=max(config['num_eval_episodes'], 1))
+        ]
+
+        self.global_step = tf.Variable(0, dtype=tf.int64, name='global_step')
+        self.eval_tf_env = tf_py_environment.TFPyEnvironment(
+            GameEnvironment(player_count, board_observations=config['board_observations'],
+                            wonder_side=config['wonder_side']))
+        self.tf_env = tf_py_environment.TFPyEnvironment(
+            BatchedGameEnvironment(batch_size, player_count, board_observations=config['board_observations'],
+                                   wonder_side=config['wonder_side']))
+        optimizer = tf.compat.v1.train.AdamOptimizer(learning_rate=config['learning_rate'])
+
+        self.actor_net = MaskedActorNetwork(
+            self.tf_env.observation_spec(),
+            self.tf_env.action_spec(),
+            fc_layer_params=tuple(config['actor_fc_layers']),
+            activation_fn=tf.keras.activations.tanh,
+            preprocessing_layers=preprocessing_layers('actor', config['board_observations']),
+            preprocessing_combiner=tf.keras.layers.Concatenate(axis=-1))
+        value_net = value_network.ValueNetwork(
+            self.tf_env.observation_spec(),
+            fc_layer_params=tuple(config['value_fc_layers']),
+            activation_fn=tf.keras.activations.tanh,
+            preprocessing_layers=preprocessing_layers('value', config['board_observations']),
+            preprocessing_combiner=tf.keras.layers.Concatenate(axis=-1))
+
+        self.tf_agent = ppo_agent.PPOAgent(
+            self.tf_env.time_step_spec(),
+            self.tf_env.action_spec(),
+            optimizer,
+            actor_net=self.actor_net,
+            value_net=value_net,
+            entropy_regularization=0.0,
+            importance_ratio_clipping=0.2,
+            normalize_observations=False,
+            normalize_rewards=False,
+            use_gae=True,
+            num_epochs=config['num_epochs'],
+            debug_summaries=config['debug_summaries'],
+            summarize_grads_and_vars=config['summarize_grads_and_vars'],
+            train_step_counter=self.global_step)
+        self.tf_agent.initialize()
+
+        self.environment_steps_metric = tf_metrics.EnvironmentSteps()
+        self.number_of_episodes_metric = tf_metrics.NumberOfEpisodes()
+        self.average_return_metric = tf_metrics.AverageReturnMetric(batch_size=batch_size)
+        self.average_episode_length_metric = tf_metrics.AverageEpisodeLengthMetric(batch_size=batch_size)
+        self.step_metrics = [
+            self.number_of_episodes_metric,
+            self.environment_steps_metric,
+        ]
+        self.train_metrics = self.step_metrics + [
+            self.average_return_metric,
+            self.average_episode_length_metric,
+        ]
+
+        self.eval_policy = self.tf_agent.policy
+        self.replay_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
+            self.tf_agent.collect_data_spec,
+            batch_size=batch_size,
+            max_length=config['replay_buffer_capacity'])
+
+        self.train_checkpointer = AsyncCheckpointer(
+            ckpt_dir=self.train_dir,
+            max_to_keep=config['train_checkpoints_to_keep'],
+            agent=self.tf_agent,
+            global_step=self.global_step,
+            metrics=metric_utils.MetricsGroup(self.train_metrics, 'train_metrics'))
+        self.policy_checkpointer = AsyncCheckpointer(
+            ckpt_dir=os.path.join(self.train_dir, 'policy'),
+            max_to_keep=config['train_checkpoints_to_keep'],
+            policy=self.eval_policy,
+            global_step=self.global_step)
+        saved_model = policy_saver.PolicySaver(self.eval_policy, train_step=self.global_step)
+
+        self.train_checkpointer.initialize_or_restore()
+        self.policy_publisher = PolicyPublisher(saved_model, self.saved_model_dir, self.global_step,
+                                                config['policy_versions_to_keep'])
+
+        self.collect_driver = dynamic_episode_driver.DynamicEpisodeDriver(
+            self.tf_env,
+            self.tf_agent.collect_policy,
+            observers=[self.replay_buffer.add_batch] + self.train_metrics,
+            num_episodes=config['collect_episodes_per_iteration'])
+        self.train_step = self.gather_and_train
+        self.train = self.tf_agent.train
+        if config['use_tf_functions']:
+            self.collect_driver.run = common.function(self.collect_driver.run, autograph=False)
+            self.train = common.function(self.tf_agent.train, autograph=False)
+            self.train_step = common.function(self.gather_and_train)
+
+        self.collector = None
+        self.tournament = None
+        self.build_seconds = time.time() - build_start_time
+
+    def gather_and_train(self):
+        return self.train(experience=self.replay_buffer.gather_all())
+
+    def train_on_episodes(self, episodes):
+        # The collectors return numpy arrays, train takes tensors whether or not it is a tf function
+        experience = tf.nest.map_structure(tf.convert_to_tensor, SelfPlayCollector.to_trajectory(episodes))
+        return self.train(experience=experience)
+
+    def observe_episodes(self, episodes):
+        # The collectors return whole episodes, they go to the train metrics at once rather than step by step as the
+        # collect driver observers see them. The last trajectory of an episode is the boundary to the next one.
+        episode_count, length = episodes['reward'].shape
+        self.environment_steps_metric.environment_steps.assign_add(episode_count * (length - 1))
+        self.number_of_episodes_metric.number_episodes.assign_add(episode_count)
+        self.average_return_metric._buffer.extend(np.sum(episodes['reward'], axis=1))
+        self.average_episode_length_metric._buffer.extend(np.full(episode_count, length - 1, dtype=np.float32))
+
+    def start_collector(self):
+        config = self.config
+        weights = self.actor_net.get_weights()
+        # The workers write their own stats next to the profile_stats.json of the learner
+        profile_dir = self.train_dir if config['profile'] else None
+        if config['distributed_transport'] is not None:
+            if config['distributed_transport'] == 'tcp':
+                host, port = config['distributed_address']
+                transport = TcpLearnerTransport(host, port, token=config['distributed_token'])
+                logging.info('Actors join with: python distributed.py --address %s:%d --token %s',
+                             host, transport.address[1], transport.token)
+            else:
+                transport = QueueLearnerTransport([w.shape for w in weights])
+            self.collector = DistributedCollector(
+                transport, MlpPolicy, config['number_of_players'], config['num_collect_workers'],
+                config['envs_per_collect_worker'], board_observations=config['board_observations'],
+                wonder_side=config['wonder_side'], profile_dir=profile_dir)
+            self.collector.start(weights)
+        elif config['num_collect_workers'] > 0:
+            self.collector = SelfPlayCollector(
+                MlpPolicy, [w.shape for w in weights], config['number_of_players'], config['num_collect_workers'],
+                config['envs_per_collect_worker'], inference_batch_size=config['collect_inference_batch_size'],
+                board_observations=config['board_observations'], wonder_side=config['wonder_side'],
+                profile_dir=profile_dir)
+            self.collector.start(weights)
+
+    def evaluate(self):
+        if self.config['num_eval_episodes'] > 0:
+            metric_utils.eager_compute(
+                self.eval_metrics,
+                self.eval_tf_env,
+                self.eval_policy,
+                num_episodes=self.config['num_eval_episodes'],
+                train_step=self.global_step,
+                summary_writer=self.eval_summary_writer,
+                summary_prefix='Metrics',
+            )
+
+    def run(self):
+        # Trains until num_environment_steps or num_iterations, returns the throughput of the run
+        config = self.config
+        global_step = self.global_step
+        self.train_summary_writer.set_as_default()
+        self.start_collector()
+        if config['tournament_interval'] > 0:
+            self.tournament = Tournament(config['number_of_players'], config['tournament_workers'],
+                                         board_observations=config['board_observations'],
+                                         wonder_side=config['wonder_side'])
+            self.tournament.add_entrant('random', RandomPolicy)
+            self.tournament.add_entrant('heuristic', HeuristicPolicy)
+        if config['profile']:
+            profiling.enable()
+        profiler_window = None
+        if config['profile_iterations'] is not None:
+            profiler_window = profiling.ProfilerWindow(
+                os.path.join(self.train_dir, 'profile'), config['profile_iterations'][0],
+                config['profile_iterations'][1] + 1)
+
+        collect_time = 0
+        train_time = 0
+        total_collect_time = 0
+        total_train_time = 0
+        timed_at_step = global_step.numpy()
+        first_step = global_step.numpy()
+        first_environment_steps = int(self.environment_steps_metric.result())
+        iteration = 0
+
+        with tf.compat.v2.summary.record_if(lambda: tf.math.equal(global_step % config['summary_interval'], 0)):
+            while (self.environment_steps_metric.result() < config['num_environment_steps']
+                   and (config['num_iterations'] is None or iteration < config['num_iterations'])):
+                global_step_val = global_step.numpy()
+                if profiler_window is not None:
+                    profiler_window.step(iteration)
+                iteration += 1
+                if global_step_val % config['eval_interval'] == 0:
+                    self.evaluate()
+                if self.tournament is not None and global_step_val % config['tournament_interval'] == 0:
+                    # The latest version whose write has completed
+                    saved_model_path, checkpoint_path = latest_policy(self.saved_model_dir)
+                    name = None if checkpoint_path is None else os.path.basename(checkpoint_path)
+                    if name is not None and name not in self.tournament.entrants:
+                        self.tournament.add_entrant(
+                            name, functools.partial(SavedPolicy, saved_model_path, checkpoint_path))
+                        self.tournament.submit(config['tournament_games'])
+
+                start_time = time.time()
+                if self.collector is None:
+                    self.collect_driver.run()
+                else:
+                    episodes = self.collector.collect(config['collect_episodes_per_iteration'])
+                    self.observe_episodes(episodes)
+                collect_time += time.time() - start_time
+                profiling.record('collect', time.time() - start_time)
+
+                start_time = time.time()
+                if self.collector is None:
+                    total_loss, _ = self.train_step()
+                    self.replay_buffer.clear()
+                else:
+                    total_loss, _ = self.train_on_episodes(episodes)
+                    self.collector.publish(self.actor_net.get_weights())
+                train_time += time.time() - start_time
+                profiling.record('train', time.time() - start_time)
+
+                for train_metric in self.train_metrics:
+                    train_metric.tf_summaries(train_step=global_step, step_metrics=self.step_metrics)
+
+                if global_step_val % config['log_interval'] == 0:
+                    logging.info('step = %d, loss = %f', global_step_val, total_loss)
+                    steps_per_sec = (global_step_val - timed_at_step) / (collect_time + train_time)
+                    logging.info('%.3f steps/sec', steps_per_sec)
+                    logging.info('collect_time = %.3f, train_time = %.3f', collect_time, train_time)
+                    if self.collector is not None:
+                        logging.info('average_return = %.3f, policy_lag = %.2f',
+                                     SelfPlayCollector.average_return(episodes), self.collector.last_policy_lag)
+                    with tf.compat.v2.summary.record_if(True):
+                        tf.compat.v2.summary.scalar(name='global_steps_per_sec', data=steps_per_sec, step=global_step)
+                    if profiling.enabled:
+                        profiling.write_summaries(global_step)
+                        profiling.dump(os.path.join(self.train_dir, 'profile_stats.json'))
+                        profiling.reset()
+                    if self.tournament is not None:
+                        self.tournament.poll()
+                        with self.eval_summary_writer.as_default(), tf.compat.v2.summary.record_if(True):
+                            for name, rating in self.tournament.ratings().items():
+                                tf.compat.v2.summary.scalar(name='League/elo/' + name, data=rating, step=global_step)
+
+                    if global_step_val % config['train_checkpoint_interval'] == 0:
+                        self.train_checkpointer.save(global_step=global_step_val)
+
+                    if global_step_val % config['policy_checkpoint_interval'] == 0:
+                        self.policy_checkpointer.save(global_step=global_step_val)
+                        self.policy_publisher.publish(global_step_val)
+
+                    timed_at_step = global_step_val
+                    total_collect_time += collect_time
+                    total_train_time += train_time
+                    collect_time = 0
+                    train_time = 0
+
+        total_collect_time += collect_time
+        total_train_time += train_time
+        if profiler_window is not None:
+            profiler_window.close()
+        if config['profile']:
+            profiling.disable()
+
+        seconds = total_collect_time + total_train_time
+        train_steps = int(global_step.numpy() - first_step)
+        environment_steps = int(self.environment_steps_metric.result()) - first_environment_steps
+        return {
+            'name': config['name'],
+            'iterations': iteration,
+            'train_steps': train_steps,
+            'environment_steps': environment_steps,
+            'build_seconds': self.build_seconds,
+            'collect_seconds': total_collect_time,
+            'train_seconds': total_train_time,
+            'steps_per_second': train_steps / seconds if seconds else 0.0,
+            'samples_per_second': environment_steps / seconds if seconds else 0.0,
+            'collect_samples_per_second': environment_steps / total_collect_time if total_collect_time else 0.0,
+        }
+
+    def close(self):
+        self.train_checkpointer.save(global_step=self.global_step.numpy())
+        self.train_checkpointer.sync()
+        self.policy_checkpointer.sync()
+        self.policy_publisher.publish(self.global_step.numpy())
+        self.policy_publisher.close()
+        if self.collector is not None:
+            self.collector.close()
+            self.collector = None
+        if self.tournament is not None:
+            self.tournament.poll(wait=True)
+            logging.info('league: %s', self.tournament.report())
+            self.tournament.close()
+            self.tournament = None
+
+        # One final eval before exiting.
+        self.evaluate()
+        self.train_summary_writer.close()
+        self.eval_summary_writer.close()
+
+
+def run_experiments(configs):
+    # Runs the configs one after the other in this process, returns the throughput of each. Runs sharing a root_dir
+    # would restore each other's checkpoints.
+    root_dirs = [os.path.abspath(config['root_dir']) for config in configs]
+    if len(set(root_dirs)) != len(root_dirs):
+        raise ValueError('configs share a root_dir: %s' % ', '.join(sorted(set(
+            root_dir for root_dir in root_dirs if root_dirs.count(root_dir) > 1))))
+    results = []
+    for config in configs:
+        experiment = Experiment(config)
+        try:
+            result = experiment.run()
+        finally:
+            experiment.close()
+        logging.info('%s: %.3f steps/sec, %.1f samples/sec, built in %.1f sec', result['name'],
+                     result['steps_per_second'], result['samples_per_second'], result['build_seconds'])
+        results.append(result)
+    return results
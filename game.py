@@ -1,6 +1,7 @@
 import json
 import numpy as np
 from collections import defaultdict
+from functools import lru_cache
 from math import floor
 from enum import Enum
 
@@ -39,22 +40,41 @@ class ImpossibleBuildException(Exception):
 
 
 class Player:
-
-    def __init__(self, wonder):
+    __slots__ = ('wonder', 'coins', 'neighbors', 'wonder_stage', 'constructions', 'construction_names',
+                 'built_structures', 'productions', 'production_key', 'resources_for_sale', 'choices_for_sale',
+                 'free_build_available',
+                 'free_build_used_this_age', 'shields', 'defeat_tokens', 'victory_points', 'wonder_points',
+                 'civilian_points', 'scientific_symbols', 'copy_guild', 'structure_type_counts',
+                 'board_element_points', 'board_points', 'observers', 'trade_keys', 'board', 'guilds',
+                 'discarded_plays', 'play_last_card')
+
+    # When enabled, every score() is cross-checked against a full recomputation from the constructions
+    debug_score = False
+
+    def __init__(self, wonder, board=None):
         self.wonder = wonder
         self.coins = 3
         self.neighbors = {'SELF': {
             'player': self,
-            'commerce': defaultdict(lambda: 0)
+            'commerce': dict.fromkeys(resource_names, 0)
         }}
 
         # Construction & Production
         self.wonder_stage = 0
         self.constructions = []
+        self.construction_names = set()
+        self.built_structures = 0
         self.productions = [self.wonder['production']]
-        self.resources_for_sale = defaultdict(int, self.wonder['production'])
+        self.production_key = production_key(self.productions)
+        self.resources_for_sale = dict.fromkeys(resource_names, 0)
+        self.resources_for_sale.update(self.wonder['production'])
+        # "Either/or" productions for sale, as tuples of resource indexes. A neighbor buys one of the options.
+        self.choices_for_sale = ()
         self.free_build_available = False
         self.free_build_used_this_age = False
+        # Halikarnassus stages built this turn, the environment resolves them at the end of the turn
+        self.discarded_plays = 0
+        self.play_last_card = False
 
         # Score calculation
         self.shields = 0
@@ -64,6 +84,23 @@ class Player:
         self.civilian_points = 0
         self.scientific_symbols = defaultdict(int)
         self.copy_guild = False
+        # Effects of the built guilds, what a neighbor with copy_guild chooses from
+        self.guilds = []
+
+        # Running counters for the per board element effects, keyed by (side, Type or element type)
+        self.structure_type_counts = defaultdict(int)
+        self.board_element_points = {}
+        self.board_points = 0
+        self.observers = [(self, 'SELF')]
+        # ((quantity for sale, unit price) of every resource, "either/or" productions for sale) of a neighbor, rebuilt
+        # after a change to either
+        self.trade_keys = {'LEFT': None, 'RIGHT': None}
+
+        # Observation of the board, kept up to date by every change. The environments pass a row of their board
+        # array, long enough for the built structure flags.
+        self.board = board if board is not None else np.zeros(board_structures, dtype=np.float32)
+        self.board.fill(0)
+        self.add_board_production(self.wonder['production'])
 
     def __repr__(self) -> str:
         return str({
@@ -73,76 +110,169 @@ class Player:
     def with_neighbor(self, left, right):
         self.neighbors['LEFT'] = {
             'player': left,
-            'commerce': defaultdict(lambda: 2)
+            'commerce': dict.fromkeys(resource_names, 2)
         }
         self.neighbors['RIGHT'] = {
             'player': right,
-            'commerce': defaultdict(lambda: 2)
+            'commerce': dict.fromkeys(resource_names, 2)
         }
-        pass
+        left.observers.append((self, 'LEFT'))
+        right.observers.append((self, 'RIGHT'))
+
+    def snapshot(self):
+        # Everything a game can change, the wonder and the seating are fixed for the whole game
+        return (self.coins, self.wonder_stage, tuple(self.constructions), frozenset(self.construction_names),
+                self.built_structures, tuple(self.productions), self.production_key, self.resources_for_sale.copy(),
+                self.choices_for_sale, tuple(neighbor['commerce'].copy() for neighbor in self.neighbors.values()),
+                self.free_build_available, self.free_build_used_this_age, self.shields, self.defeat_tokens,
+                self.victory_points, self.wonder_points, self.civilian_points, self.scientific_symbols.copy(),
+                self.copy_guild, self.structure_type_counts.copy(), self.board_element_points.copy(),
+                self.board_points, self.board.tobytes(), tuple(self.guilds), self.discarded_plays,
+                self.play_last_card)
+
+    def restore(self, snapshot):
+        (self.coins, self.wonder_stage, constructions, construction_names, self.built_structures, productions,
+         self.production_key, resources_for_sale, self.choices_for_sale, commerces, self.free_build_available,
+         self.free_build_used_this_age, self.shields, self.defeat_tokens, self.victory_points, self.wonder_points,
+         self.civilian_points, scientific_symbols, self.copy_guild, structure_type_counts, board_element_points,
+         self.board_points, board, guilds, self.discarded_plays, self.play_last_card) = snapshot
+        self.board[:] = np.frombuffer(board, dtype=self.board.dtype)
+        self.constructions = list(constructions)
+        self.guilds = list(guilds)
+        self.construction_names = set(construction_names)
+        self.productions = list(productions)
+        self.resources_for_sale = resources_for_sale.copy()
+        for neighbor, commerce in zip(self.neighbors.values(), commerces):
+            neighbor['commerce'] = commerce.copy()
+        # Every player of the game is restored, neighbors included
+        self.trade_keys = {'LEFT': None, 'RIGHT': None}
+        self.scientific_symbols = scientific_symbols.copy()
+        self.structure_type_counts = structure_type_counts.copy()
+        self.board_element_points = board_element_points.copy()
+
+    def structure_cost(self, structure):
+        # (gold to pay, whether the free build is used), gold None when the structure cannot be built. Once per age,
+        # free_build_available builds a structure that is not already free. A player never builds the same name twice.
+        if structure['name'] in self.construction_names:
+            return None, False
+        cost = self.affordable_cost(structure['cost'])
+        if cost != 0 and self.free_build_ready():
+            return 0, True
+        return cost, False
+
+    def build_structure(self, structure, free=False, cost=None):
+        # cost is a structure_cost computed earlier, as the simultaneous environment does for every seat of a turn
+        if structure['name'] in self.construction_names:
+            raise ImpossibleBuildException('structure already built')
+        if free:
+            cost = (0, False)
+        self.pay_structure(structure, self.structure_cost(structure) if cost is None else cost)
+        self.place_structure(structure)
+        self.apply_effect(structure['effect'], structure['type'])
 
-    def build_structure(self, structure):
-        cost = self.build_cost(structure['cost'])
-        if cost is None or self.coins < cost:
+    def pay_structure(self, structure, cost):
+        gold, free_build = cost
+        if gold is None:
             raise ImpossibleBuildException('cannot build structure')
+        if free_build:
+            self.free_build_used_this_age = True
+        self.coins -= gold
 
-        self.coins -= cost
+    def place_structure(self, structure):
+        # Counts the structure on the board, without its effect
         self.constructions.append(structure)
-        self.apply_effect(structure['effect'], structure['type'])
-
-    def build_wonder_stage(self):
+        self.construction_names.add(structure['name'])
+        if 'id' in structure:
+            self.built_structures |= 1 << structure['id']
+            if len(self.board) > board_structures:
+                self.board[board_structures + structure['id']] = 1
+        if structure['type'] == Type.GUILD:
+            self.guilds.append(structure['effect'])
+        self.structure_type_counts[structure['type']] += 1
+        self.board_element_changed(structure['type'])
+
+    def build_wonder_stage(self, cost=None):
+        # cost is a wonder_stage_cost computed earlier
+        self.pay_wonder_stage(self.wonder_stage_cost() if cost is None else cost)
+        self.place_wonder_stage()
+        self.apply_wonder_stage_effects()
+
+    def pay_wonder_stage(self, cost):
         if self.wonder_stage >= len(self.wonder['stages']):
             raise ImpossibleBuildException('no more wonder stage to build')
-
-        cost = self.build_cost(self.wonder['stages'][self.wonder_stage]['cost'])
-        if cost is None or self.coins < cost:
+        if cost is None:
             raise ImpossibleBuildException('cannot pay for the wonder stage cost')
-
         self.coins -= cost
+
+    def place_wonder_stage(self):
         self.wonder_stage += 1
+        self.board[board_wonder_stage] += 1
+        self.board_element_changed('WONDER_STAGES')
+
+    def apply_wonder_stage_effects(self):
         for effect in self.wonder['stages'][self.wonder_stage - 1]['effects']:
             self.apply_effect(effect, None)
 
     def discard_structure(self):
         self.coins += 3
 
-    def build_cost(self, cost):
-        # TODO self.free_build_available
-
-        for construction in self.constructions:
-            if 'structure' in cost and cost['structure'] == construction['name']:
-                return 0
+    def affordable_cost(self, cost):
+        price = self.build_cost(cost)
+        if price is None or self.coins < price:
+            return None
+        return price
 
-        resources = defaultdict(int, cost['resources'])
+    def wonder_stage_cost(self):
+        if self.wonder_stage >= len(self.wonder['stages']):
+            return None
+        return self.affordable_cost(self.wonder['stages'][self.wonder_stage]['cost'])
 
-        if any(resources.values()):
-            for production in self.productions:
-                for resource, quantity in production.items():
-                    if resources[resource] > 0:
-                        resources[resource] -= quantity
-                        break
+    def free_build_ready(self):
+        return self.free_build_available and not self.free_build_used_this_age
 
-        gold = 0
-        gold += cost['gold']
+    def build_cost(self, cost, left=None, right=None):
+        if 'structure' in cost and cost['structure'] in self.construction_names:
+            return 0
 
-        # TODO priorize
-        if any(resources.values()):
-            gold += self.purchase_resource('LEFT', resources)
-            gold += self.purchase_resource('RIGHT', resources)
+        if not cost['resources']:
+            return cost['gold']
 
-        if any(resources.values()):
+        price = payment_cost(self.production_key, left or self.trade_key('LEFT'), right or self.trade_key('RIGHT'),
+                             tuple(sorted(cost['resources'].items())))
+        if price is None:
             return None
 
-        return gold
-
-    def purchase_resource(self, side, resources):
-        price = 0
-        neighbor = self.neighbors[side]
-        for resource, quantity in resources.items():
-            resource_count = min(neighbor['player'].resources_for_sale[resource], quantity)
-            price += resource_count * neighbor['commerce'][resource]
-            resources[resource] -= resource_count
-        return price
+        return cost['gold'] + price
+
+    def build_costs(self, costs):
+        # Gold needed for each structure cost, inf when the resources cannot be gathered. The trade vectors are read
+        # once for the hand, each cost still goes through build_cost and the payment_cost cache
+        if self.free_build_ready():
+            return np.zeros(len(costs))
+        left = self.trade_key('LEFT')
+        right = self.trade_key('RIGHT')
+        prices = np.full(len(costs), np.inf)
+        for index, cost in enumerate(costs):
+            price = self.build_cost(cost, left, right)
+            if price is not None:
+                prices[index] = price
+        return prices
+
+    def trade_key(self, side):
+        trade_key = self.trade_keys[side]
+        if trade_key is None:
+            neighbor = self.neighbors[side]
+            resources_for_sale = neighbor['player'].resources_for_sale
+            commerce = neighbor['commerce']
+            trade_key = (tuple((resources_for_sale[resource], commerce[resource]) for resource in resource_names),
+                         neighbor['player'].choices_for_sale)
+            self.trade_keys[side] = trade_key
+        return trade_key
+
+    def resources_for_sale_changed(self):
+        for observer, side in self.observers:
+            if side != 'SELF':
+                observer.trade_keys[side] = None
 
     def apply_effect(self, effect, structure_type):
         if 'gold' in effect:
@@ -150,17 +280,24 @@ class Player:
 
         elif 'production' in effect:
             self.productions.append(effect['production'])
-            sorted(self.productions, key=lambda p: len(p.keys()))
+            self.production_key = production_key(self.productions)
+            self.add_board_production(effect['production'])
 
             if structure_type in [Type.RAW_MATERIAL, Type.MANUFACTURED_GOOD]:
-                for resource, quantity in effect['production'].items():
-                    self.resources_for_sale[resource] += quantity
+                if len(effect['production']) == 1:
+                    for resource, quantity in effect['production'].items():
+                        self.resources_for_sale[resource] += quantity
+                else:
+                    self.choices_for_sale += (tuple(sorted(resource_indexes[resource]
+                                                           for resource in effect['production'])),)
+                self.resources_for_sale_changed()
 
         elif 'discount' in effect:
             discount = effect['discount']
             for neighbor in discount['neighbor']:
                 for resource in discount['resources']:
                     self.neighbors[neighbor]['commerce'][resource] = discount['price']
+                self.trade_keys[neighbor] = None
 
         elif 'points' in effect:
             if structure_type == Type.CIVILIAN:
@@ -170,50 +307,116 @@ class Player:
 
         elif 'science' in effect:
             self.scientific_symbols[effect['science']] += 1
+            self.board[board_science + effect['science'].value - 1] += 1
 
         elif 'military' in effect:
             self.shields += effect['military']
+            self.board[board_shields] += effect['military']
 
-        elif 'perBoardElement' in effect and effect['perBoardElement']['gold'] > 0:
-            count = self.count_board_elements(effect)
-            self.coins += count * effect['perBoardElement']['gold']
+        elif 'perBoardElement' in effect:
+            if effect['perBoardElement']['gold'] > 0:
+                count = self.count_board_elements(effect)
+                self.coins += count * effect['perBoardElement']['gold']
+            if effect['perBoardElement']['points'] > 0:
+                self.watch_board_elements(effect)
 
         elif 'action' in effect:
             if effect['action'] == 'FREE_BUILD':
                 self.free_build_available = True
             elif effect['action'] == 'PLAY_DISCARDED':
-                # TODO PLAY_DISCARDED
-                pass
+                self.discarded_plays += 1
             elif effect['action'] == 'PLAY_LAST_CARD':
-                # TODO PLAY_LAST_CARD
-                pass
+                self.play_last_card = True
             elif effect['action'] == 'COPY_GUILD':
                 self.copy_guild = True
 
+    def add_board_production(self, production):
+        for resource, quantity in production.items():
+            self.board[board_productions + resource_indexes[resource]] += quantity
+
     def score(self):
         score = 0
         score += self.victory_points - self.defeat_tokens
         score += floor(self.coins / 3)
         score += self.wonder_points
         score += self.civilian_points
+        score += self.science_score()
+        score += self.board_points
+        if self.copy_guild:
+            score += self.copied_guild_points(self.count_board_elements)
+
+        if Player.debug_score:
+            full_score = self.full_score()
+            assert score == full_score, 'incremental score %d != full score %d' % (score, full_score)
+
+        return score
 
-        # TODO choose the "ANY symbol" first
-        if self.scientific_symbols:
-            score += min(self.scientific_symbols.values()) * 7
-        for quantity in self.scientific_symbols.values():
-            score += quantity ** 2
+    def full_score(self):
+        score = 0
+        score += self.victory_points - self.defeat_tokens
+        score += floor(self.coins / 3)
+        score += self.wonder_points
+        score += self.civilian_points
+        score += self.science_score()
 
         for construction in self.constructions:
             effect = construction['effect']
             if 'perBoardElement' in effect and effect['perBoardElement']['points'] > 0:
-                count = self.count_board_elements(effect)
+                count = self.recount_board_elements(effect)
                 score += count * effect['perBoardElement']['points']
-
-        # TODO COPY_GUILD
+        if self.copy_guild:
+            score += self.copied_guild_points(self.recount_board_elements)
 
         return score
 
+    def science_score(self, extra_symbol=None):
+        # Exact with "any" symbols, see science_score_table
+        symbols = self.scientific_symbols
+        counts = [symbols.get(symbol, 0) for symbol in science_kinds]
+        if extra_symbol is not None:
+            counts[extra_symbol.value - 1] += 1
+        return science_score_list[counts[0]][counts[1]][counts[2]][counts[3]]
+
+    def copied_guild_points(self, count_board_elements):
+        # The guild of a neighbor worth the most to the player, counted with the player's own neighbors
+        best = 0
+        for side in ('LEFT', 'RIGHT'):
+            for effect in self.neighbors[side]['player'].guilds:
+                if 'science' in effect:
+                    points = self.science_score(effect['science']) - self.science_score()
+                else:
+                    points = count_board_elements(effect) * effect['perBoardElement']['points']
+                best = max(best, points)
+        return best
+
+    def watch_board_elements(self, effect):
+        points = effect['perBoardElement']['points']
+        for neighbor in effect['perBoardElement']['neighbors']:
+            for element in board_elements(effect):
+                key = (neighbor, element)
+                self.board_element_points[key] = self.board_element_points.get(key, 0) + points
+                self.board_points += points * self.board_element_count(neighbor, element)
+
+    def board_element_changed(self, element):
+        for observer, side in self.observers:
+            observer.board_points += observer.board_element_points.get((side, element), 0)
+
+    def board_element_count(self, neighbor, element):
+        player = self.neighbors[neighbor]['player']
+        if element == 'DEFEAT_TOKEN':
+            return player.defeat_tokens
+        elif element == 'WONDER_STAGES':
+            return player.wonder_stage
+        return player.structure_type_counts[element]
+
     def count_board_elements(self, effect):
+        count = 0
+        for neighbor in effect['perBoardElement']['neighbors']:
+            for element in board_elements(effect):
+                count += self.board_element_count(neighbor, element)
+        return count
+
+    def recount_board_elements(self, effect):
         count = 0
         if effect['perBoardElement']['type'] == 'CARD':
             for neighbor in effect['perBoardElement']['neighbors']:
@@ -228,6 +431,10 @@ class Player:
                 count += self.neighbors[neighbor]['player'].wonder_stage
         return count
 
+    def finish_age(self, age):
+        self.resolve_military_conflicts(age)
+        self.free_build_used_this_age = False
+
     def resolve_military_conflicts(self, age):
         self.resolve_military_conflicts_with_neighbor(age, self.neighbors['LEFT']['player'])
         self.resolve_military_conflicts_with_neighbor(age, self.neighbors['RIGHT']['player'])
@@ -235,6 +442,8 @@ class Player:
     def resolve_military_conflicts_with_neighbor(self, age, neighbor):
         if neighbor.shields > self.shields:
             self.defeat_tokens += 1
+            self.board[board_defeat_tokens] += 1
+            self.board_element_changed('DEFEAT_TOKEN')
         elif neighbor.shields < self.shields:
             self.victory_points += age * 2 - 1
 
@@ -251,6 +460,158 @@ class Player:
         return all_productions
 
 
+resource_names = tuple(resource.name for resource in Resource)
+resource_indexes = dict((name, index) for index, name in enumerate(resource_names))
+
+# Player.board: productions as all_productions() counts them, shields, defeat tokens, wonder stage, science symbols,
+# then one flag per built structure id
+board_productions = 0
+board_shields = board_productions + len(Resource)
+board_defeat_tokens = board_shields + 1
+board_wonder_stage = board_defeat_tokens + 1
+board_science = board_wonder_stage + 1
+board_structures = board_science + len(Science)
+
+
+# Most symbols of one kind a player can gather, every copy of the science structures of the kind, and most "any"
+# symbols: the Scientists Guild, Babylon and a copied Scientists Guild. catalog_test checks the game data fits.
+science_symbol_limit = 8
+any_symbol_limit = 3
+
+
+def science_score_table(symbol_limit=science_symbol_limit, any_limit=any_symbol_limit):
+    # Best science score of every (wheel, compass, tablet, any) count: 7 points per set of the three kinds plus the
+    # square of every kind, each "any" symbol taking the kind that scores the most
+    size = symbol_limit + any_limit + 1
+    counts = np.indices((size, size, size))
+    scores = counts.min(axis=0) * 7 + (counts ** 2).sum(axis=0)
+
+    kept = slice(0, symbol_limit + 1)
+    table = np.zeros((symbol_limit + 1,) * 3 + (any_limit + 1,), dtype=np.int32)
+    for wildcards in range(any_limit + 1):
+        for wheels in range(wildcards + 1):
+            for compasses in range(wildcards - wheels + 1):
+                tablets = wildcards - wheels - compasses
+                shifted = scores[wheels:wheels + symbol_limit + 1, compasses:compasses + symbol_limit + 1,
+                                 tablets:tablets + symbol_limit + 1]
+                table[kept, kept, kept, wildcards] = np.maximum(table[kept, kept, kept, wildcards], shifted)
+    return table
+
+
+science_kinds = tuple(Science)
+science_scores = science_score_table()
+science_scores.setflags(write=False)
+# Nested lists index faster than the array one symbol count at a time, and give Python ints
+science_score_list = science_scores.tolist()
+
+
+def board_elements(effect):
+    if effect['perBoardElement']['type'] == 'CARD':
+        return effect['perBoardElement']['cardType']
+    return [effect['perBoardElement']['type']]
+
+
+def production_key(productions):
+    return tuple(sorted(tuple(sorted(production.items())) for production in productions if production))
+
+
+@lru_cache(maxsize=65536)
+def payment_cost(productions, left, right, resources):
+    # Minimum gold paid to neighbors for `resources`, or None when they cannot be gathered.
+    # Fixed productions are spent first, then every assignment of the "either/or" productions is tried and the
+    # remaining resources are bought from the cheapest neighbor first.
+    needed = [0] * len(resource_names)
+    for resource, quantity in resources:
+        needed[resource_indexes[resource]] += quantity
+
+    choices = []
+    for production in productions:
+        if len(production) == 1:
+            resource, quantity = production[0]
+            needed[resource_indexes[resource]] -= quantity
+        else:
+            choices.append(tuple((resource_indexes[resource], quantity) for resource, quantity in production))
+
+    return assign_choice_productions(needed, choices, 0, left, right)
+
+
+def assign_choice_productions(needed, choices, choice_index, left, right):
+    if all(quantity <= 0 for quantity in needed):
+        return 0
+    if choice_index == len(choices):
+        return purchase_cost(needed, left, right)
+
+    best = None
+    used = False
+    for resource, quantity in choices[choice_index]:
+        if needed[resource] > 0:
+            used = True
+            needed[resource] -= quantity
+            price = assign_choice_productions(needed, choices, choice_index + 1, left, right)
+            needed[resource] += quantity
+            if price is not None and (best is None or price < best):
+                best = price
+                if best == 0:
+                    break
+    if not used:
+        best = assign_choice_productions(needed, choices, choice_index + 1, left, right)
+
+    return best
+
+
+def purchase_cost(needed, left, right):
+    # Every assignment of the neighbors' "either/or" productions for sale is tried, each sells one of its options
+    (left_for_sale, left_choices), (right_for_sale, right_choices) = left, right
+    available = ([quantity for quantity, _ in left_for_sale], [quantity for quantity, _ in right_for_sale])
+    prices = ([price for _, price in left_for_sale], [price for _, price in right_for_sale])
+    choices = [(0, options) for options in left_choices] + [(1, options) for options in right_choices]
+    return assign_neighbor_choices(needed, available, prices, choices, 0)
+
+
+def assign_neighbor_choices(needed, available, prices, choices, choice_index):
+    if choice_index == len(choices):
+        return fixed_purchase_cost(needed, available, prices)
+
+    side, options = choices[choice_index]
+    best = None
+    used = False
+    for resource in options:
+        if needed[resource] > 0:
+            used = True
+            available[side][resource] += 1
+            price = assign_neighbor_choices(needed, available, prices, choices, choice_index + 1)
+            available[side][resource] -= 1
+            if price is not None and (best is None or price < best):
+                best = price
+    if not used:
+        best = assign_neighbor_choices(needed, available, prices, choices, choice_index + 1)
+
+    return best
+
+
+def fixed_purchase_cost(needed, available, prices):
+    price = 0
+    (left_available, right_available), (left_prices, right_prices) = available, prices
+    for resource, quantity in enumerate(needed):
+        if quantity <= 0:
+            continue
+        if left_available[resource] + right_available[resource] < quantity:
+            return None
+        if left_prices[resource] <= right_prices[resource]:
+            bought = min(left_available[resource], quantity)
+            price += bought * left_prices[resource] + (quantity - bought) * right_prices[resource]
+        else:
+            bought = min(right_available[resource], quantity)
+            price += bought * right_prices[resource] + (quantity - bought) * left_prices[resource]
+    return price
+
+
+def payment_cache_hit_rate():
+    cache_info = payment_cost.cache_info()
+    lookups = cache_info.hits + cache_info.misses
+    return cache_info.hits / lookups if lookups else 0.0
+
+
 class GameDataJsonDecoder(json.JSONDecoder):
     def __init__(self, *args, **kwargs):
         json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
@@ -258,5 +619,7 @@ class GameDataJsonDecoder(json.JSONDecoder):
     def object_hook(self, data):
         if "__type__" in data:
             return getattr(Type, data["__type__"])
+        elif "__science__" in data:
+            return getattr(Science, data["__science__"])
         else:
             return data
@@ -0,0 +1,180 @@
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+from batched_environment import BatchedGameEnvironment
+from collector import PolicyStore, SharedArrays
+from environment import action_count
+
+# Slot states, a slot belongs to one client and holds at most one request
+IDLE = 0
+REQUEST = 1
+RESPONSE = 2
+
+
+class InferenceSlots(SharedArrays):
+
+    @staticmethod
+    def create_layout(slot_count, observation_spec):
+        layout = [('state', (slot_count,), np.int64), ('policy_version', (slot_count,), np.int64)]
+        for key, spec in sorted(observation_spec.items()):
+            layout.append(('observation/' + key, (slot_count,) + spec.shape, spec.dtype))
+        layout += [
+            ('action', (slot_count,), np.int32),
+            ('action_logits', (slot_count, action_count), np.float32),
+        ]
+        return layout
+
+    @property
+    def slot_count(self):
+        return self.arrays['state'].shape[0]
+
+
+class InferenceClient:
+    # Drop in for the policies of policies.py: writes the observations of a batch into the slots [first_slot,
+    # first_slot + count) and waits for the server to answer all of them
+
+    weights_required = False
+
+    def __init__(self, slots_spec, first_slot, count, stop_event=None):
+        self.slots = InferenceSlots.attach(slots_spec)
+        self.rows = slice(first_slot, first_slot + count)
+        self.stop_event = stop_event
+        self.policy_version = 0
+
+    def load(self, weights):
+        # The server reloads the weights
+        pass
+
+    def action(self, observation):
+        arrays = self.slots.arrays
+        for key, value in observation.items():
+            arrays['observation/' + key][self.rows] = value
+        state = arrays['state'][self.rows]
+        state[:] = REQUEST
+        while (state != RESPONSE).any():
+            if self.stop_event is not None and self.stop_event.is_set():
+                raise RuntimeError('inference server stopped')
+            time.sleep(0.0001)
+
+        self.policy_version = int(arrays['policy_version'][self.rows].min())
+        result = arrays['action'][self.rows].copy(), arrays['action_logits'][self.rows].copy()
+        state[:] = IDLE
+        return result
+
+    def close(self):
+        self.slots.close()
+
+
+def serve(slots, policy, max_batch_size, max_latency, stop_event, store=None, weight_shapes=()):
+    # Answers pending requests in batches: a batch runs once it is full, every slot waits or the oldest pending
+    # request is max_latency seconds old. Weights published to the store are loaded between batches.
+    arrays = slots.arrays
+    observation_keys = [key for key in arrays if key.startswith('observation/')]
+    policy_version = 0
+    first_pending_time = None
+    batches = 0
+    while not stop_event.is_set():
+        pending = np.flatnonzero(arrays['state'] == REQUEST)
+        if len(pending) == 0:
+            first_pending_time = None
+            time.sleep(0.0001)
+            continue
+        if first_pending_time is None:
+            first_pending_time = time.perf_counter()
+        if (len(pending) < min(max_batch_size, slots.slot_count)
+                and time.perf_counter() - first_pending_time < max_latency):
+            time.sleep(0.0001)
+            continue
+
+        if store is not None:
+            weights, version = store.read(weight_shapes, policy_version)
+            if weights is not None:
+                policy.load(weights)
+                policy_version = version
+        if policy.weights_required and policy_version == 0:
+            time.sleep(0.001)
+            continue
+
+        batch = pending[:max_batch_size]
+        observation = dict((key[len('observation/'):], arrays[key][batch]) for key in observation_keys)
+        actions, action_logits = policy.action(observation)
+        arrays['action'][batch] = actions
+        arrays['action_logits'][batch] = action_logits
+        arrays['policy_version'][batch] = policy_version
+        arrays['state'][batch] = RESPONSE
+        first_pending_time = None if len(pending) <= max_batch_size else first_pending_time
+        batches += 1
+    return batches
+
+
+def inference_worker(slots_spec, store_spec, weight_shapes, policy_factory, max_batch_size, max_latency,
+                     stop_event):
+    slots = InferenceSlots.attach(slots_spec)
+    store = PolicyStore.attach(store_spec) if store_spec is not None else None
+    serve(slots, policy_factory(), max_batch_size, max_latency, stop_event, store, weight_shapes)
+    slots.close()
+    if store is not None:
+        store.close()
+
+
+class InferenceServer:
+    # One network evaluation loop shared by many rollout workers. Runs in a spawned process, or in a thread of the
+    # calling process with in_process, and follows the weights published to a collector PolicyStore.
+
+    def __init__(self, policy_factory, slot_count, player_count=3, max_batch_size=256, max_latency=0.002,
+                 store_spec=None, weight_shapes=(), board_observations=False):
+        self.policy_factory = policy_factory
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.store_spec = store_spec
+        self.weight_shapes = [tuple(shape) for shape in weight_shapes]
+        observation_spec = BatchedGameEnvironment(
+            1, player_count, board_observations=board_observations).observation_spec()
+        self.slots = InferenceSlots(InferenceSlots.create_layout(slot_count, observation_spec))
+        self.next_slot = 0
+
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = self.context.Event()
+        self.worker = None
+
+    def client_factory(self, count):
+        # A picklable factory of the client of the next `count` slots, for collect_worker and other processes
+        if self.next_slot + count > self.slots.slot_count:
+            raise ValueError('all %d inference slots are taken' % self.slots.slot_count)
+        first_slot = self.next_slot
+        self.next_slot += count
+        return ClientFactory(self.slots.spec(), first_slot, count, self.stop_event)
+
+    def start(self, in_process=False):
+        args = (self.slots.spec(), self.store_spec, self.weight_shapes, self.policy_factory, self.max_batch_size,
+                self.max_latency, self.stop_event)
+        if in_process:
+            self.worker = threading.Thread(target=inference_worker, args=args, daemon=True)
+        else:
+            self.worker = self.context.Process(target=inference_worker, args=args, daemon=True)
+        self.worker.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.worker is not None:
+            self.worker.join(timeout=10)
+            if isinstance(self.worker, multiprocessing.process.BaseProcess) and self.worker.is_alive():
+                self.worker.terminate()
+            self.worker = None
+        self.slots.close()
+        self.slots.unlink()
+
+
+class ClientFactory:
+
+    def __init__(self, slots_spec, first_slot, count, stop_event):
+        self.slots_spec = slots_spec
+        self.first_slot = first_slot
+        self.count = count
+        self.stop_event = stop_event
+
+    def __call__(self):
+        return InferenceClient(self.slots_spec, self.first_slot, self.count, self.stop_event)
@@ -0,0 +1,237 @@
+import math
+import pickle
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from catalog import points_offset, military_offset, science_offset
+from environment import Action, legal_actions, split_action
+
+
+def action_keys(env):
+    # Actions are identified by (Action, structure name) so that they stay meaningful across determinizations
+    player = env.players[env.current_player_index]
+    player_deck = env.player_deck(env.current_player_index)
+    hand = [env.catalog.structures[structure_id] for structure_id in player_deck]
+    mask, _ = legal_actions(player, hand)
+
+    keys = {}
+    for action, structure_index in zip(*split_action(np.flatnonzero(mask))):
+        keys.setdefault((int(action), hand[structure_index]['name']), int(structure_index))
+    return keys
+
+
+def random_policy(env, keys, rng):
+    return rng.choice(list(keys))
+
+
+def heuristic_policy(env, keys, rng):
+    # Build the structure with the most immediate value, else a wonder stage, else discard anything
+    best_key = None
+    best_value = -1
+    for key, structure_index in keys.items():
+        if key[0] != Action.BUILD_STRUCTURE.value:
+            continue
+        structure_id = env.player_deck(env.current_player_index)[structure_index]
+        features = env.catalog.structure_features[structure_id]
+        value = features[points_offset] + features[military_offset] + features[science_offset:].sum() + rng.random()
+        if value > best_value:
+            best_key = key
+            best_value = value
+    if best_key is not None:
+        return best_key
+
+    wonder_keys = [key for key in keys if key[0] == Action.BUILD_WONDER_STAGE.value]
+    if wonder_keys:
+        return rng.choice(wonder_keys)
+    return rng.choice(list(keys))
+
+
+rollout_policies = {
+    'random': random_policy,
+    'heuristic': heuristic_policy,
+}
+
+
+def game_rewards(env):
+    # Share of the win for each seat, ties split the win
+    scores = [player.score() for player in env.players]
+    best_score = max(scores)
+    winners = scores.count(best_score)
+    return [1 / winners if score == best_score else 0 for score in scores]
+
+
+class Node:
+    __slots__ = ('player_index', 'visits', 'availability', 'value', 'children')
+
+    def __init__(self, player_index):
+        self.player_index = player_index
+        self.visits = 0
+        self.availability = 0
+        self.value = 0.0
+        self.children = {}
+
+    def select(self, keys, exploration):
+        best_key = None
+        best_score = -math.inf
+        for key in keys:
+            child = self.children[key]
+            score = child.value / child.visits + exploration * math.sqrt(math.log(child.availability) / child.visits)
+            if score > best_score:
+                best_key = key
+                best_score = score
+        return best_key
+
+
+class InformationSetSearch:
+    # Single observer information set MCTS: every simulation samples the hands the observer cannot see
+
+    def __init__(self, exploration=0.7, rollout_policy='random', seed=None):
+        self.exploration = exploration
+        self.rollout_policy = rollout_policies[rollout_policy]
+        self.rng = random.Random(seed)
+        self.simulations = 0
+
+    def determinize(self, env, observer):
+        # The decks of the later ages are hidden too: a fresh random generator deals them anew in every simulation,
+        # the real one would replay the deals of the game
+        env.random = np.random.default_rng(self.rng.getrandbits(64))
+        hidden_players = [i for i in range(env.player_count) if i != observer]
+        hidden_structures = [structure_id for i in hidden_players for structure_id in env.player_deck(i)]
+        self.rng.shuffle(hidden_structures)
+        for i in hidden_players:
+            player_deck = env.player_deck(i)
+            player_deck[:] = hidden_structures[:len(player_deck)]
+            del hidden_structures[:len(player_deck)]
+
+    def run(self, env, root, simulations):
+        snapshot = env.snapshot()
+        observer = env.current_player_index
+        for _ in range(simulations):
+            env.restore(snapshot)
+            self.determinize(env, observer)
+            self.simulate(env, root)
+        env.restore(snapshot)
+        self.simulations += simulations
+
+    def simulate(self, env, root):
+        node = root
+        path = [root]
+        expanded = False
+        while not env._episode_ended:
+            keys = action_keys(env)
+            for key in keys:
+                if key in node.children:
+                    node.children[key].availability += 1
+
+            untried = [key for key in keys if key not in node.children]
+            if untried:
+                key = self.rng.choice(untried)
+                child = node.children[key] = Node(env.current_player_index)
+                child.availability = 1
+                expanded = True
+            else:
+                key = node.select(keys, self.exploration)
+                child = node.children[key]
+
+            env.play(Action(key[0]), keys[key])
+            node = child
+            path.append(node)
+            if expanded:
+                break
+
+        while not env._episode_ended:
+            keys = action_keys(env)
+            key = self.rollout_policy(env, keys, self.rng)
+            env.play(Action(key[0]), keys[key])
+
+        rewards = game_rewards(env)
+        for node in path:
+            node.visits += 1
+            if node is not root:
+                node.value += rewards[node.player_index]
+
+
+def search_root_statistics(env_state, simulations, exploration, rollout_policy, seed):
+    env = pickle.loads(env_state)
+    root = Node(None)
+    InformationSetSearch(exploration, rollout_policy, seed).run(env, root, simulations)
+    return dict((key, (child.visits, child.value)) for key, child in root.children.items())
+
+
+class MctsAgent:
+    # Plays the current seat of a GameEnvironment. With workers > 1 the simulation budget is split across a process
+    # pool (root parallelization) and the root statistics are merged, otherwise the tree is reused between turns.
+
+    def __init__(self, simulations=1000, exploration=0.7, rollout_policy='random', workers=1, seed=None):
+        self.simulations = simulations
+        self.exploration = exploration
+        self.rollout_policy = rollout_policy
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.search = InformationSetSearch(exploration, rollout_policy, self.rng.getrandbits(32))
+        self.pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        self.root = None
+        self.search_time = 0.0
+        self.simulation_count = 0
+
+    def act(self, env):
+        start_time = time.time()
+        keys = action_keys(env)
+        if self.pool is None:
+            if self.root is None:
+                self.root = Node(None)
+            self.search.run(env, self.root, self.simulations)
+            statistics = dict((key, (child.visits, child.value)) for key, child in self.root.children.items())
+        else:
+            statistics = self.parallel_statistics(env)
+        self.search_time += time.time() - start_time
+        self.simulation_count += self.simulations
+
+        key = max(keys, key=lambda k: statistics.get(k, (0, 0))[0])
+        return [key[0], keys[key]]
+
+    def parallel_statistics(self, env):
+        env_state = pickle.dumps(env)
+        budgets = [self.simulations // self.workers + (1 if i < self.simulations % self.workers else 0)
+                   for i in range(self.workers)]
+        futures = [self.pool.submit(search_root_statistics, env_state, budget, self.exploration,
+                                    self.rollout_policy, self.rng.getrandbits(32)) for budget in budgets]
+        statistics = {}
+        for future in futures:
+            for key, (visits, value) in future.result().items():
+                merged_visits, merged_value = statistics.get(key, (0, 0))
+                statistics[key] = (merged_visits + visits, merged_value + value)
+        return statistics
+
+    def observe(self, key):
+        # Follow the played action down the tree so that the next search starts from the matching subtree
+        if self.root is not None:
+            child = self.root.children.get(key)
+            self.root = child if child is not None else None
+            if self.root is not None:
+                self.root.player_index = None
+
+    def simulations_per_second(self):
+        return self.simulation_count / self.search_time if self.search_time else 0.0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def play_game(env, agents):
+    # agents[i] plays seat i, every agent observes every played action. Returns the final scores.
+    env.reset()
+    while not env._episode_ended:
+        agent = agents[env.current_player_index]
+        player_action, structure_index = agent.act(env)
+        structure_id = env.player_deck(env.current_player_index)[structure_index]
+        key = (int(player_action), env.catalog.structures[structure_id]['name'])
+        env.play(Action(int(player_action)), structure_index)
+        for observer in agents:
+            if hasattr(observer, 'observe'):
+                observer.observe(key)
+    return [player.score() for player in env.players]
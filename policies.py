@@ -0,0 +1,103 @@
+import numpy as np
+
+from catalog import points_offset, military_offset, science_offset
+from environment import Action, action_count, action_index, player_hand_size
+
+
+def flatten_observation(observation):
+    # Same feature order as the Concatenate preprocessing combiner of the networks, which follows the sorted keys
+    batch_size = np.shape(observation['age'])[0]
+    return np.concatenate([np.reshape(observation[key], (batch_size, -1)) for key in sorted(observation)],
+                          axis=1).astype(np.float32)
+
+
+def masked_logits(logits, legal_actions):
+    # As the masked CategoricalProjectionNetwork of the actor network, illegal actions get the lowest float
+    return np.where(np.asarray(legal_actions) > 0, logits, np.finfo(np.float32).min).astype(np.float32)
+
+
+def sample_logits(logits, rng):
+    # Gumbel-max trick, samples every row of the batch at once
+    return np.argmax(logits - np.log(-np.log(rng.random(logits.shape))), axis=-1).astype(np.int32)
+
+
+class RandomPolicy:
+    # Uniform over the legal actions, and reports the masked uniform logits it samples from
+    weights_required = False
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def load(self, weights):
+        pass
+
+    def action(self, observation):
+        legal_actions = np.asarray(observation['legal_actions'])
+        choices = np.argmax(self.rng.random(legal_actions.shape) * legal_actions, axis=-1)
+        return choices.astype(np.int32), masked_logits(np.zeros(legal_actions.shape, dtype=np.float32), legal_actions)
+
+
+class HeuristicPolicy:
+    # Batched mcts.heuristic_policy: the legal build with the most points, military and science, else a wonder stage,
+    # else a random discard
+    weights_required = False
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def load(self, weights):
+        pass
+
+    def action(self, observation):
+        hand = np.asarray(observation['player_hand'])
+        batch_size = hand.shape[0]
+        legal_actions = np.reshape(observation['legal_actions'], (batch_size, len(Action), player_hand_size))
+
+        values = (hand[..., points_offset] + hand[..., military_offset] + hand[..., science_offset:].sum(axis=-1)
+                  + self.rng.random((batch_size, player_hand_size)))
+        builds = legal_actions[:, Action.BUILD_STRUCTURE.value] > 0
+        best_builds = np.argmax(np.where(builds, values, -np.inf), axis=-1)
+        discards = np.argmax(self.rng.random((batch_size, player_hand_size)) * legal_actions[:, Action.DISCARD.value],
+                             axis=-1)
+
+        can_build = builds.any(axis=-1)
+        can_build_stage = legal_actions[:, Action.BUILD_WONDER_STAGE.value].any(axis=-1)
+        actions = np.where(can_build, Action.BUILD_STRUCTURE.value,
+                           np.where(can_build_stage, Action.BUILD_WONDER_STAGE.value, Action.DISCARD.value))
+        cards = np.where(can_build, best_builds, discards)
+        return action_index(actions, cards).astype(np.int32), np.zeros((batch_size, action_count), dtype=np.float32)
+
+
+class MlpPolicy:
+    # NumPy evaluation of the actor network of experiment.py: the weights are MaskedActorNetwork.get_weights(), that is
+    # the (kernel, bias) of every encoding layer followed by the projection layer, whose logits are masked with the
+    # legal actions.
+    weights_required = True
+
+    def __init__(self, weights=None, activation=np.tanh, greedy=False, seed=None):
+        self.activation = activation
+        self.greedy = greedy
+        self.rng = np.random.default_rng(seed)
+        self.layers = []
+        self.projection_layer = None
+        if weights is not None:
+            self.load(weights)
+
+    def load(self, weights):
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.layers = [(weights[i], weights[i + 1]) for i in range(0, len(weights) - 2, 2)]
+        self.projection_layer = (weights[-2], weights[-1])
+
+    def logits(self, observation):
+        x = flatten_observation(observation)
+        for kernel, bias in self.layers:
+            x = self.activation(x @ kernel + bias)
+        return masked_logits(x @ self.projection_layer[0] + self.projection_layer[1], observation['legal_actions'])
+
+    def action(self, observation):
+        logits = self.logits(observation)
+        if self.greedy:
+            actions = np.argmax(logits, axis=-1).astype(np.int32)
+        else:
+            actions = sample_logits(logits, self.rng)
+        return actions, logits
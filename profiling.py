@@ -0,0 +1,167 @@
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+import batched_environment
+import environment
+import game
+import policies
+
+# Timers wrap the hot paths only while profiling is enabled, disabled code runs the original functions untouched.
+# Spawned collect workers import fresh modules, each enables its own timers.
+hot_paths = [
+    (environment.GameEnvironment, '_step', 'environment/step'),
+    (environment.GameEnvironment, 'to_observation', 'environment/to_observation'),
+    (environment.GameEnvironment, 'finish_age', 'environment/finish_age'),
+    (environment.SimultaneousGameEnvironment, '_step', 'environment/step'),
+    (environment.SimultaneousGameEnvironment, 'to_observation', 'environment/to_observation'),
+    (batched_environment.BatchedGameEnvironment, '_step', 'environment/step'),
+    (batched_environment.BatchedGameEnvironment, 'to_observation', 'environment/to_observation'),
+    (batched_environment.BatchedGameEnvironment, 'finish_age', 'environment/finish_age'),
+    (game.Player, 'build_cost', 'player/build_cost'),
+    (game.Player, 'score', 'player/score'),
+    (policies.RandomPolicy, 'action', 'policy/action'),
+    (policies.HeuristicPolicy, 'action', 'policy/action'),
+    (policies.MlpPolicy, 'action', 'policy/action'),
+]
+
+enabled = False
+# name -> [calls, seconds]
+timers = defaultdict(lambda: [0, 0.0])
+counters = defaultdict(int)
+patched = []
+
+
+def timed(function, name):
+    timer = timers[name]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += time.perf_counter() - start_time
+
+    return wrapper
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    enabled = True
+    for owner, attribute, name in hot_paths:
+        original = owner.__dict__[attribute]
+        if isinstance(original, staticmethod):
+            replacement = staticmethod(timed(original.__func__, name))
+        else:
+            replacement = timed(original, name)
+        setattr(owner, attribute, replacement)
+        patched.append((owner, attribute, original))
+
+
+def disable():
+    global enabled
+    enabled = False
+    while patched:
+        owner, attribute, original = patched.pop()
+        setattr(owner, attribute, original)
+
+
+def record(name, seconds, calls=1):
+    # For phases timed by the caller, like the collect and train phases of the training loop
+    if enabled:
+        timer = timers[name]
+        timer[0] += calls
+        timer[1] += seconds
+
+
+def count(name, value=1):
+    if enabled:
+        counters[name] += value
+
+
+def reset():
+    # Clears the values in place, the wrappers keep references to their timers
+    for timer in timers.values():
+        timer[0] = 0
+        timer[1] = 0.0
+    counters.clear()
+
+
+def stats():
+    result = {}
+    for name, (calls, seconds) in sorted(timers.items()):
+        if calls:
+            result[name + '/calls'] = calls
+            result[name + '/seconds'] = seconds
+            result[name + '/us_per_call'] = seconds / calls * 1e6
+    for name, value in sorted(counters.items()):
+        result[name] = value
+    if 'collect' in timers and timers['collect'][0]:
+        # Time spent in the driver outside of the python environment: policy inference and the TF boundary
+        result['collect/outside_environment/seconds'] = timers['collect'][1] - timers['environment/step'][1]
+    result['player/payment_cache_hit_rate'] = game.payment_cache_hit_rate()
+    return result
+
+
+def write_summaries(step):
+    # TensorFlow is imported where it is used, the collect workers time themselves without it
+    import tensorflow as tf
+    with tf.compat.v2.summary.record_if(True):
+        for name, value in stats().items():
+            tf.compat.v2.summary.scalar(name='Profile/' + name, data=value, step=step)
+
+
+def dump(file_path):
+    # Replaced whole, readers never see a partly written file
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(stats(), file, indent=2, sort_keys=True)
+    os.replace(file_path + '.tmp', file_path)
+
+
+class StatsWriter:
+    # The stats of a worker process in a file of its own, written at most every `interval` seconds and on close
+
+    def __init__(self, file_path, interval=10.0):
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        self.file_path = file_path
+        self.interval = interval
+        self.written_at = time.perf_counter()
+
+    def update(self):
+        if time.perf_counter() - self.written_at >= self.interval:
+            self.close()
+
+    def close(self):
+        dump(self.file_path)
+        self.written_at = time.perf_counter()
+
+
+class ProfilerWindow:
+    # Runs the TensorFlow profiler, with python function tracing, over the iterations [start, stop)
+
+    def __init__(self, log_dir, start, stop):
+        self.log_dir = log_dir
+        self.start = start
+        self.stop = stop
+        self.running = False
+
+    def step(self, iteration):
+        import tensorflow as tf
+        if iteration == self.start and not self.running:
+            tf.profiler.experimental.start(
+                self.log_dir, options=tf.profiler.experimental.ProfilerOptions(python_tracer_level=1))
+            self.running = True
+        elif iteration >= self.stop and self.running:
+            self.close()
+
+    def close(self):
+        if self.running:
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+            self.running = False
@@ -0,0 +1,240 @@
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from tf_agents.trajectories import time_step
+
+from catalog import load_catalog
+from collector import episode_length
+from environment import action_count, board_length, episode_deals, player_hand_size, seat_order, split_action
+from rules import RulesKernel, RulesTables, wonder_sides
+
+# File: header, then zlib compressed chunks of fixed size game records. Appending only ever adds chunks, a chunk cut
+# short by a crash is ignored by the reader and cut off by the next writer.
+magic = b'7WRL'
+format_version = 2
+file_header = struct.Struct('<4sHB20s')
+chunk_header = struct.Struct('<II')
+# Hand slots without a structure, structure ids fit a byte
+EMPTY_SLOT = 255
+
+
+def game_dtype(player_count):
+    # Boards are stored as wonder id * 2 + side, actions as the actions of the action spec, environment.action_index
+    return np.dtype([
+        ('seed', '<u8'),
+        ('boards', 'u1', (player_count,)),
+        ('hands', 'u1', (3, player_count, player_hand_size)),
+        ('actions', 'u1', (episode_length(player_count),)),
+    ])
+
+
+def read_header(buffer, catalog):
+    file_magic, version, player_count, digest = file_header.unpack_from(buffer, 0)
+    if file_magic != magic or version != format_version:
+        raise ValueError('not a version %d replay log' % format_version)
+    if digest != catalog.digest:
+        raise ValueError('replay log was written with different game data')
+    return player_count
+
+
+def complete_chunks(buffer):
+    # (data offset, game count, compressed size) of every complete chunk, and the offset where they end
+    chunks = []
+    offset = file_header.size
+    while offset + chunk_header.size <= len(buffer):
+        count, size = chunk_header.unpack_from(buffer, offset)
+        if offset + chunk_header.size + size > len(buffer):
+            break
+        chunks.append((offset + chunk_header.size, count, size))
+        offset += chunk_header.size + size
+    return chunks, offset
+
+
+class ReplayWriter:
+
+    def __init__(self, file_path, player_count, chunk_size=1024, compression_level=6, catalog=None):
+        self.catalog = catalog if catalog is not None else load_catalog()
+        self.player_count = player_count
+        self.compression_level = compression_level
+
+        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            self.file = open(file_path, 'r+b')
+            data = self.file.read()
+            if read_header(data, self.catalog) != player_count:
+                self.file.close()
+                raise ValueError('replay log holds games of another player count')
+            # A torn final chunk would swallow the chunks appended after it
+            end = complete_chunks(data)[1]
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(file_path, 'wb')
+            self.file.write(file_header.pack(magic, format_version, player_count, self.catalog.digest))
+
+        self.records = np.zeros(chunk_size, dtype=game_dtype(player_count))
+        self.count = 0
+
+    def add(self, seed, wonder_ids, sides, decks, actions):
+        # sides lists the wonder side of every seat, decks[age - 1][deck] the structure ids dealt to the deck, actions
+        # the actions played, as GameEnvironment.episode_actions
+        record = self.records[self.count]
+        record['seed'] = seed
+        record['boards'] = [wonder_id * len(wonder_sides) + wonder_sides.index(side)
+                            for wonder_id, side in zip(wonder_ids, sides)]
+        record['hands'] = EMPTY_SLOT
+        for age_index, age_decks in enumerate(decks):
+            for deck, structure_ids in enumerate(age_decks):
+                record['hands'][age_index, deck, :len(structure_ids)] = structure_ids
+        if len(actions) != len(record['actions']):
+            raise ValueError('only complete episodes can be logged')
+        record['actions'] = actions
+
+        self.count += 1
+        if self.count == len(self.records):
+            self.flush()
+
+    def add_episode(self, env):
+        wonder_ids, sides, decks = episode_deals(env.catalog, env.player_count, env.episode_seed, env.wonder_side)
+        self.add(env.episode_seed, wonder_ids, sides, decks, env.episode_actions)
+
+    def flush(self):
+        if self.count:
+            data = zlib.compress(self.records[:self.count].tobytes(), self.compression_level)
+            self.file.write(chunk_header.pack(self.count, len(data)))
+            self.file.write(data)
+            self.count = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayReader:
+    # Memory maps the log and decompresses one chunk at a time
+
+    def __init__(self, file_path, catalog=None):
+        self.catalog = catalog if catalog is not None else load_catalog()
+        self.file = open(file_path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.player_count = read_header(self.buffer, self.catalog)
+        self.dtype = game_dtype(self.player_count)
+
+        self.chunks = complete_chunks(self.buffer)[0]
+
+    def __len__(self):
+        return sum(count for _, count, _ in self.chunks)
+
+    def chunk(self, index):
+        offset, count, size = self.chunks[index]
+        data = zlib.decompress(memoryview(self.buffer)[offset:offset + size])
+        return np.frombuffer(data, dtype=self.dtype, count=count)
+
+    def games(self):
+        for index in range(len(self.chunks)):
+            yield self.chunk(index)
+
+    def batches(self, batch_size, tables=None, board_observations=False):
+        # Replayed episodes of up to batch_size games, in the layout of SelfPlayCollector.collect
+        tables = tables if tables is not None else RulesTables(self.catalog)
+        pending = []
+        pending_count = 0
+        for games in self.games():
+            pending.append(games)
+            pending_count += len(games)
+            while pending_count >= batch_size:
+                games = np.concatenate(pending)
+                yield replay_games(games[:batch_size], self.catalog, tables, board_observations)
+                pending = [games[batch_size:]]
+                pending_count -= batch_size
+        if pending_count:
+            yield replay_games(np.concatenate(pending), self.catalog, tables, board_observations)
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+def replay_games(games, catalog=None, tables=None, board_observations=False):
+    # Replays game records on the rules kernel, all games in lockstep: the seat, turn and age of a step are the same
+    # for every game. Returns the observations, actions, rewards and step types that GameEnvironment produced,
+    # players_board included with board_observations.
+    catalog = catalog if catalog is not None else load_catalog()
+    player_count = games.dtype['boards'].shape[0]
+    length = episode_length(player_count)
+    batch_size = len(games)
+    game_indexes = np.arange(batch_size)
+    kernel = RulesKernel(batch_size, player_count, tables)
+    kernel.reset(game_indexes, games['boards'].astype(np.int32))
+
+    episodes = {
+        'observation/age': np.zeros((batch_size, length), dtype=np.float32),
+        'observation/turn': np.zeros((batch_size, length), dtype=np.float32),
+        'observation/players_coins': np.zeros((batch_size, length, player_count), dtype=np.float32),
+        'observation/player_hand': np.zeros(
+            (batch_size, length, player_hand_size, catalog.structure_features.shape[1]), dtype=np.float32),
+        'observation/legal_actions': np.zeros((batch_size, length, action_count), dtype=np.float32),
+        'observation/action_costs': np.zeros((batch_size, length, action_count), dtype=np.float32),
+        'step_type': np.full((batch_size, length), time_step.StepType.MID, dtype=np.int32),
+        'next_step_type': np.full((batch_size, length), time_step.StepType.MID, dtype=np.int32),
+        'reward': np.zeros((batch_size, length), dtype=np.float32),
+        'discount': np.ones((batch_size, length), dtype=np.float32),
+        'action': games['actions'].astype(np.int32),
+        'action_logits': np.zeros((batch_size, length, action_count), dtype=np.float32),
+    }
+    if board_observations:
+        episodes['observation/players_board'] = np.zeros(
+            (batch_size, length, player_count, board_length(catalog)), dtype=np.float32)
+    episodes['step_type'][:, 0] = time_step.StepType.FIRST
+    episodes['next_step_type'][:, -1] = time_step.StepType.LAST
+    episodes['discount'][:, -1] = 0
+
+    # As GameEnvironment.current_player_scores, the first reward of a seat includes its starting score
+    scores = np.zeros((batch_size, player_count), dtype=np.int32)
+    slots = np.arange(player_hand_size)
+    step = 0
+    for age in (1, 2, 3):
+        hands = games['hands'][:, age - 1].astype(np.int32)
+        hands[hands == EMPTY_SLOT] = -1
+        deck_offset = -1 if age == 2 else 0
+        for turn in range(1, 7):
+            for seat in range(player_count):
+                seats = np.full(batch_size, seat)
+                hand = hands[:, (seat + deck_offset) % player_count]
+                episodes['observation/age'][:, step] = age
+                episodes['observation/turn'][:, step] = turn
+                episodes['observation/players_coins'][:, step] = kernel.coins
+                episodes['observation/player_hand'][:, step] = catalog.structure_features[hand]
+                episodes['observation/legal_actions'][:, step], episodes['observation/action_costs'][:, step] = \
+                    kernel.legal_actions(game_indexes, seats, hand)
+                if board_observations:
+                    episodes['observation/players_board'][:, step] = kernel.boards()[:, seat_order(seat, player_count)]
+
+                actions, cards = split_action(episodes['action'][:, step])
+                modifiers = kernel.play(game_indexes, seats, actions, hand[game_indexes, cards])
+                # Remove the played structure, the rest of the hand moves up a slot
+                shifted = np.minimum(slots + (slots >= cards[:, None]), player_hand_size)
+                hand[:] = np.take_along_axis(np.concatenate([hand, np.full((batch_size, 1), -1)], axis=1), shifted,
+                                             axis=1)
+
+                if turn == 6 and seat == player_count - 1:
+                    leftovers = hands[:, (np.arange(player_count) + deck_offset) % player_count, 0]
+                    kernel.finish_age(game_indexes, age + 1, leftovers)
+                elif seat == player_count - 1:
+                    kernel.finish_turn(game_indexes)
+                new_scores = kernel.scores()
+                episodes['reward'][:, step] = new_scores[:, seat] - scores[:, seat] + modifiers
+                scores[:, seat] = new_scores[:, seat]
+                step += 1
+
+    return episodes
@@ -0,0 +1,602 @@
+from functools import lru_cache
+
+import numpy as np
+
+from catalog import load_catalog
+from environment import Action, action_count, action_index, player_hand_size
+from game import Type, Resource, Science, science_scores
+
+# Effect opcodes, one row of the effect tables per effect of a structure or a wonder stage
+(OP_NONE, OP_GOLD, OP_PRODUCTION, OP_CHOICE_PRODUCTION, OP_DISCOUNT, OP_CIVILIAN_POINTS, OP_WONDER_POINTS, OP_SCIENCE,
+ OP_MILITARY, OP_BOARD_ELEMENT, OP_FREE_BUILD, OP_COPY_GUILD, OP_PLAY_DISCARDED, OP_PLAY_LAST_CARD) = range(14)
+
+# Board elements: the structure types, then the defeat tokens and the wonder stages
+DEFEAT_TOKEN = len(Type)
+WONDER_STAGES = len(Type) + 1
+board_element_count = len(Type) + 2
+# Sides of the per board element effects, LEFT and RIGHT are also the sides of the trade prices
+LEFT, SELF, RIGHT = range(3)
+side_indexes = {'LEFT': LEFT, 'SELF': SELF, 'RIGHT': RIGHT}
+wonder_sides = ('A', 'B')
+
+resource_indexes = dict((resource.name, resource.value - 1) for resource in Resource)
+unaffordable = np.iinfo(np.int32).max
+# Packs a production vector into one integer, no player produces 32 of a resource
+assignment_key_weights = 32 ** np.arange(len(Resource), dtype=np.int64)
+
+
+def resource_vector(resources):
+    vector = np.zeros(len(Resource), dtype=np.int32)
+    for resource, quantity in resources.items():
+        vector[resource_indexes[resource]] += quantity
+    return vector
+
+
+class RulesTables:
+    # Integer coded costs and effects of every structure and wonder stage of a catalog. Structures keep their catalog
+    # id as source id, wonder stages follow them.
+
+    def __init__(self, catalog):
+        stages = catalog.wonder_stages
+        self.structure_count = len(catalog.structures)
+        source_count = self.structure_count + len(stages)
+        effect_slots = max([1] + [len(stage['effects']) for stage in stages])
+        name_indexes = dict((name, index) for index, name in enumerate(catalog.structure_names))
+        self.name_count = len(name_indexes)
+
+        self.source_name = np.full(source_count, -1, dtype=np.int32)
+        self.chain_name = np.full(source_count, -1, dtype=np.int32)
+        self.cost_gold = np.zeros(source_count, dtype=np.int32)
+        self.cost_resources = np.zeros((source_count, len(Resource)), dtype=np.int32)
+        self.effect_op = np.zeros((source_count, effect_slots), dtype=np.int32)
+        self.effect_value = np.zeros((source_count, effect_slots), dtype=np.int32)
+        self.effect_gold = np.zeros((source_count, effect_slots), dtype=np.int32)
+        self.effect_resources = np.zeros((source_count, effect_slots, len(Resource)), dtype=np.int32)
+        self.effect_for_sale = np.zeros((source_count, effect_slots), dtype=bool)
+        self.effect_sides = np.zeros((source_count, effect_slots, 3), dtype=np.int32)
+        self.effect_elements = np.zeros((source_count, effect_slots, board_element_count), dtype=np.int32)
+        self.source_type = np.full(source_count, -1, dtype=np.int32)
+
+        for structure in catalog.structures:
+            source = structure['id']
+            self.source_name[source] = name_indexes[structure['name']]
+            self.source_type[source] = structure['type'].value - 1
+            if structure['cost'].get('structure') in name_indexes:
+                self.chain_name[source] = name_indexes[structure['cost']['structure']]
+            self.compile_cost(source, structure['cost'])
+            self.compile_effect(source, 0, structure['effect'], structure['type'])
+
+        for stage in stages:
+            source = self.structure_count + stage['id']
+            self.compile_cost(source, stage['cost'])
+            for slot, effect in enumerate(stage['effects']):
+                self.compile_effect(source, slot, effect, None)
+
+        # Wonder boards are indexed by wonder id * 2 + side
+        max_stages = max(len(wonder['sides'][side]['stages']) for wonder in catalog.wonders for side in wonder_sides)
+        board_count = len(catalog.wonders) * len(wonder_sides)
+        self.board_production = np.zeros((board_count, len(Resource)), dtype=np.int32)
+        self.board_stage_sources = np.full((board_count, max_stages + 1), -1, dtype=np.int32)
+        self.board_stage_count = np.zeros(board_count, dtype=np.int32)
+        for wonder in catalog.wonders:
+            for side_index, side in enumerate(wonder_sides):
+                board = wonder['id'] * len(wonder_sides) + side_index
+                self.board_production[board] = resource_vector(wonder['sides'][side]['production'])
+                self.board_stage_count[board] = len(wonder['sides'][side]['stages'])
+                for index, stage in enumerate(wonder['sides'][side]['stages']):
+                    self.board_stage_sources[board, index] = self.structure_count + stage['id']
+
+        # The guilds a copy_guild seat chooses from: points per (side, board element), or the science symbol
+        self.structure_value = catalog.structure_values
+        self.guild_sources = np.array(catalog.guild_ids, dtype=np.int32)
+        self.guild_names = self.source_name[self.guild_sources]
+        self.guild_board_points = (self.effect_sides[self.guild_sources, 0, :, None]
+                                   * self.effect_elements[self.guild_sources, 0, None, :]
+                                   * self.effect_value[self.guild_sources, 0, None, None])
+        self.guild_science = np.where(self.effect_op[self.guild_sources, 0] == OP_SCIENCE,
+                                      self.effect_value[self.guild_sources, 0], -1)
+
+    def compile_cost(self, source, cost):
+        self.cost_gold[source] = cost['gold']
+        self.cost_resources[source] = resource_vector(cost['resources'])
+
+    def compile_effect(self, source, slot, effect, structure_type):
+        if 'gold' in effect:
+            self.effect_op[source, slot] = OP_GOLD
+            self.effect_value[source, slot] = effect['gold']
+
+        elif 'production' in effect:
+            production = effect['production']
+            self.effect_op[source, slot] = OP_PRODUCTION if len(production) == 1 else OP_CHOICE_PRODUCTION
+            self.effect_resources[source, slot] = resource_vector(production)
+            self.effect_for_sale[source, slot] = structure_type in [Type.RAW_MATERIAL, Type.MANUFACTURED_GOOD]
+
+        elif 'discount' in effect:
+            discount = effect['discount']
+            self.effect_op[source, slot] = OP_DISCOUNT
+            self.effect_value[source, slot] = discount['price']
+            self.effect_resources[source, slot] = resource_vector(dict.fromkeys(discount['resources'], 1))
+            for neighbor in discount['neighbor']:
+                self.effect_sides[source, slot, side_indexes[neighbor]] = 1
+
+        elif 'points' in effect:
+            if structure_type == Type.CIVILIAN:
+                self.effect_op[source, slot] = OP_CIVILIAN_POINTS
+            elif structure_type is None:
+                self.effect_op[source, slot] = OP_WONDER_POINTS
+            self.effect_value[source, slot] = effect['points']
+
+        elif 'science' in effect:
+            self.effect_op[source, slot] = OP_SCIENCE
+            self.effect_value[source, slot] = effect['science'].value - 1
+
+        elif 'military' in effect:
+            self.effect_op[source, slot] = OP_MILITARY
+            self.effect_value[source, slot] = effect['military']
+
+        elif 'perBoardElement' in effect:
+            per_board_element = effect['perBoardElement']
+            self.effect_op[source, slot] = OP_BOARD_ELEMENT
+            self.effect_value[source, slot] = per_board_element['points']
+            self.effect_gold[source, slot] = per_board_element['gold']
+            for neighbor in per_board_element['neighbors']:
+                self.effect_sides[source, slot, side_indexes[neighbor]] = 1
+            if per_board_element['type'] == 'CARD':
+                for card_type in per_board_element['cardType']:
+                    self.effect_elements[source, slot, card_type.value - 1] = 1
+            elif per_board_element['type'] == 'DEFEAT_TOKEN':
+                self.effect_elements[source, slot, DEFEAT_TOKEN] = 1
+            elif per_board_element['type'] == 'WONDER_STAGES':
+                self.effect_elements[source, slot, WONDER_STAGES] = 1
+
+        elif 'action' in effect:
+            if effect['action'] == 'FREE_BUILD':
+                self.effect_op[source, slot] = OP_FREE_BUILD
+            elif effect['action'] == 'COPY_GUILD':
+                self.effect_op[source, slot] = OP_COPY_GUILD
+            elif effect['action'] == 'PLAY_DISCARDED':
+                self.effect_op[source, slot] = OP_PLAY_DISCARDED
+            elif effect['action'] == 'PLAY_LAST_CARD':
+                self.effect_op[source, slot] = OP_PLAY_LAST_CARD
+
+
+# Most (structure, own assignment, left assignment, right assignment) combinations build_costs prices in one group
+padded_pricing_size = 4096
+
+
+@lru_cache(maxsize=None)
+def load_tables():
+    return RulesTables(load_catalog())
+
+
+def purchase_costs(shortfall, left_available, left_price, right_available, right_price):
+    # Gold paid to the neighbors for the shortfall of every resource, buying from the cheapest neighbor first.
+    # Broadcasts over any leading dimensions and returns `unaffordable` when the neighbors do not have enough.
+    left_first = left_price <= right_price
+    first_available = np.where(left_first, left_available, right_available)
+    first_price = np.where(left_first, left_price, right_price)
+    second_price = np.where(left_first, right_price, left_price)
+    bought = np.minimum(first_available, shortfall)
+    price = (bought * first_price + (shortfall - bought) * second_price).sum(axis=-1)
+    feasible = np.all(shortfall <= left_available + right_available, axis=-1)
+    return np.where(feasible, price, unaffordable)
+
+
+class RulesKernel:
+    # The rules of game.Player over flat arrays indexed by (game, seat), for `batch_size` games at once.
+    # Every operation takes parallel arrays of game and seat indexes, a (game, seat) pair must appear at most once per
+    # call. "Either/or" productions are kept as the table of every production vector they can assign, so that the
+    # payment of any number of structures is one broadcast over (structure, assignment, neighbor assignments,
+    # resource). The "either/or" productions for sale have their own table, a neighbor buys one option of each.
+    # The tables are as wide as the longest one of the batch, their counts say how many rows of each seat are used.
+
+    def __init__(self, batch_size, player_count, tables=None):
+        self.tables = tables if tables is not None else load_tables()
+        self.batch_size = batch_size
+        self.player_count = player_count
+        shape = (batch_size, player_count)
+
+        self.board = np.zeros(shape, dtype=np.int32)
+        self.coins = np.zeros(shape, dtype=np.int32)
+        self.shields = np.zeros(shape, dtype=np.int32)
+        self.defeat_tokens = np.zeros(shape, dtype=np.int32)
+        self.victory_points = np.zeros(shape, dtype=np.int32)
+        self.wonder_points = np.zeros(shape, dtype=np.int32)
+        self.civilian_points = np.zeros(shape, dtype=np.int32)
+        self.wonder_stage = np.zeros(shape, dtype=np.int32)
+        self.free_build_available = np.zeros(shape, dtype=bool)
+        self.free_build_used = np.zeros(shape, dtype=bool)
+        self.copy_guild = np.zeros(shape, dtype=bool)
+        self.discarded_plays = np.zeros(shape, dtype=np.int32)
+        self.play_last_card = np.zeros(shape, dtype=bool)
+        # Discard pile of every game, the number of copies of every structure id
+        self.discard_pile = np.zeros((batch_size, self.tables.structure_count), dtype=np.int32)
+        self.scientific_symbols = np.zeros(shape + (len(Science),), dtype=np.int32)
+        self.structure_type_counts = np.zeros(shape + (len(Type),), dtype=np.int32)
+        self.built_names = np.zeros(shape + (self.tables.name_count,), dtype=bool)
+        self.built_structures = np.zeros(shape + (self.tables.structure_count,), dtype=bool)
+        self.productions = np.zeros(shape + (len(Resource),), dtype=np.int32)
+        # Fixed productions plus every option of the "either/or" ones, as the productions of Player.board
+        self.production_totals = np.zeros(shape + (len(Resource),), dtype=np.int32)
+        self.choice_productions = np.zeros(shape + (1, len(Resource)), dtype=np.int32)
+        self.choice_production_counts = np.ones(shape, dtype=np.int32)
+        self.resources_for_sale = np.zeros(shape + (len(Resource),), dtype=np.int32)
+        self.choices_for_sale = np.zeros(shape + (1, len(Resource)), dtype=np.int32)
+        self.choice_for_sale_counts = np.ones(shape, dtype=np.int32)
+        self.commerce = np.zeros(shape + (2, len(Resource)), dtype=np.int32)
+        self.board_element_points = np.zeros(shape + (3, board_element_count), dtype=np.int32)
+
+        self.seats = np.arange(player_count)
+
+    def reset(self, games, boards):
+        # boards[game, seat] is wonder id * 2 + side
+        for array in (self.coins, self.shields, self.defeat_tokens, self.victory_points, self.wonder_points,
+                      self.civilian_points, self.wonder_stage, self.free_build_available, self.free_build_used,
+                      self.copy_guild, self.discarded_plays, self.play_last_card, self.scientific_symbols,
+                      self.structure_type_counts, self.built_names, self.built_structures, self.choice_productions,
+                      self.choices_for_sale, self.board_element_points, self.discard_pile):
+            array[games] = 0
+        self.choice_production_counts[games] = 1
+        self.choice_for_sale_counts[games] = 1
+        self.board[games] = boards
+        self.coins[games] = 3
+        self.productions[games] = self.tables.board_production[boards]
+        self.production_totals[games] = self.tables.board_production[boards]
+        self.resources_for_sale[games] = self.tables.board_production[boards]
+        self.commerce[games] = 2
+
+    def neighbors(self, players):
+        return (players - 1) % self.player_count, (players + 1) % self.player_count
+
+    def board_element_counts(self, games):
+        return np.concatenate([self.structure_type_counts[games], self.defeat_tokens[games][..., None],
+                               self.wonder_stage[games][..., None]], axis=-1)
+
+    def next_stage_sources(self, games, players):
+        return self.tables.board_stage_sources[self.board[games, players], self.wonder_stage[games, players]]
+
+    def free_build_ready(self, games, players):
+        return self.free_build_available[games, players] & ~self.free_build_used[games, players]
+
+    def build_costs(self, games, players, sources, free_build=True):
+        # Gold cost to build every source for the matching (game, seat), -1 when the resources cannot be gathered, the
+        # seat already built a structure of the name or the source is -1. games, players and sources broadcast
+        # together. free_build makes the structures free for the seats that have not used their free build of the age.
+        tables = self.tables
+        games, players, sources = np.broadcast_arrays(games, players, sources)
+        valid = sources >= 0
+        sources = np.where(valid, sources, 0)
+
+        # Only the structures the fixed productions do not cover go through the "either/or" assignments and trade
+        shortfall = np.maximum(tables.cost_resources[sources] - self.productions[games, players], 0)
+        payment = np.zeros(sources.shape, dtype=np.int32)
+        pending = np.nonzero(shortfall.any(axis=-1))
+        if len(pending[0]):
+            g, p = games[pending], players[pending]
+            left, right = self.neighbors(p)
+            # Structures are priced in groups of seats with the same table counts, over the used rows only. A few
+            # structures are priced at once over the widest counts, the padding rows are zeros, which never cost less.
+            counts = np.stack([self.choice_production_counts[g, p], self.choice_for_sale_counts[g, left],
+                               self.choice_for_sale_counts[g, right]], axis=1)
+            widest = counts.max(axis=0)
+            if len(g) * widest.prod() <= padded_pricing_size:
+                groups = [(widest, np.arange(len(g)))]
+            else:
+                width = max(self.choice_productions.shape[2], self.choices_for_sale.shape[2]) + 1
+                keys = (counts[:, 0] * width + counts[:, 1]) * width + counts[:, 2]
+                _, firsts, group_indexes = np.unique(keys, return_index=True, return_inverse=True)
+                groups = [(counts[first], np.flatnonzero(group_indexes == group)) for group, first in enumerate(firsts)]
+            pending_payment = np.zeros(len(g), dtype=np.int32)
+            for (own_count, left_count, right_count), rows in groups:
+                rg, rp, rl, rr = g[rows], p[rows], left[rows], right[rows]
+                own = self.choice_productions[rg, rp, :own_count]
+                left_supply = self.resources_for_sale[rg, rl][:, None, :] + self.choices_for_sale[rg, rl, :left_count]
+                right_supply = (self.resources_for_sale[rg, rr][:, None, :]
+                                + self.choices_for_sale[rg, rr, :right_count])
+                # (structure, own assignment, left assignment, right assignment, resource)
+                pending_payment[rows] = purchase_costs(
+                    np.maximum(shortfall[pending][rows][:, None, :] - own, 0)[:, :, None, None, :],
+                    left_supply[:, None, :, None, :],
+                    self.commerce[rg, rp, 0][:, None, None, None, :],
+                    right_supply[:, None, None, :, :],
+                    self.commerce[rg, rp, 1][:, None, None, None, :]
+                ).min(axis=(1, 2, 3))
+            payment[pending] = pending_payment
+
+        costs = np.where(payment == unaffordable, -1, tables.cost_gold[sources] + payment)
+        chain_names = tables.chain_name[sources]
+        chained = (chain_names >= 0) & self.built_names[games, players, np.maximum(chain_names, 0)]
+        costs = np.where(chained, 0, costs)
+        if free_build:
+            costs = np.where((sources < tables.structure_count) & self.free_build_ready(games, players), 0, costs)
+        return np.where(valid & ~self.built_already(games, players, sources), costs, -1)
+
+    def built_already(self, games, players, sources):
+        # Whether the seat built a structure of the name of the source, never for a wonder stage
+        names = self.tables.source_name[sources]
+        return (names >= 0) & self.built_names[games, players, np.maximum(names, 0)]
+
+    def affordable_costs(self, games, players, sources, free_build=True):
+        costs = self.build_costs(games, players, sources, free_build)
+        return np.where(self.coins[games, players] >= costs, costs, -1)
+
+    def legal_actions(self, games, players, hands):
+        # The vectorized environment.legal_actions: hands[i] holds the structure ids of the hand of
+        # (games[i], players[i]), -1 for an empty slot
+        mask = np.zeros((len(games), len(Action), player_hand_size), dtype=np.float32)
+        costs = np.zeros((len(games), len(Action), player_hand_size), dtype=np.float32)
+        in_hand = hands >= 0
+
+        # The next wonder stage is priced with the hand, as an eighth source
+        sources = np.concatenate([hands, self.next_stage_sources(games, players)[:, None]], axis=1)
+        all_costs = self.affordable_costs(games[:, None], players[:, None], sources)
+        structure_costs, stage_costs = all_costs[:, :-1], all_costs[:, -1:]
+
+        mask[:, Action.DISCARD.value] = in_hand
+        mask[:, Action.BUILD_WONDER_STAGE.value] = in_hand & (stage_costs >= 0)
+        costs[:, Action.BUILD_WONDER_STAGE.value] = np.where(in_hand & (stage_costs >= 0), stage_costs, 0)
+        mask[:, Action.BUILD_STRUCTURE.value] = structure_costs >= 0
+        costs[:, Action.BUILD_STRUCTURE.value] = np.maximum(structure_costs, 0)
+        return mask.reshape(len(games), action_count), costs.reshape(len(games), action_count)
+
+    def play(self, games, players, actions, structures):
+        # Resolves one action per (game, seat): costs are paid against the state before the call, then every build is
+        # counted on the boards, then the effects are applied. Returns the reward modifiers of game.Player, -3 for an
+        # impossible build, which discards the structure instead. A structure that is not free uses the free build.
+        # Discarded structures go to the discard pile.
+        tables = self.tables
+        games = np.asarray(games)
+        players = np.asarray(players)
+        actions = np.asarray(actions)
+        structures = np.asarray(structures)
+
+        build_structure = actions == Action.BUILD_STRUCTURE.value
+        build_stage = actions == Action.BUILD_WONDER_STAGE.value
+        sources = np.where(build_structure, structures, -1)
+        sources = np.where(build_stage, self.next_stage_sources(games, players), sources)
+        costs = self.affordable_costs(games, players, sources, free_build=False)
+        free = (build_structure & (costs != 0) & self.free_build_ready(games, players)
+                & ~self.built_already(games, players, sources))
+        self.free_build_used[games[free], players[free]] = True
+        costs = np.where(free, 0, costs)
+
+        built = (build_structure | build_stage) & (costs >= 0)
+        modifiers = np.where((build_structure | build_stage) & ~built, -3, 0)
+        self.coins[games, players] += np.where(built, -costs, 3)
+        np.add.at(self.discard_pile, (games[~built], structures[~built]), 1)
+
+        self.construct(games[built], players[built], sources[built])
+        return modifiers
+
+    def construct(self, games, players, sources):
+        # Counts the paid for structures and wonder stages on the boards and applies their effects
+        tables = self.tables
+        is_structure = sources < tables.structure_count
+        structure_games, structure_players = games[is_structure], players[is_structure]
+        self.built_names[structure_games, structure_players, tables.source_name[sources[is_structure]]] = True
+        self.built_structures[structure_games, structure_players, sources[is_structure]] = True
+        self.structure_type_counts[structure_games, structure_players, tables.source_type[sources[is_structure]]] += 1
+        self.wonder_stage[games[~is_structure], players[~is_structure]] += 1
+
+        for slot in np.flatnonzero((tables.effect_op[sources] != OP_NONE).any(axis=0)):
+            self.apply_effects(games, players, sources, slot)
+
+    def apply_effects(self, games, players, sources, slot):
+        # Only the operations of the slot are applied, a step builds a handful of sources
+        tables = self.tables
+        ops = tables.effect_op[sources, slot]
+        values = tables.effect_value[sources, slot]
+        present = set(ops.tolist())
+
+        if OP_GOLD in present:
+            selected = ops == OP_GOLD
+            self.coins[games[selected], players[selected]] += values[selected]
+
+        for op in present & {OP_PRODUCTION, OP_CHOICE_PRODUCTION}:
+            selected = ops == op
+            g, p, s = games[selected], players[selected], sources[selected]
+            resources = tables.effect_resources[s, slot]
+            for_sale = tables.effect_for_sale[s, slot]
+            self.production_totals[g, p] += resources
+            if op == OP_PRODUCTION:
+                self.productions[g, p] += resources
+                self.resources_for_sale[g, p] += resources * for_sale[:, None]
+            else:
+                for game, player, options, sold in zip(g, p, resources, for_sale):
+                    self.choice_productions = self.add_choice_production(
+                        self.choice_productions, self.choice_production_counts, game, player, options)
+                    if sold:
+                        self.choices_for_sale = self.add_choice_production(
+                            self.choices_for_sale, self.choice_for_sale_counts, game, player, options)
+
+        if OP_DISCOUNT in present:
+            selected = ops == OP_DISCOUNT
+            for side, commerce_side in ((LEFT, 0), (RIGHT, 1)):
+                side_selected = selected & (tables.effect_sides[sources, slot, side] == 1)
+                g, p, s = games[side_selected], players[side_selected], sources[side_selected]
+                self.commerce[g, p, commerce_side] = np.where(tables.effect_resources[s, slot] > 0,
+                                                              values[side_selected][:, None],
+                                                              self.commerce[g, p, commerce_side])
+
+        for op, points in ((OP_CIVILIAN_POINTS, self.civilian_points), (OP_WONDER_POINTS, self.wonder_points),
+                           (OP_MILITARY, self.shields)):
+            if op in present:
+                selected = ops == op
+                points[games[selected], players[selected]] += values[selected]
+        if OP_SCIENCE in present:
+            selected = ops == OP_SCIENCE
+            self.scientific_symbols[games[selected], players[selected], values[selected]] += 1
+
+        if OP_BOARD_ELEMENT in present:
+            selected = ops == OP_BOARD_ELEMENT
+            g, p, s = games[selected], players[selected], sources[selected]
+            sides = tables.effect_sides[s, slot]
+            elements = tables.effect_elements[s, slot]
+            left, right = self.neighbors(p)
+            counts = np.stack([self.board_element_counts(g)[np.arange(len(g)), seats]
+                               for seats in (left, p, right)], axis=1)
+            count = (sides[:, :, None] * elements[:, None, :] * counts).sum(axis=(1, 2))
+            self.coins[g, p] += count * tables.effect_gold[s, slot]
+            self.board_element_points[g, p] += (
+                    sides[:, :, None] * elements[:, None, :] * values[selected][:, None, None])
+
+        for op, flags in ((OP_FREE_BUILD, self.free_build_available), (OP_COPY_GUILD, self.copy_guild),
+                          (OP_PLAY_LAST_CARD, self.play_last_card)):
+            if op in present:
+                selected = ops == op
+                flags[games[selected], players[selected]] = True
+        if OP_PLAY_DISCARDED in present:
+            selected = ops == OP_PLAY_DISCARDED
+            self.discarded_plays[games[selected], players[selected]] += 1
+
+    @staticmethod
+    def add_choice_production(table, counts, game, player, options):
+        # Every assignment of the new "either/or" production on top of the known ones of the table, duplicates
+        # removed, and counts[game, player] updated. The rows past the count are padding. Returns the table, grown
+        # when needed.
+        option_vectors = np.diag(options)[options > 0]
+        assignments = (table[game, player, :counts[game, player]][:, None, :] + option_vectors[None, :, :])
+        assignments = assignments.reshape(-1, len(Resource))
+        _, unique_indexes = np.unique(assignments @ assignment_key_weights, return_index=True)
+        assignments = assignments[unique_indexes]
+
+        length = table.shape[2]
+        if len(assignments) > length:
+            padding = np.zeros(table.shape[:2] + (max(len(assignments), 2 * length) - length, len(Resource)),
+                               dtype=table.dtype)
+            table = np.concatenate([table, padding], axis=2)
+        table[game, player, :len(assignments)] = assignments
+        counts[game, player] = len(assignments)
+        return table
+
+    def finish_turn(self, games):
+        # As environment.resolve_discarded_plays: every pending play builds the most valuable discarded structure
+        # the seat has not built yet for free, the same heuristic pick in place of a decision of the agent
+        tables = self.tables
+        games = np.asarray(games)
+        rows, seats = np.nonzero(self.discarded_plays[games] > 0)
+        for game, seat in zip(games[rows], seats):
+            while self.discarded_plays[game, seat]:
+                self.discarded_plays[game, seat] -= 1
+                pile = self.discard_pile[game]
+                candidates = (pile > 0) & ~self.built_names[game, seat, tables.source_name[:tables.structure_count]]
+                if not candidates.any():
+                    continue
+                structure = np.argmax(np.where(candidates, tables.structure_value, -np.inf))
+                pile[structure] -= 1
+                self.construct(np.array([game]), np.array([seat]), np.array([structure]))
+
+    def finish_age(self, games, age, leftovers):
+        # leftovers[i, seat] is the structure left in the hand of the seat of games[i], -1 for none. A play_last_card
+        # seat plays it as environment.play_last_card, the others discard it. Then the discarded plays of the last turn
+        # are resolved as finish_turn, the military conflicts too and the free builds come back, age is the age that
+        # starts. finish_age replaces finish_turn at the end of the last turn.
+        games = np.asarray(games)
+        leftovers = np.asarray(leftovers)
+        rows, seats = np.nonzero(leftovers >= 0)
+        last_games, structures = games[rows], leftovers[rows, seats]
+        last = self.play_last_card[last_games, seats]
+        np.add.at(self.discard_pile, (last_games[~last], structures[~last]), 1)
+        if last.any():
+            last_games, seats, structures = last_games[last], seats[last], structures[last]
+            hands = np.full((len(structures), player_hand_size), -1, dtype=np.int32)
+            hands[:, 0] = structures
+            mask, _ = self.legal_actions(last_games, seats, hands)
+            actions = np.where(mask[:, action_index(Action.BUILD_STRUCTURE.value, 0)] > 0, Action.BUILD_STRUCTURE.value,
+                               np.where(mask[:, action_index(Action.BUILD_WONDER_STAGE.value, 0)] > 0,
+                                        Action.BUILD_WONDER_STAGE.value, Action.DISCARD.value))
+            self.play(last_games, seats, actions, structures)
+
+        self.finish_turn(games)
+        self.resolve_military_conflicts(games, age)
+        self.free_build_used[games] = False
+
+    def resolve_military_conflicts(self, games, age):
+        # age is one age for all the games or one per game
+        age = np.asarray(age)[..., None]
+        for neighbor_shields in (np.roll(self.shields[games], 1, axis=1), np.roll(self.shields[games], -1, axis=1)):
+            self.defeat_tokens[games] += neighbor_shields > self.shields[games]
+            self.victory_points[games] += np.where(neighbor_shields < self.shields[games], age * 2 - 1, 0)
+
+    def science_scores(self, games, extra_symbol=None):
+        # One gather from game.science_scores, the best assignment of the "any" symbols
+        symbols = self.scientific_symbols[games]
+        if extra_symbol is not None:
+            symbols = symbols + np.eye(len(Science), dtype=np.int32)[extra_symbol]
+        return science_scores[symbols[..., 0], symbols[..., 1], symbols[..., 2], symbols[..., 3]]
+
+    def board_scores(self, games):
+        counts = self.board_element_counts(games)
+        neighbor_counts = np.stack([np.roll(counts, 1, axis=1), counts, np.roll(counts, -1, axis=1)], axis=2)
+        return (self.board_element_points[games] * neighbor_counts).sum(axis=(2, 3))
+
+    def copied_guild_scores(self, games):
+        # As game.Player.copied_guild_points, for the seats with copy_guild
+        tables = self.tables
+        copy_guild = self.copy_guild[games]
+        if not copy_guild.any():
+            return np.zeros(copy_guild.shape, dtype=np.int32)
+
+        built = self.built_names[games][..., tables.guild_names]
+        available = np.roll(built, 1, axis=1) | np.roll(built, -1, axis=1)
+        counts = self.board_element_counts(games)
+        neighbor_counts = np.stack([np.roll(counts, 1, axis=1), counts, np.roll(counts, -1, axis=1)], axis=2)
+        points = np.einsum('gpse,kse->gpk', neighbor_counts, tables.guild_board_points)
+        science = self.science_scores(games)
+        for guild in np.flatnonzero(tables.guild_science >= 0):
+            points[..., guild] = self.science_scores(games, tables.guild_science[guild]) - science
+        return np.where(copy_guild, np.where(available, points, 0).max(axis=-1), 0)
+
+    def boards(self, games=slice(None)):
+        # game.Player.board of every seat, the players_board observation rows
+        return np.concatenate([self.production_totals[games], self.shields[games, :, None],
+                               self.defeat_tokens[games, :, None], self.wonder_stage[games, :, None],
+                               self.scientific_symbols[games], self.built_structures[games]], axis=-1).astype(np.float32)
+
+    def scores(self, games=slice(None)):
+        return (self.victory_points[games] - self.defeat_tokens[games] + self.coins[games] // 3
+                + self.wonder_points[games] + self.civilian_points[games] + self.science_scores(games)
+                + self.board_scores(games) + self.copied_guild_scores(games))
+
+
+def play_random_games(kernel, rng, catalog=None, random_sides=False):
+    # One random legal game on every game of the kernel, all seats acting at once and hands passed every turn.
+    # Wonders are on side A, or on a random side with random_sides. Returns the final scores.
+    catalog = catalog if catalog is not None else load_catalog()
+    batch_size, player_count = kernel.batch_size, kernel.player_count
+    games = np.repeat(np.arange(batch_size), player_count)
+    players = np.tile(np.arange(player_count), batch_size)
+
+    wonder_ids = np.argsort(rng.random((batch_size, len(catalog.wonders))), axis=1)[:, :player_count]
+    sides = rng.integers(len(wonder_sides), size=wonder_ids.shape) if random_sides else 0
+    kernel.reset(np.arange(batch_size), wonder_ids * len(wonder_sides) + sides)
+
+    for age in (1, 2, 3):
+        structures = np.array(catalog.age_structures(age, player_count), dtype=np.int32)
+        decks = np.tile(structures, (batch_size, 1))
+        if age == 3:
+            guilds = np.array(catalog.guild_ids, dtype=np.int32)
+            chosen = np.argsort(rng.random((batch_size, len(guilds))), axis=1)[:, :player_count + 2]
+            decks = np.concatenate([decks, guilds[chosen]], axis=1)
+        decks = np.take_along_axis(decks, np.argsort(rng.random(decks.shape), axis=1), axis=1)
+        hands = np.full((batch_size, player_count, player_hand_size), -1, dtype=np.int32)
+        for seat in range(player_count):
+            deck = decks[:, seat::player_count]
+            hands[:, seat, :deck.shape[1]] = deck
+
+        for turn in range(6):
+            mask, _ = kernel.legal_actions(games, players, hands.reshape(-1, player_hand_size))
+            mask = mask.reshape(len(games), -1)
+            choices = np.argmax(rng.random(mask.shape) * mask, axis=1)
+            actions = choices // player_hand_size
+            slots = choices % player_hand_size
+            flat_hands = hands.reshape(-1, player_hand_size)
+            kernel.play(games, players, actions, flat_hands[np.arange(len(games)), slots])
+            flat_hands[np.arange(len(games)), slots] = -1
+            if turn < 5:
+                kernel.finish_turn(np.arange(batch_size))
+                hands = np.roll(hands, 1 if age == 2 else -1, axis=1)
+
+        kernel.finish_age(np.arange(batch_size), age + 1, hands.max(axis=2))
+
+    return kernel.scores()
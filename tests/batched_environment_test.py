@@ -0,0 +1,110 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from batched_environment import BatchedGameEnvironment
+from collector import episode_length
+from environment import Action, GameEnvironment, action_count, action_index, copy_time_step, replay_episode
+
+
+class BatchedGameEnvironmentTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_init(self):
+        env = BatchedGameEnvironment(4, 3, seed=0)
+        self.assertTrue(env.batched)
+        self.assertEqual(env.batch_size, 4)
+        self.assertEqual(env.hands.shape, (4, 3, 7))
+        self.assertTrue(np.all(env.hand_sizes == 7))
+        self.assertTrue(np.all(env.coins == 3))
+
+    def test_step(self):
+        env = BatchedGameEnvironment(4, 3, seed=0)
+        step = env.reset()
+        self.assertEqual(step.observation['player_hand'].shape, (4, 7, 27))
+
+        step = env.step(np.full(4, action_index(Action.DISCARD.value, 0)))
+        self.assertEqual(step.reward.shape, (4,))
+        self.assertTrue(np.all(env.coins[:, 0] == 6))
+        self.assertTrue(np.all(env.current_player_index == 1))
+        self.assertTrue(np.all(env.hand_sizes[:, 0] == 6))
+
+    def test_observation_buffers(self):
+        env = BatchedGameEnvironment(2, 3, seed=0, observe=False)
+        self.assertIsNone(env.reset().observation)
+        batch = dict((key, np.zeros((5, 2) + spec.shape, spec.dtype)) for key, spec in env.observation_spec().items())
+        env.set_observation_buffers(dict((key, array[3]) for key, array in batch.items()))
+        observation = env.to_observation()
+        self.assertTrue(np.shares_memory(observation['player_hand'], batch['player_hand']))
+        self.assertTrue(np.all(batch['players_coins'][3] == 3))
+        self.assertTrue(np.all(batch['legal_actions'][3, :, action_index(Action.DISCARD.value, np.arange(7))] == 1))
+        self.assertFalse(np.any(batch['legal_actions'][2]))
+
+    def test_board_observation(self):
+        env = BatchedGameEnvironment(2, 3, seed=0, board_observations=True)
+        env.reset()
+        observation = env.step(np.full(2, action_index(Action.BUILD_WONDER_STAGE.value, 0))).observation
+        self.assertEqual(observation['players_board'].shape, (2, 3, env.boards.shape[2]))
+        # Seat 1 acts, the seat that just played is its left neighbor, the last row
+        np.testing.assert_array_equal(observation['players_board'][:, 2], env.boards[:, 0])
+        np.testing.assert_array_equal(observation['players_board'][:, 0], env.boards[:, 1])
+
+    def test_episode(self):
+        env = BatchedGameEnvironment(2, 3, seed=0)
+        env.reset()
+        for _ in range(3 * 6 * 3 - 1):
+            step = env.step(np.full(2, action_index(Action.DISCARD.value, 0)))
+            self.assertTrue(np.all(step.step_type == 1))
+        step = env.step(np.full(2, action_index(Action.DISCARD.value, 0)))
+        self.assertTrue(np.all(step.is_last()))
+        step = env.step(np.full(2, action_index(Action.DISCARD.value, 0)))
+        self.assertTrue(np.all(step.is_first()))
+
+    def test_replay_in_game_environment(self):
+        for player_count, wonder_side in ((3, 'A'), (7, 'B')):
+            env = BatchedGameEnvironment(2, player_count, seed=0, wonder_side=wonder_side)
+            env.reset()
+            episode_seed = int(env.episode_seeds[1])
+            rng = np.random.default_rng(0)
+            actions = []
+            for _ in range(player_count * 6 * 3):
+                action = rng.integers(action_count, size=2)
+                actions.append(action[1])
+                env.step(action)
+            scores = list(env.kernel.scores()[1])
+
+            replay_env = GameEnvironment(player_count, wonder_side=wonder_side)
+            replay_episode(replay_env, episode_seed, actions)
+            self.assertEqual([player.score() for player in replay_env.players], scores)
+            self.assertTrue(np.array_equal(replay_env.discarded_structures, env.discarded_structures[1]))
+
+    def test_matches_game_environment(self):
+        # Random legal episodes replay to the same time steps in GameEnvironment, board observations included
+        rng = np.random.default_rng(0)
+        for player_count, wonder_side in itertools.product(range(3, 8), ('A', 'B', 'random')):
+            env = BatchedGameEnvironment(3, player_count, seed=player_count, board_observations=True,
+                                         wonder_side=wonder_side)
+            steps = [copy_time_step(env.reset())]
+            episode_seeds = env.episode_seeds.copy()
+            actions = []
+            for _ in range(episode_length(player_count)):
+                mask = steps[-1].observation['legal_actions']
+                actions.append(np.argmax(rng.random(mask.shape) * mask, axis=1))
+                steps.append(copy_time_step(env.step(actions[-1])))
+
+            for game in range(3):
+                replay_env = GameEnvironment(player_count, board_observations=True, wonder_side=wonder_side)
+                replay_steps = replay_episode(replay_env, int(episode_seeds[game]),
+                                              [action[game] for action in actions])
+                for step, replay_step in zip(steps, replay_steps):
+                    self.assertEqual(step.step_type[game], replay_step.step_type)
+                    self.assertEqual(step.reward[game], replay_step.reward)
+                    for key, value in replay_step.observation.items():
+                        np.testing.assert_array_equal(step.observation[key][game], value, key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from benchmark import compare, metric, run
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_run(self):
+        results = run(player_counts=(3,), episodes=1, number=10)
+        self.assertGreater(results['episodes_per_second/3']['value'], 0)
+        self.assertGreater(results['peak_memory_per_game/3']['value'], 0)
+        self.assertGreater(results['batched_episodes_per_second/3']['value'], 0)
+        self.assertGreater(results['kernel_episodes_per_second/3']['value'], 0)
+        self.assertGreater(results['replay_episodes_per_second/3']['value'], 0)
+        self.assertGreater(results['random_side_episodes_per_second/3']['value'], 0)
+        self.assertGreater(results['kernel_random_side_episodes_per_second/3']['value'], 0)
+        for name in ['build_cost', 'build_cost_cold', 'score', 'science_score', 'to_observation',
+                     'shuffle_age_structures']:
+            self.assertGreater(results[name + '/3']['value'], 0)
+
+    def test_compare(self):
+        baseline = {
+            'episodes_per_second/3': metric(100.0, 'episodes/s', True),
+            'score/3': metric(1e-6, 's/call', False),
+        }
+        results = {
+            'episodes_per_second/3': metric(90.0, 'episodes/s', True),
+            'score/3': metric(1.5e-6, 's/call', False),
+            'to_observation/3': metric(1e-5, 's/call', False),
+        }
+        self.assertEqual([regression[0] for regression in compare(results, baseline, 0.2)], ['score/3'])
+        self.assertEqual([regression[0] for regression in compare(results, baseline, 0.05)],
+                         ['episodes_per_second/3', 'score/3'])
+        self.assertEqual(compare(results, baseline, 0.6), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
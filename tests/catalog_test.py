@@ -0,0 +1,76 @@
+import copy
+import pickle
+import unittest
+
+from catalog import FrozenDict, load_catalog
+from game import Science, Type, any_symbol_limit, science_symbol_limit
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = load_catalog()
+
+    def test_catalog_is_loaded_once(self):
+        self.assertIs(load_catalog(), self.catalog)
+
+    def test_structures_are_integer_indexed(self):
+        for structure_id, structure in enumerate(self.catalog.structures):
+            self.assertEqual(structure['id'], structure_id)
+        for stage_id, stage in enumerate(self.catalog.wonder_stages):
+            self.assertEqual(stage['id'], stage_id)
+
+    def test_age_structures_are_filtered_by_player_count(self):
+        for player_count in [3, 7]:
+            self.assertEqual(len(self.catalog.age_structures(1, player_count)), player_count * 7)
+            self.assertEqual(len(self.catalog.age_structures(2, player_count)), player_count * 7)
+            self.assertEqual(len(self.catalog.age_structures(3, player_count)) + player_count + 2, player_count * 7)
+
+    def test_science_symbols_fit_the_score_table(self):
+        symbols = [structure['effect']['science'] for structure in self.catalog.structures
+                   if 'science' in structure['effect']]
+        for symbol in (Science.WHEEL, Science.COMPASS, Science.TABLET):
+            self.assertLessEqual(symbols.count(symbol), science_symbol_limit)
+        # A copied Scientists Guild adds one "any" symbol
+        stage_any = max(sum(effect.get('science') == Science.ANY for stage in wonder['sides'][side]['stages']
+                            for effect in stage['effects']) for wonder in self.catalog.wonders for side in 'AB')
+        self.assertLessEqual(symbols.count(Science.ANY) + stage_any + 1, any_symbol_limit)
+
+    def test_effects_are_decoded(self):
+        structures = dict((s['name'], s) for s in self.catalog.structures)
+        self.assertEqual(structures['Apothecary']['effect']['science'], Science.COMPASS)
+        self.assertEqual(structures['Haven']['effect']['perBoardElement']['cardType'], (Type.RAW_MATERIAL,))
+
+    def test_records_are_frozen(self):
+        structure = self.catalog.structures[0]
+        with self.assertRaises(TypeError):
+            structure['age'] = 2
+        with self.assertRaises(TypeError):
+            structure['cost']['resources'].update({'WOOD': 1})
+        stages = self.catalog.wonders[0]['sides']['A']['stages']
+        self.assertIsInstance(stages, tuple)
+        self.assertIs(self.catalog.wonder_stages[stages[0]['id']], stages[0])
+        for copied in (pickle.loads(pickle.dumps(self.catalog.wonders)), copy.deepcopy(self.catalog.wonders)):
+            self.assertEqual(copied, self.catalog.wonders)
+            self.assertIsInstance(copied[0]['sides'], FrozenDict)
+
+    def test_structure_features(self):
+        structures = dict((s['name'], s) for s in self.catalog.structures)
+        self.assertEqual(self.catalog.structure_features.shape, (len(self.catalog.structures) + 1, 27))
+        self.assertFalse(self.catalog.structure_features[-1].any())
+
+        tree_farm = self.catalog.structure_features[structures['Tree Farm']['id']]
+        self.assertEqual(list(tree_farm[:8]), [1, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(list(tree_farm[15:22]), [1, 0, 0, 1, 0, 0, 0])
+
+        baths = self.catalog.structure_features[structures['Baths']['id']]
+        self.assertEqual(list(baths[8:15]), [0, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(baths[22], 3)
+
+        scientists_guild = self.catalog.structure_features[structures['Scientists Guild']['id']]
+        self.assertEqual(scientists_guild[6], 1)
+        self.assertEqual(list(scientists_guild[24:]), [1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.environments import tf_py_environment
+from tf_agents.networks import actor_distribution_network
+from tf_agents.policies import actor_policy, policy_saver
+
+from batched_environment import BatchedGameEnvironment
+from environment import action_count
+from checkpointing import AsyncCheckpointer, PolicyPublisher, latest_policy
+from tournament import SavedPolicy
+
+
+def small_policy():
+    env = tf_py_environment.TFPyEnvironment(BatchedGameEnvironment(1, 3))
+    preprocessing_layers = dict((key, tf.keras.layers.Flatten()) for key in env.observation_spec())
+    actor_net = actor_distribution_network.ActorDistributionNetwork(
+        env.observation_spec(), env.action_spec(), fc_layer_params=(8,), preprocessing_layers=preprocessing_layers,
+        preprocessing_combiner=tf.keras.layers.Concatenate(axis=-1))
+    return actor_policy.ActorPolicy(env.time_step_spec(), env.action_spec(), actor_net), actor_net
+
+
+class CheckpointingTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_async_checkpointer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            step = tf.Variable(0, dtype=tf.int64)
+            weights = tf.Variable([1.0, 2.0])
+            checkpointer = AsyncCheckpointer(directory, max_to_keep=2, step=step, weights=weights)
+            for value in range(1, 4):
+                step.assign(value)
+                checkpointer.save(step)
+                # Changes after save are not part of the checkpoint
+                weights.assign_add([10.0, 10.0])
+            checkpointer.sync()
+            self.assertEqual(len(checkpointer.manager.checkpoints), 2)
+
+            restored_step = tf.Variable(0, dtype=tf.int64)
+            restored_weights = tf.Variable([0.0, 0.0])
+            AsyncCheckpointer(directory, step=restored_step, weights=restored_weights).initialize_or_restore()
+            self.assertEqual(int(restored_step.numpy()), 3)
+            np.testing.assert_allclose(restored_weights.numpy(), [21.0, 22.0])
+
+    def test_policy_publisher(self):
+        policy, actor_net = small_policy()
+        train_step = tf.Variable(0, dtype=tf.int64)
+        saver = policy_saver.PolicySaver(policy, batch_size=None, train_step=train_step)
+        env = BatchedGameEnvironment(4, 3, seed=0)
+        observation = env.reset().observation
+        with tempfile.TemporaryDirectory() as directory:
+            publisher = PolicyPublisher(saver, directory, train_step, max_to_keep=1)
+            self.assertIsNone(latest_policy(directory)[1])
+
+            rng = np.random.default_rng(0)
+            actor_net.set_weights([rng.normal(size=w.shape) for w in actor_net.get_weights()])
+            published = [v.numpy() for v in policy.variables()]
+            publisher.publish(10)
+            publisher.publish(20)
+            # Training goes on while the version is written
+            actor_net.set_weights([w + 1 for w in actor_net.get_weights()])
+            publisher.close()
+
+            saved_model_path, checkpoint_path = latest_policy(directory)
+            self.assertTrue(checkpoint_path.endswith('policy_000000020'))
+            self.assertEqual(os.listdir(os.path.join(directory, 'checkpoints')), ['policy_000000020'])
+
+            saved_policy = SavedPolicy(saved_model_path, checkpoint_path)
+            for value, variable in zip(published, saved_policy.policy.model_variables):
+                np.testing.assert_allclose(variable.numpy(), value)
+            actions, _ = saved_policy.action(observation)
+            self.assertEqual(actions.shape, (4,))
+            self.assertTrue(np.all(actions < action_count))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from batched_environment import BatchedGameEnvironment
+from collector import EpisodeRing, PolicyStore, SelfPlayCollector, episode_length
+from environment import action_count
+from policies import MlpPolicy, RandomPolicy, flatten_observation
+import profiling
+
+
+class CollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_policy_store(self):
+        shapes = [(2, 3), (3,)]
+        store = PolicyStore(PolicyStore.create_layout(shapes))
+        try:
+            self.assertEqual(store.read(shapes, 0), (None, 0))
+            version = store.publish([np.ones((2, 3)), np.arange(3)])
+            weights, read_version = store.read(shapes, 0)
+            self.assertEqual(read_version, version)
+            self.assertTrue(np.all(weights[0] == 1))
+            self.assertEqual(list(weights[1]), [0, 1, 2])
+            self.assertEqual(store.read(shapes, version), (None, version))
+        finally:
+            store.close()
+            store.unlink()
+
+    def test_episode_ring(self):
+        env = BatchedGameEnvironment(1, 3)
+        ring = EpisodeRing(EpisodeRing.create_layout(2, 4, env.observation_spec()))
+        try:
+            episodes = dict((field, np.full((3,) + array.shape[1:], 7, array.dtype))
+                            for field, array in ring.arrays.items() if field not in ('counters', 'policy_version'))
+            stop_event = threading.Event()
+            self.assertTrue(ring.put(episodes, 0, 1, stop_event))
+            self.assertTrue(ring.put(episodes, 1, 2, stop_event))
+            stop_event.set()
+            self.assertFalse(ring.put(episodes, 2, 3, stop_event))
+            self.assertEqual(ring.available(), 2)
+
+            out = {'reward': np.zeros((2, 4), np.float32), 'policy_version': np.zeros(2, np.int64)}
+            ring.get(2, out, 0)
+            self.assertEqual(ring.available(), 0)
+            self.assertTrue(np.all(out['reward'] == 7))
+            self.assertEqual(list(out['policy_version']), [1, 2])
+        finally:
+            ring.close()
+            ring.unlink()
+
+    def test_mlp_policy(self):
+        env = BatchedGameEnvironment(2, 3, seed=0)
+        observation = env.reset().observation
+        features = flatten_observation(observation).shape[1]
+        bias = np.full(action_count, 5.0)
+        weights = [np.zeros((features, 4)), np.zeros(4), np.zeros((4, action_count)), bias]
+        actions, logits = MlpPolicy(weights, greedy=True).action(observation)
+        self.assertEqual(logits.shape, (2, action_count))
+        # Masked logits, the preferred actions are the legal ones
+        np.testing.assert_array_equal(logits > 0, observation['legal_actions'] > 0)
+        self.assertTrue(np.all(observation['legal_actions'][np.arange(2), actions] == 1))
+
+    def test_collect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            collector = SelfPlayCollector(RandomPolicy, player_count=3, num_workers=1, envs_per_worker=2,
+                                          ring_capacity=4, seed=0, profile_dir=directory)
+            try:
+                collector.start()
+                episodes = collector.collect(3, timeout=120)
+            finally:
+                collector.close()
+            # The worker timed itself, the learner process stays unpatched
+            with open(os.path.join(directory, 'profile_stats_worker_0.json')) as file:
+                stats = json.load(file)
+        self.assertGreaterEqual(stats['episodes'], 4)
+        self.assertGreater(stats['environment/step/calls'], 0)
+        self.assertGreater(stats['policy/action/calls'], 0)
+        self.assertFalse(profiling.enabled)
+
+        length = episode_length(3) + 1
+        self.assertEqual(episodes['reward'].shape, (3, length))
+        self.assertEqual(episodes['observation/player_hand'].shape, (3, length, 7, 27))
+        self.assertTrue(np.all(episodes['step_type'][:, 0] == 0))
+        self.assertTrue(np.all(episodes['step_type'][:, -1] == 2))
+        experience = SelfPlayCollector.to_trajectory(episodes)
+        self.assertEqual(experience.action.shape, (3, length))
+
+
+if __name__ == '__main__':
+    unittest.main()
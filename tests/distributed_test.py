@@ -0,0 +1,143 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from collector import episode_length
+from distributed import (EPISODES, DistributedCollector, QueueLearnerTransport, TcpActorTransport, TcpLearnerTransport,
+                         actor_worker, decode_arrays, encode_arrays, receive_message, send_message)
+from policies import RandomPolicy
+
+
+class DistributedTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_encode_arrays(self):
+        arrays = {'reward': np.arange(6, dtype=np.float32).reshape(2, 3), 'observation/age': np.ones((2, 1), np.int8)}
+        decoded = decode_arrays(encode_arrays(arrays))
+        self.assertEqual(set(decoded), set(arrays))
+        for key, value in arrays.items():
+            self.assertEqual(decoded[key].dtype, value.dtype)
+            np.testing.assert_array_equal(decoded[key], value)
+
+    def test_tcp_transport(self):
+        learner = TcpLearnerTransport()
+        try:
+            actor = TcpActorTransport(learner.address, 1, learner.token)
+            self.assertEqual(actor.weights(0), (None, 0))
+            version = learner.publish([np.ones((2, 3)), np.arange(3)])
+            weights, read_version = actor.weights(0)
+            self.assertEqual(read_version, version)
+            self.assertTrue(np.all(weights[0] == 1))
+            self.assertEqual(list(weights[1]), [0, 1, 2])
+            self.assertEqual(actor.weights(version), (None, version))
+
+            actor.send({'reward': np.full((2, 4), 3, np.float32)}, 0)
+            self.assertTrue(np.all(learner.receive(10)['reward'] == 3))
+            self.assertIsNone(learner.receive(0.01))
+            # A batch sent again, after its acknowledgment timed out, is acknowledged but not queued twice
+            actor.send({'reward': np.full((2, 4), 3, np.float32)}, 0)
+            self.assertIsNone(learner.receive(0.01))
+            other_actor = TcpActorTransport(learner.address, 2, learner.token)
+            other_actor.send({'reward': np.full((2, 4), 4, np.float32)}, 0)
+            self.assertTrue(np.all(learner.receive(10)['reward'] == 4))
+            other_actor.close()
+
+            # The learner drops the connection, a new one works
+            for connection in list(learner.connections):
+                connection.shutdown(socket.SHUT_RDWR)
+            with self.assertRaises(OSError):
+                actor.send({'reward': np.zeros(1)}, 1)
+            actor.close()
+            actor = TcpActorTransport(learner.address, 1, learner.token)
+            self.assertEqual(actor.weights(0)[1], version)
+            actor.close()
+        finally:
+            learner.close()
+
+    def test_tcp_handshake(self):
+        learner = TcpLearnerTransport(token='secret', max_message_size=1000)
+        try:
+            with self.assertRaises(OSError):
+                TcpActorTransport(learner.address, 1, 'wrong')
+            # Oversized messages are refused before any buffer is allocated
+            connection = socket.create_connection(learner.address, 10)
+            with self.assertRaises(OSError):
+                send_message(connection, EPISODES, b'x' * 2000)
+                receive_message(connection)
+            connection.close()
+            actor = TcpActorTransport(learner.address, 1, 'secret')
+            with self.assertRaises(OSError):
+                actor.send({'reward': np.zeros(1000)}, 0)
+            actor.close()
+            actor = learner.actor_factory()(1)
+            actor.send({'reward': np.zeros(2)}, 0)
+            self.assertEqual(len(learner.receive(10)['reward']), 2)
+            actor.close()
+        finally:
+            learner.close()
+
+    def test_actor_reconnects(self):
+        learner = TcpLearnerTransport()
+        stop_event = threading.Event()
+        actor = threading.Thread(target=actor_worker, args=(learner.actor_factory(), RandomPolicy, 3, 2, 0, stop_event),
+                                 kwargs={'retry_interval': 0.01}, daemon=True)
+        actor.start()
+        try:
+            length = episode_length(3) + 1
+            for _ in range(3):
+                episodes = learner.receive(120)
+                self.assertEqual(episodes['reward'].shape, (2, length))
+                self.assertEqual(list(episodes['policy_version']), [0, 0])
+                for connection in list(learner.connections):
+                    connection.shutdown(socket.SHUT_RDWR)
+        finally:
+            stop_event.set()
+            learner.close()
+            actor.join(timeout=60)
+        self.assertFalse(actor.is_alive())
+
+    def test_collect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            collector = DistributedCollector(QueueLearnerTransport([]), RandomPolicy, player_count=3, num_actors=1,
+                                             envs_per_actor=2, seed=0, profile_dir=directory)
+            try:
+                collector.start()
+                episodes = collector.collect(3, timeout=120)
+                self.assertEqual(collector.pending_count, 1)
+                more_episodes = collector.collect(1, timeout=120)
+            finally:
+                collector.close()
+            with open(os.path.join(directory, 'profile_stats_actor_0.json')) as file:
+                stats = json.load(file)
+        self.assertGreaterEqual(stats['episodes'], 4)
+        self.assertGreater(stats['environment/step/calls'], 0)
+
+        length = episode_length(3) + 1
+        self.assertEqual(episodes['reward'].shape, (3, length))
+        self.assertEqual(more_episodes['reward'].shape, (1, length))
+        self.assertEqual(episodes['observation/player_hand'].shape, (3, length, 7, 27))
+        self.assertTrue(np.all(episodes['step_type'][:, 0] == 0))
+        self.assertTrue(np.all(episodes['step_type'][:, -1] == 2))
+        experience = DistributedCollector.to_trajectory(episodes)
+        self.assertEqual(experience.action.shape, (3, length))
+
+    def test_collect_tcp(self):
+        collector = DistributedCollector(TcpLearnerTransport(), RandomPolicy, player_count=3, num_actors=2,
+                                         envs_per_actor=1, seed=0)
+        try:
+            collector.start()
+            episodes = collector.collect(2, timeout=120)
+        finally:
+            collector.close()
+        self.assertEqual(episodes['reward'].shape, (2, episode_length(3) + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from collector import episode_length
+from experiment import Experiment, load_configs, make_config, parse_overrides, run_experiments
+from policies import MlpPolicy
+
+
+class ExperimentTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_make_config(self):
+        config = make_config({'num_epochs': 2})
+        self.assertEqual(config['num_epochs'], 2)
+        self.assertEqual(config['root_dir'], 'logs')
+        self.assertEqual(make_config({'name': 'wide'})['root_dir'], os.path.join('logs', 'wide'))
+        with self.assertRaises(ValueError):
+            make_config({'num_epoch': 2})
+
+    def test_parse_overrides(self):
+        overrides = parse_overrides(['num_epochs=5', 'actor_fc_layers=[64, 64]', 'wonder_side=B', 'profile=true'])
+        self.assertEqual(overrides, {'num_epochs': 5, 'actor_fc_layers': [64, 64], 'wonder_side': 'B', 'profile': True})
+        with self.assertRaises(ValueError):
+            parse_overrides(['num_epochs'])
+
+    def test_run_experiments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            small = {'actor_fc_layers': [8], 'value_fc_layers': [8], 'num_epochs': 1, 'num_iterations': 2,
+                     'num_eval_episodes': 0, 'collect_episodes_per_iteration': 2, 'use_tf_functions': False}
+            path = os.path.join(directory, 'configs.json')
+            with open(path, 'w') as file:
+                json.dump([{'name': 'one', 'num_parallel_environments': 1},
+                           {'name': 'two', 'num_parallel_environments': 2}], file)
+            configs = load_configs(path, dict(small, root_dir=None))
+            for config in configs:
+                config['root_dir'] = os.path.join(directory, config['name'])
+            results = run_experiments(configs)
+
+            self.assertEqual([result['name'] for result in results], ['one', 'two'])
+            for result in results:
+                self.assertEqual(result['iterations'], 2)
+                self.assertEqual(result['environment_steps'] % 2, 0)
+                self.assertGreater(result['environment_steps'], 0)
+                self.assertGreater(result['samples_per_second'], 0)
+                self.assertGreater(result['steps_per_second'], 0)
+                self.assertTrue(os.path.isdir(os.path.join(directory, result['name'], 'train')))
+
+    def test_unnamed_configs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            small = {'actor_fc_layers': [8], 'value_fc_layers': [8], 'num_epochs': 1, 'num_iterations': 2,
+                     'num_eval_episodes': 0, 'collect_episodes_per_iteration': 2, 'use_tf_functions': False}
+            path = os.path.join(directory, 'configs.json')
+            with open(path, 'w') as file:
+                json.dump([{'num_parallel_environments': 1}, {'num_parallel_environments': 1}], file)
+            configs = load_configs(path, small)
+            self.assertEqual([config['name'] for config in configs], ['default-0', 'default-1'])
+            self.assertEqual([config['root_dir'] for config in configs],
+                             [os.path.join('logs', 'default-0'), os.path.join('logs', 'default-1')])
+            with self.assertRaises(ValueError):
+                run_experiments([configs[0], dict(configs[1], root_dir=configs[0]['root_dir'])])
+
+            for config in configs:
+                config['root_dir'] = os.path.join(directory, config['root_dir'])
+            results = run_experiments(configs)
+            self.assertEqual([result['train_steps'] for result in results], [2, 2])
+            for config in configs:
+                self.assertTrue(os.path.isdir(os.path.join(config['root_dir'], 'train')))
+
+    def test_collector_without_tf_functions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = make_config({'actor_fc_layers': [8], 'value_fc_layers': [8], 'num_epochs': 1, 'num_iterations': 2,
+                                  'num_eval_episodes': 0, 'collect_episodes_per_iteration': 2,
+                                  'use_tf_functions': False, 'num_collect_workers': 1, 'envs_per_collect_worker': 1,
+                                  'root_dir': directory})
+            experiment = Experiment(config)
+            try:
+                result = experiment.run()
+            finally:
+                experiment.close()
+
+            self.assertEqual(result['train_steps'], 2)
+            self.assertEqual(int(experiment.number_of_episodes_metric.result()), 4)
+            self.assertEqual(int(experiment.environment_steps_metric.result()), 4 * episode_length(3))
+            self.assertEqual(float(experiment.average_episode_length_metric.result()), episode_length(3))
+            self.assertNotEqual(float(experiment.average_return_metric.result()), 0)
+
+    def test_masked_actor_network(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = make_config({'actor_fc_layers': [8], 'value_fc_layers': [8], 'num_eval_episodes': 0,
+                                  'num_parallel_environments': 4, 'root_dir': directory})
+            experiment = Experiment(config)
+            try:
+                time_step = experiment.tf_env.reset()
+                legal_actions = time_step.observation['legal_actions'].numpy()
+                for _ in range(20):
+                    actions = experiment.tf_agent.collect_policy.action(time_step).action.numpy()
+                    self.assertTrue(np.all(legal_actions[np.arange(4), actions] == 1))
+
+                # The NumPy actor of the collect workers computes the same masked logits
+                distribution, _ = experiment.actor_net(time_step.observation, step_type=time_step.step_type,
+                                                       network_state=())
+                logits = MlpPolicy(experiment.actor_net.get_weights()).logits(
+                    dict((key, value.numpy()) for key, value in time_step.observation.items()))
+                np.testing.assert_allclose(logits, distribution.logits_parameter().numpy(), rtol=1e-5, atol=1e-6)
+            finally:
+                experiment.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,26 @@
+import pickle
 import unittest
 
-from environment import GameEnvironment, Action
+import numpy as np
+
+from environment import (GameEnvironment, SimultaneousGameEnvironment, Action, action_index, copy_time_step,
+                         episode_deals, legal_actions, replay_episode, resolve_discarded_plays)
+from game import (Resource, board_defeat_tokens, board_productions, board_science, board_shields,
+                  board_structures, board_wonder_stage)
+
+
+def recomputed_board(player, structure_count):
+    board = np.zeros(board_structures + structure_count, dtype=np.float32)
+    for resource, quantity in player.all_productions().items():
+        board[board_productions + Resource[resource].value - 1] = quantity
+    board[board_shields] = player.shields
+    board[board_defeat_tokens] = player.defeat_tokens
+    board[board_wonder_stage] = player.wonder_stage
+    for symbol, quantity in player.scientific_symbols.items():
+        board[board_science + symbol.value - 1] = quantity
+    for construction in player.constructions:
+        board[board_structures + construction['id']] = 1
+    return board
 
 
 class GameEnvironmentTest(unittest.TestCase):
@@ -14,7 +34,251 @@ class GameEnvironmentTest(unittest.TestCase):
         self.assertEqual(len(env.player_decks), 3)
         self.assertEqual(len(env.player_decks[0]), 7)
 
-        env.step([[Action.BUILD_STRUCTURE, 0], [Action.BUILD_STRUCTURE, 0], [Action.BUILD_STRUCTURE, 0]])
+        env.step(action_index(Action.BUILD_STRUCTURE.value, 0))
+
+    def test_legal_actions(self):
+        env = GameEnvironment(3)
+        observation = env.reset().observation
+        self.assertEqual(observation['legal_actions'].shape, (21,))
+        self.assertTrue(all(observation['legal_actions'][action_index(Action.DISCARD.value, np.arange(7))] == 1))
+
+        player = env.players[env.current_player_index]
+        for index, structure_id in enumerate(env.player_deck(env.current_player_index)):
+            cost = env.catalog.structures[structure_id]['cost']
+            legal = observation['legal_actions'][action_index(Action.BUILD_STRUCTURE.value, index)]
+            self.assertEqual(legal, player.affordable_cost(cost) is not None)
+            if not cost['resources']:
+                self.assertEqual(legal, 1)
+                self.assertEqual(observation['action_costs'][action_index(Action.BUILD_STRUCTURE.value, index)], cost['gold'])
+
+    def test_legal_actions_reject_built_names(self):
+        env = GameEnvironment(3, seed=0)
+        env.reset()
+        player = env.players[env.current_player_index]
+        hand = [env.catalog.structures[structure_id] for structure_id in env.player_deck(env.current_player_index)]
+        player.build_structure(hand[0], free=True)
+        mask, _ = legal_actions(player, hand)
+        self.assertEqual(mask[action_index(Action.BUILD_STRUCTURE.value, 0)], 0)
+        self.assertEqual(mask[action_index(Action.DISCARD.value, 0)], 1)
+
+    def test_snapshot_and_restore(self):
+        env = GameEnvironment(3)
+        env.reset()
+        for _ in range(10):
+            env.step(action_index(Action.BUILD_STRUCTURE.value, 0))
+        snapshot = env.snapshot()
+        coins = env.players_coins()
+        scores = [player.score() for player in env.players]
+        decks = [list(player_deck) for player_deck in env.player_decks]
+
+        for _ in range(20):
+            env.step(action_index(Action.BUILD_STRUCTURE.value, 0))
+        env.restore(snapshot)
+
+        self.assertEqual(env.turn, 4)
+        self.assertEqual(env.players_coins(), coins)
+        self.assertEqual([player.score() for player in env.players], scores)
+        self.assertEqual(env.player_decks, decks)
+        self.assertEqual(env.snapshot(), snapshot)
+
+    def test_players_are_picklable(self):
+        env = GameEnvironment(3)
+        env.reset()
+        env.step(action_index(Action.BUILD_STRUCTURE.value, 0))
+        players = pickle.loads(pickle.dumps(env.players))
+        self.assertEqual([player.score() for player in players], [player.score() for player in env.players])
+
+    def test_simultaneous_step(self):
+        env = SimultaneousGameEnvironment(3)
+        step = env.reset()
+        self.assertTrue(env.batched)
+        self.assertEqual(step.observation['player_hand'].shape, (3, 7, 27))
+        self.assertEqual(step.observation['legal_actions'].shape, (3, 21))
+        hands = env.hands.copy()
+
+        step = env.step(np.full(3, action_index(Action.DISCARD.value, 0)))
+        self.assertEqual(step.reward.shape, (3,))
+        self.assertEqual(env.players_coins(), [6, 6, 6])
+        self.assertEqual(env.turn, 2)
+        # Age 1 passes to the left neighbor
+        for player_index in range(3):
+            self.assertEqual(env.player_deck(player_index - 1), list(hands[player_index, 1:]))
+
+    def test_simultaneous_episode(self):
+        env = SimultaneousGameEnvironment(3)
+        env.reset()
+        for _ in range(3 * 6 - 1):
+            step = env.step(np.full(3, action_index(Action.BUILD_STRUCTURE.value, 0)))
+            self.assertTrue(np.all(step.step_type == 1))
+        step = env.step(np.full(3, action_index(Action.BUILD_STRUCTURE.value, 0)))
+        self.assertTrue(np.all(step.is_last()))
+        self.assertEqual(env.age, 4)
+
+    def test_simultaneous_costs_use_start_of_turn_state(self):
+        # No wonder produces stone, the Stone Pit seat 0 builds this turn cannot pay for the Baths of seat 1
+        env = SimultaneousGameEnvironment(3, seed=0)
+        env.reset()
+        names = dict((structure['name'], structure['id']) for structure in env.catalog.structures)
+        env.hands[0, 0] = names['Stone Pit']
+        env.hands[1, 0] = names['Baths']
+        step = env.step(action_index(np.array([Action.BUILD_STRUCTURE.value, Action.BUILD_STRUCTURE.value,
+                                               Action.DISCARD.value]), 0))
+        self.assertIn('Stone Pit', env.players[0].construction_names)
+        self.assertNotIn('Baths', env.players[1].construction_names)
+        self.assertEqual(env.players_coins(), [3, 6, 6])
+        self.assertEqual(env.discarded_structures[names['Baths']], 1)
+        # From the next turn on the stone is for sale
+        self.assertEqual(env.players[1].build_cost(env.catalog.structures[names['Baths']]['cost']), 2)
+        self.assertEqual(step.reward.shape, (3,))
+
+    def test_seed(self):
+        env = GameEnvironment(3, seed=1)
+        other_env = GameEnvironment(3, seed=1)
+        self.assertEqual(env.player_decks, other_env.player_decks)
+        env.reset()
+        other_env.reset()
+        self.assertEqual(env.player_decks, other_env.player_decks)
+        self.assertEqual(env.episode_seed, other_env.episode_seed)
+        self.assertNotEqual(GameEnvironment(3, seed=1).player_decks, GameEnvironment(3, seed=2).player_decks)
+
+    def test_replay_episode(self):
+        rng = np.random.default_rng(0)
+        env = GameEnvironment(3, seed=3)
+        # Observations live in buffers reused by the next step
+        time_steps = [copy_time_step(env.reset())]
+        while not time_steps[-1].is_last():
+            actions = np.flatnonzero(time_steps[-1].observation['legal_actions'])
+            choice = rng.integers(len(actions))
+            time_steps.append(copy_time_step(env.step(actions[choice])))
+
+        replayed = replay_episode(GameEnvironment(3), env.episode_seed, env.episode_actions)
+        self.assertEqual(len(replayed), len(time_steps))
+        for time_step, replayed_time_step in zip(time_steps, replayed):
+            self.assertEqual(time_step.reward, replayed_time_step.reward)
+            for key, value in time_step.observation.items():
+                self.assertTrue(np.array_equal(value, replayed_time_step.observation[key]))
+
+    def test_board_observation(self):
+        rng = np.random.default_rng(0)
+        env = GameEnvironment(3, seed=5, board_observations=True)
+        observation = env.reset().observation
+        structure_count = len(env.catalog.structures)
+        for _ in range(3 * 6 * 3 - 1):
+            actions = np.flatnonzero(observation['legal_actions'])
+            choice = rng.integers(len(actions))
+            observation = env.step(actions[choice]).observation
+            for row in range(3):
+                player = env.players[(env.current_player_index + row) % 3]
+                np.testing.assert_array_equal(observation['players_board'][row],
+                                              recomputed_board(player, structure_count))
+        self.assertGreater(sum(player.defeat_tokens for player in env.players), 0)
+
+        snapshot = env.snapshot()
+        boards = env.boards.copy()
+        env.step(action_index(Action.DISCARD.value, 0))
+        env.restore(snapshot)
+        np.testing.assert_array_equal(env.boards, boards)
+
+    def test_simultaneous_board_observation(self):
+        env = SimultaneousGameEnvironment(3, seed=0, board_observations=True)
+        env.reset()
+        observation = env.step(np.full(3, action_index(Action.DISCARD.value, 0))).observation
+        self.assertEqual(observation['players_board'].shape, (3, 3, env.boards.shape[1]))
+        for seat in range(3):
+            np.testing.assert_array_equal(observation['players_board'][seat, 1], env.boards[(seat + 1) % 3])
+
+    def test_restore_keeps_random_state(self):
+        env = GameEnvironment(3, seed=4)
+        env.reset()
+        snapshot = env.snapshot()
+        for _ in range(3 * 6):
+            env.step(action_index(Action.DISCARD.value, 0))
+        age_2_decks = env.player_decks
+        env.restore(snapshot)
+        for _ in range(3 * 6):
+            env.step(action_index(Action.DISCARD.value, 0))
+        self.assertEqual(env.player_decks, age_2_decks)
+        self.assertEqual(len(env.episode_actions), 3 * 6)
+
+    def test_discard_pile(self):
+        env = GameEnvironment(3, seed=6)
+        env.reset()
+        for _ in range(3 * 6):
+            env.step(action_index(Action.DISCARD.value, 0))
+        # Six discards and the last structure of every hand
+        self.assertEqual(env.discarded_structures.sum(), 3 * 7)
+        snapshot = env.snapshot()
+        env.step(action_index(Action.DISCARD.value, 0))
+        env.restore(snapshot)
+        self.assertEqual(env.discarded_structures.sum(), 3 * 7)
+
+    def test_discarded_plays(self):
+        env = GameEnvironment(3, seed=7)
+        env.reset()
+        catalog = env.catalog
+        player = env.players[0]
+        built = catalog.structures[env.player_deck(0)[0]]
+        player.build_structure(built, free=True)
+        valuable = max((structure for structure in catalog.structures if structure['name'] != built['name']),
+                       key=lambda structure: catalog.structure_values[structure['id']])
+        pile = np.zeros(len(catalog.structures), dtype=np.int32)
+        pile[[built['id'], valuable['id'], 0]] = 1
+        player.discarded_plays = 1
+        resolve_discarded_plays(env.players, pile, catalog)
+        self.assertEqual(player.discarded_plays, 0)
+        self.assertIn(valuable['name'], player.construction_names)
+        self.assertEqual(pile.sum(), 2)
+        self.assertEqual(pile[valuable['id']], 0)
+
+    def test_discarded_plays_after_age_end_discards(self):
+        # A play pending on the last turn of the age chooses among the structures left in the hands too
+        env = GameEnvironment(3, seed=7)
+        time_step = env.reset()
+        for _ in range(3 * 5):
+            time_step = env.step(action_index(Action.DISCARD.value, 0))
+        env.discarded_structures[:] = 0
+        player = env.players[0]
+        player.discarded_plays = 1
+        for player_index in range(3):
+            legal_actions = time_step.observation['legal_actions'].reshape(len(Action), 7)
+            action = next(action for action in (Action.BUILD_STRUCTURE, Action.BUILD_WONDER_STAGE)
+                          if legal_actions[action.value].any())
+            card = int(np.flatnonzero(legal_actions[action.value])[0])
+            leftover = [structure_id for index, structure_id in enumerate(env.player_deck(player_index))
+                        if index != card]
+            if player_index == 2:
+                leftovers = [env.player_deck(seat)[0] for seat in range(2)] + leftover
+                candidates = [structure_id for structure_id in sorted(leftovers)
+                              if env.catalog.structures[structure_id]['name'] not in player.construction_names]
+            time_step = env.step(action_index(action.value, card))
+
+        self.assertTrue(candidates)
+        self.assertEqual(env.age, 2)
+        self.assertEqual(player.discarded_plays, 0)
+        self.assertEqual(env.discarded_structures.sum(), 2)
+        built = max(candidates, key=lambda structure_id: env.catalog.structure_values[structure_id])
+        self.assertIn(env.catalog.structures[built]['name'], player.construction_names)
+
+    def test_wonder_sides(self):
+        env = GameEnvironment(7, seed=8, wonder_side='B')
+        self.assertTrue(all(player.wonder is env.catalog.wonders[wonder_id]['sides']['B']
+                            for player, wonder_id in zip(env.players, episode_deals(env.catalog, 7, env.episode_seed,
+                                                                                      'B')[0])))
+        rng = np.random.default_rng(1)
+        env = GameEnvironment(7, seed=8, wonder_side='random')
+        time_steps = [copy_time_step(env.reset())]
+        while not time_steps[-1].is_last():
+            actions = np.flatnonzero(time_steps[-1].observation['legal_actions'])
+            choice = rng.integers(len(actions))
+            time_steps.append(copy_time_step(env.step(actions[choice])))
+        wonder_ids, sides, _ = episode_deals(env.catalog, 7, env.episode_seed, 'random')
+        self.assertEqual([player.wonder for player in env.players],
+                         [env.catalog.wonder_side(wonder_id, side) for wonder_id, side in zip(wonder_ids, sides)])
+
+        replayed = replay_episode(GameEnvironment(7, wonder_side='random'), env.episode_seed, env.episode_actions)
+        self.assertEqual([time_step.reward for time_step in replayed], [time_step.reward for time_step in time_steps])
+        with self.assertRaises(ValueError):
+            GameEnvironment(3, wonder_side='C')
 
 
 if __name__ == '__main__':
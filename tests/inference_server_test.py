@@ -0,0 +1,88 @@
+import threading
+import unittest
+
+import numpy as np
+
+from batched_environment import BatchedGameEnvironment
+from collector import PolicyStore, SelfPlayCollector, episode_length
+from environment import Action, action_count, action_index
+from inference_server import InferenceServer, InferenceSlots, serve
+from policies import MlpPolicy, RandomPolicy, flatten_observation
+
+
+def constant_weights(features, preferred_action):
+    action_bias = np.zeros(action_count)
+    action_bias[preferred_action] = 5
+    return [np.zeros((features, 4)), np.zeros(4), np.zeros((4, action_count)), action_bias]
+
+
+def greedy_policy():
+    return MlpPolicy(greedy=True)
+
+
+class InferenceServerTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_hot_reload(self):
+        env = BatchedGameEnvironment(2, 3, seed=0)
+        observation = env.reset().observation
+        # Discards are legal in every hand of the first turn
+        first_discard = action_index(Action.DISCARD.value, 0)
+        weights = constant_weights(flatten_observation(observation).shape[1], first_discard + 2)
+        shapes = [w.shape for w in weights]
+        store = PolicyStore(PolicyStore.create_layout(shapes))
+        store.publish(weights)
+        server = InferenceServer(greedy_policy, 4, 3, max_batch_size=4, store_spec=store.spec(), weight_shapes=shapes)
+        try:
+            server.start(in_process=True)
+            client = server.client_factory(2)()
+            actions, logits = client.action(observation)
+            self.assertEqual(list(actions), [first_discard + 2] * 2)
+            self.assertEqual(logits.shape, (2, action_count))
+            self.assertEqual(client.policy_version, 1)
+
+            store.publish(constant_weights(flatten_observation(observation).shape[1], first_discard))
+            actions, _ = client.action(observation)
+            self.assertEqual(list(actions), [first_discard] * 2)
+            self.assertEqual(client.policy_version, 2)
+            client.close()
+        finally:
+            server.close()
+            store.close()
+            store.unlink()
+
+    def test_serve_batches_until_deadline(self):
+        env = BatchedGameEnvironment(3, 3, seed=0)
+        slots = InferenceSlots(InferenceSlots.create_layout(3, env.observation_spec()))
+        try:
+            for key, value in env.reset().observation.items():
+                slots.arrays['observation/' + key][:] = value
+            # Two of three slots ask, the batch runs at the deadline
+            slots.arrays['state'][:2] = 1
+            stop_event = threading.Event()
+            timer = threading.Timer(0.2, stop_event.set)
+            timer.start()
+            batches = serve(slots, RandomPolicy(), 8, 0.01, stop_event)
+            timer.join()
+            self.assertEqual(batches, 1)
+            self.assertEqual(list(slots.arrays['state']), [2, 2, 0])
+        finally:
+            slots.close()
+            slots.unlink()
+
+    def test_collect(self):
+        collector = SelfPlayCollector(RandomPolicy, player_count=3, num_workers=2, envs_per_worker=2,
+                                      ring_capacity=4, seed=0, inference_batch_size=4)
+        try:
+            collector.start()
+            episodes = collector.collect(4, timeout=120)
+        finally:
+            collector.close()
+        self.assertEqual(episodes['reward'].shape, (4, episode_length(3) + 1))
+        self.assertTrue(np.all(episodes['step_type'][:, -1] == 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
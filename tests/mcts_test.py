@@ -0,0 +1,65 @@
+import unittest
+
+from environment import Action, GameEnvironment
+from mcts import InformationSetSearch, MctsAgent, Node, action_keys, play_game
+
+
+def play_to_age(env, age):
+    while env.age < age:
+        env.play(Action.DISCARD, 0)
+
+
+class MctsAgentTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_act_returns_legal_action(self):
+        env = GameEnvironment(3)
+        env.reset()
+        agent = MctsAgent(simulations=20, seed=0)
+        player_action, structure_index = agent.act(env)
+        legal_indexes = [index for key, index in action_keys(env).items() if key[0] == player_action]
+        self.assertIn(structure_index, legal_indexes)
+        self.assertEqual(agent.simulation_count, 20)
+
+    def test_search_does_not_change_the_game(self):
+        env = GameEnvironment(3)
+        env.reset()
+        snapshot = env.snapshot()
+        MctsAgent(simulations=20, rollout_policy='heuristic', seed=0).act(env)
+        self.assertEqual(env.snapshot(), snapshot)
+
+    def test_simulations_deal_unseen_ages(self):
+        env = GameEnvironment(3, seed=0)
+        env.reset()
+        snapshot = env.snapshot()
+        play_to_age(env, 3)
+        real_hands = tuple(env.player_deck(0))
+        env.restore(snapshot)
+
+        search = InformationSetSearch(seed=0)
+        age_3_hands = []
+
+        def simulate(env, root):
+            # Only the deals, the observer sees its age 3 hand
+            play_to_age(env, 3)
+            age_3_hands.append(tuple(env.player_deck(0)))
+
+        search.simulate = simulate
+        search.run(env, Node(None), 10)
+        self.assertGreater(len(set(age_3_hands)), 1)
+        self.assertNotIn(real_hands, age_3_hands)
+        self.assertEqual(env.snapshot(), snapshot)
+
+    def test_play_game_reuses_tree(self):
+        env = GameEnvironment(3)
+        agents = [MctsAgent(simulations=5, seed=i) for i in range(3)]
+        scores = play_game(env, agents)
+        self.assertEqual(len(scores), 3)
+        self.assertTrue(env._episode_ended)
+        self.assertGreater(agents[0].simulations_per_second(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
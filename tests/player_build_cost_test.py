@@ -1,7 +1,7 @@
 import json
 import unittest
 
-from game import GameDataJsonDecoder, Player
+from game import GameDataJsonDecoder, ImpossibleBuildException, Player
 
 
 class PlayerBuildCostTest(unittest.TestCase):
@@ -70,6 +70,93 @@ class PlayerBuildCostTest(unittest.TestCase):
         player.build_structure(self.structures['Theater'])
         self.assertEqual(player.build_cost(self.structures_2['Statue']['cost']), 0)
 
+    def test_that_either_or_productions_are_assigned_to_the_needed_resources(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        player.build_structure(self.structures['Tree Farm'])
+        player.build_structure(self.structures['Excavation'])
+        self.assertEqual(player.build_cost(self.structures_2['Statue']['cost']), None)
+        player.build_structure(self.structures['Timber Yard'])
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'WOOD': 1, 'CLAY': 1, 'STONE': 1}}), 0)
+
+    def test_that_neighbor_either_or_productions_sell_one_option(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        left_player.build_structure(self.structures['Tree Farm'])
+        right_player.build_structure(self.structures['Stone Pit'])
+        player.build_structure(self.structures['Clay Pool'])
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'WOOD': 1, 'CLAY': 2}}), None)
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'WOOD': 1, 'CLAY': 1}}), 2)
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'CLAY': 2, 'STONE': 1}}), 4)
+        right_player.build_structure(self.structures['Excavation'])
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'WOOD': 1, 'CLAY': 2}}), 4)
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'WOOD': 1, 'CLAY': 2, 'STONE': 1}}), 6)
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'CLAY': 3, 'STONE': 1}}), 6)
+        self.assertEqual(player.build_cost({'gold': 0, 'resources': {'CLAY': 3, 'STONE': 2}}), None)
+
+    def test_that_cheapest_neighbor_is_used_first(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        left_player.build_structure(self.structures['Stone Pit'])
+        right_player.build_structure(self.structures['Stone Pit'])
+        player.build_structure(self.structures['East Trading Post'])
+        self.assertEqual(player.build_cost(self.structures['Baths']['cost']), 1)
+        self.assertEqual(player.build_cost(self.structures_2['Aqueduct']['cost']), 3)
+
+    def test_that_trade_prices_follow_neighbor_builds_and_discounts(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        costs = [self.structures['Baths']['cost'], self.structures['Lumber Yard']['cost']]
+        self.assertEqual(list(player.build_costs(costs)), [float('inf'), 0])
+        right_player.build_structure(self.structures['Stone Pit'])
+        self.assertEqual(list(player.build_costs(costs)), [2, 0])
+        player.build_structure(self.structures['East Trading Post'])
+        self.assertEqual(list(player.build_costs(costs)), [1, 0])
+
+    def test_that_free_build_is_used_once_per_age(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        player.apply_effect({'action': 'FREE_BUILD'}, None)
+        costs = [self.structures['Baths']['cost'], self.structures['Lumber Yard']['cost']]
+        self.assertEqual(list(player.build_costs(costs)), [0, 0])
+        # A structure that is already free leaves the free build for later
+        player.build_structure(self.structures['Lumber Yard'])
+        self.assertFalse(player.free_build_used_this_age)
+        player.build_structure(self.structures['Baths'])
+        self.assertEqual(player.coins, 3)
+        self.assertEqual(list(player.build_costs(costs)), [float('inf'), 0])
+        player.finish_age(2)
+        self.assertEqual(list(player.build_costs(costs)), [0, 0])
+
+    def test_that_a_structure_name_is_built_once(self):
+        player = Player({'production': {}})
+        player.with_neighbor(Player({'production': {}}), Player({'production': {}}))
+        player.build_structure(self.structures['Lumber Yard'])
+        self.assertEqual(player.structure_cost(self.structures['Lumber Yard']), (None, False))
+        with self.assertRaises(ImpossibleBuildException):
+            player.build_structure(self.structures['Lumber Yard'], free=True)
+        self.assertEqual(player.coins, 3)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,8 @@
+import itertools
 import json
 import unittest
 
-from game import GameDataJsonDecoder, Player
+from game import GameDataJsonDecoder, Player, Science, science_score_table
 
 
 class PlayerScoreTest(unittest.TestCase):
@@ -13,6 +14,12 @@ class PlayerScoreTest(unittest.TestCase):
             self.structures = dict((o['name'], o) for o in json.load(structures_data_file, cls=GameDataJsonDecoder))
         with open('../game-data/age-2-structures.json') as structures_data_file:
             self.structures_2 = dict((o['name'], o) for o in json.load(structures_data_file, cls=GameDataJsonDecoder))
+        with open('../game-data/guild-structures.json') as structures_data_file:
+            self.guilds = dict((o['name'], o) for o in json.load(structures_data_file, cls=GameDataJsonDecoder))
+        Player.debug_score = True
+
+    def tearDown(self):
+        Player.debug_score = False
 
     def test_initial_score(self):
         left_player = Player({'production': {}})
@@ -44,6 +51,91 @@ class PlayerScoreTest(unittest.TestCase):
         player.build_wonder_stage()
         self.assertEqual(player.score(), 4)
 
+    def test_board_element_score(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        left_player.build_structure(self.structures['Lumber Yard'])
+        player.coins = 4
+        player.build_structure(self.structures_2['Vineyard'])
+        self.assertEqual(player.score(), 2)
+        right_player.build_structure(self.structures['Stone Pit'])
+        player.build_structure(self.structures['Ore Vein'])
+        self.assertEqual(player.score(), 4)
+        self.assertEqual(left_player.score(), 1)
+
+    def test_defeat_token_score(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        player.coins = 10
+        player.build_structure(self.structures['Stone Pit'])
+        player.build_structure(self.structures['Ore Vein'])
+        player.build_structure(self.structures_2['Foundry'])
+        player.build_structure(self.structures['Loom'])
+        player.build_structure(self.guilds['Strategists Guild'])
+        player.shields = 1
+        self.assertEqual(player.score(), 3)
+        left_player.resolve_military_conflicts(1)
+        right_player.resolve_military_conflicts(1)
+        self.assertEqual(player.score(), 5)
+
+    def test_science_score(self):
+        player = Player({'production': {}})
+        self.assertEqual(player.science_score(), 0)
+        player.scientific_symbols[Science.WHEEL] = 2
+        self.assertEqual(player.science_score(), 4)
+        player.scientific_symbols[Science.ANY] = 1
+        self.assertEqual(player.science_score(), 9)
+        player.scientific_symbols[Science.COMPASS] = 1
+        player.scientific_symbols[Science.TABLET] = 1
+        self.assertEqual(player.science_score(), 7 + 9 + 1 + 1)
+        self.assertEqual(player.science_score(Science.ANY), 7 * 2 + 4 + 4 + 4)
+
+    def test_science_score_table(self):
+        table = science_score_table(4, 2)
+        for counts in itertools.product(range(5), range(5), range(5), range(3)):
+            best = 0
+            for assignment in itertools.product(range(3), repeat=counts[3]):
+                kinds = list(counts[:3])
+                for kind in assignment:
+                    kinds[kind] += 1
+                best = max(best, min(kinds) * 7 + sum(quantity ** 2 for quantity in kinds))
+            self.assertEqual(table[counts], best)
+
+    def test_copy_guild_score(self):
+        left_player = Player({'production': {}})
+        right_player = Player({'production': {}})
+        player = Player({'production': {}})
+        player.with_neighbor(left_player, right_player)
+        right_player.with_neighbor(player, left_player)
+        left_player.with_neighbor(right_player, player)
+        player.apply_effect({'action': 'COPY_GUILD'}, None)
+        self.assertEqual(player.score(), 1)
+        left_player.build_structure(self.guilds['Workers Guild'], free=True)
+        right_player.build_structure(self.structures['Lumber Yard'])
+        right_player.build_structure(self.structures['Stone Pit'])
+        self.assertEqual(player.score(), 3)
+        # The best guild of either neighbor counts
+        right_player.build_structure(self.guilds['Traders Guild'], free=True)
+        self.assertEqual(player.score(), 3)
+        left_player.build_structure(self.structures['Tavern'])
+        left_player.build_structure(self.structures['East Trading Post'])
+        left_player.build_structure(self.structures['West Trading Post'])
+        self.assertEqual(player.score(), 4)
+        # The Scientists Guild is worth an "any" symbol
+        player.scientific_symbols[Science.WHEEL] = 2
+        player.scientific_symbols[Science.COMPASS] = 2
+        player.scientific_symbols[Science.TABLET] = 1
+        left_player.build_structure(self.guilds['Scientists Guild'], free=True)
+        self.assertEqual(player.score(), 1 + (7 + 4 + 4 + 1) + 10)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+import profiling
+from environment import Action, GameEnvironment, action_index
+from game import Player
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+        profiling.reset()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.reset()
+
+    def test_disabled(self):
+        build_cost = Player.__dict__['build_cost']
+        env = GameEnvironment(3)
+        env.reset()
+        env.step(action_index(Action.DISCARD.value, 0))
+        profiling.record('collect', 1.0)
+        profiling.count('episodes')
+        self.assertIs(Player.__dict__['build_cost'], build_cost)
+        self.assertNotIn('environment/step/calls', profiling.stats())
+        self.assertNotIn('collect/calls', profiling.stats())
+
+    def test_enabled(self):
+        build_cost = Player.__dict__['build_cost']
+        profiling.enable()
+        env = GameEnvironment(3)
+        env.reset()
+        for _ in range(3):
+            env.step(action_index(Action.DISCARD.value, 0))
+        profiling.count('episodes')
+
+        stats = profiling.stats()
+        self.assertEqual(stats['environment/step/calls'], 3)
+        self.assertEqual(stats['environment/to_observation/calls'], 4)
+        self.assertGreater(stats['player/build_cost/calls'], 0)
+        self.assertEqual(stats['episodes'], 1)
+
+        profiling.disable()
+        self.assertIs(Player.__dict__['build_cost'], build_cost)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from environment import GameEnvironment
+from replay_log import ReplayReader, ReplayWriter, replay_games
+
+
+def play_random_episode(env, rng):
+    # The observations are copied, the environment reuses its player_hand buffer
+    time_steps = [env.reset()]
+    observations = [dict((key, np.copy(value)) for key, value in time_steps[-1].observation.items())]
+    while not time_steps[-1].is_last():
+        actions = np.flatnonzero(time_steps[-1].observation['legal_actions'])
+        choice = rng.integers(len(actions))
+        time_steps.append(env.step(actions[choice]))
+        observations.append(dict((key, np.copy(value)) for key, value in time_steps[-1].observation.items()))
+    return [time_step._replace(observation=observation) for time_step, observation in zip(time_steps, observations)]
+
+
+class ReplayLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'games.7wrl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_read(self):
+        env = GameEnvironment(3, seed=0)
+        rng = np.random.default_rng(0)
+        with ReplayWriter(self.file_path, 3, chunk_size=2) as writer:
+            for _ in range(3):
+                play_random_episode(env, rng)
+                writer.add_episode(env)
+        with ReplayWriter(self.file_path, 3) as writer:
+            play_random_episode(env, rng)
+            writer.add_episode(env)
+        with self.assertRaises(ValueError):
+            ReplayWriter(self.file_path, 4)
+
+        reader = ReplayReader(self.file_path)
+        self.assertEqual(len(reader), 4)
+        self.assertEqual(len(reader.chunks), 3)
+        games = np.concatenate(list(reader.games()))
+        self.assertEqual(int(games['seed'][-1]), env.episode_seed)
+        self.assertEqual([int(action) for action in games['actions'][-1]], env.episode_actions)
+        self.assertEqual(sum(len(batch['reward']) for batch in reader.batches(3)), 4)
+        reader.close()
+
+    def test_append_after_torn_chunk(self):
+        env = GameEnvironment(3, seed=0)
+        rng = np.random.default_rng(0)
+        seeds = []
+        with ReplayWriter(self.file_path, 3, chunk_size=2) as writer:
+            for _ in range(4):
+                play_random_episode(env, rng)
+                writer.add_episode(env)
+                seeds.append(env.episode_seed)
+        # A crash in the middle of the last flush
+        with open(self.file_path, 'r+b') as file:
+            file.truncate(os.path.getsize(self.file_path) - 10)
+        with ReplayWriter(self.file_path, 3, chunk_size=2) as writer:
+            for _ in range(4):
+                play_random_episode(env, rng)
+                writer.add_episode(env)
+                seeds.append(env.episode_seed)
+
+        reader = ReplayReader(self.file_path)
+        self.assertEqual(len(reader), 6)
+        games = np.concatenate(list(reader.games()))
+        self.assertEqual([int(seed) for seed in games['seed']], seeds[:2] + seeds[4:])
+        reader.close()
+
+    def test_replay_matches_environment(self):
+        rng = np.random.default_rng(1)
+        for player_count, wonder_side in ((3, 'A'), (5, 'A'), (7, 'random')):
+            env = GameEnvironment(player_count, seed=player_count, board_observations=True, wonder_side=wonder_side)
+            with ReplayWriter(self.file_path, player_count) as writer:
+                episodes = []
+                for _ in range(2):
+                    episodes.append(play_random_episode(env, rng))
+                    writer.add_episode(env)
+
+            reader = ReplayReader(self.file_path)
+            replayed = replay_games(np.concatenate(list(reader.games())), board_observations=True)
+            reader.close()
+            os.remove(self.file_path)
+
+            for game, time_steps in enumerate(episodes):
+                for step, time_step in enumerate(time_steps[:-1]):
+                    for key, value in time_step.observation.items():
+                        self.assertTrue(np.array_equal(replayed['observation/' + key][game, step], value), key)
+                    self.assertEqual(replayed['reward'][game, step], time_steps[step + 1].reward)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import itertools
+import random
+import unittest
+
+import numpy as np
+
+from environment import Action, GameEnvironment, action_index, player_hand_size, split_action
+from rules import RulesKernel, RulesTables, play_random_games, OP_CHOICE_PRODUCTION
+
+
+def wonder_boards(env):
+    boards = []
+    for player in env.players:
+        boards.append(next(wonder['id'] * 2 + side for wonder in env.catalog.wonders
+                           for side, name in enumerate('AB') if wonder['sides'][name] is player.wonder))
+    return boards
+
+
+class RulesKernelTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def assertSameState(self, env, kernel):
+        self.assertEqual(list(kernel.coins[0]), [player.coins for player in env.players])
+        self.assertEqual(list(kernel.shields[0]), [player.shields for player in env.players])
+        self.assertEqual(list(kernel.defeat_tokens[0]), [player.defeat_tokens for player in env.players])
+        self.assertEqual(list(kernel.wonder_stage[0]), [player.wonder_stage for player in env.players])
+        self.assertEqual(list(kernel.scores()[0]), [player.score() for player in env.players])
+
+    def test_tables(self):
+        env = GameEnvironment(3)
+        tables = RulesTables(env.catalog)
+        self.assertEqual(len(tables.cost_gold), len(env.catalog.structures) + len(env.catalog.wonder_stages))
+        for structure in env.catalog.structures:
+            production = structure['effect'].get('production', {})
+            self.assertEqual(tables.effect_op[structure['id'], 0] == OP_CHOICE_PRODUCTION, len(production) > 1)
+
+    def test_matches_player(self):
+        # Differential test: the same random legal games on game.Player and on the kernel
+        rng = random.Random(0)
+        for player_count, wonder_side in itertools.product(range(3, 8), ('A', 'B', 'random')):
+            for game in range(10):
+                env = GameEnvironment(player_count, seed=game, wonder_side=wonder_side)
+                time_step = env.reset()
+                kernel = RulesKernel(1, player_count)
+                kernel.reset([0], [wonder_boards(env)])
+                self.assertSameState(env, kernel)
+
+                while not time_step.is_last():
+                    player_index = env.current_player_index
+                    player_deck = env.player_deck(player_index)
+                    hand = np.full((1, player_hand_size), -1)
+                    hand[0, :len(player_deck)] = player_deck
+                    mask, costs = kernel.legal_actions(np.array([0]), np.array([player_index]), hand)
+                    self.assertTrue(np.array_equal(mask[0], time_step.observation['legal_actions']))
+                    self.assertTrue(np.array_equal(costs[0], time_step.observation['action_costs']))
+
+                    actions, cards = split_action(np.flatnonzero(time_step.observation['legal_actions']))
+                    choice = rng.randrange(len(actions))
+                    if rng.random() < 0.1:
+                        # Impossible builds discard the structure too
+                        actions[choice] = rng.choice([Action.BUILD_STRUCTURE.value, Action.BUILD_WONDER_STAGE.value])
+                    structure_id = player_deck[cards[choice]]
+                    # The hands at the end of the age, a deck can be dealt one card short
+                    leftovers = [([-1] + [structure for index, structure in enumerate(env.player_deck(seat))
+                                          if seat != player_index or index != cards[choice]])[-1]
+                                 for seat in range(player_count)]
+
+                    age, turn = env.age, env.turn
+                    time_step = env.step(action_index(actions[choice], cards[choice]))
+                    kernel.play([0], [player_index], [actions[choice]], [structure_id])
+                    if env.age != age:
+                        kernel.finish_age([0], env.age, [leftovers])
+                    elif env.turn != turn:
+                        kernel.finish_turn([0])
+                    self.assertSameState(env, kernel)
+                    self.assertTrue(np.array_equal(kernel.discard_pile[0], env.discarded_structures))
+
+    def test_built_names_are_illegal(self):
+        # Free builds included, as game.Player.build_structure refuses a second structure of the same name
+        env = GameEnvironment(3, seed=0)
+        env.reset()
+        kernel = RulesKernel(1, 3)
+        kernel.reset([0], [wonder_boards(env)])
+        hand = np.full((1, player_hand_size), -1)
+        hand[0, :7] = env.player_deck(0)
+        kernel.free_build_available[0, 0] = True
+        kernel.play([0], [0], [Action.BUILD_STRUCTURE.value], [hand[0, 0]])
+        self.assertTrue(kernel.built_structures[0, 0, hand[0, 0]])
+        kernel.free_build_used[0, 0] = False
+        mask, _ = kernel.legal_actions(np.array([0]), np.array([0]), hand)
+        self.assertEqual(mask[0, action_index(Action.BUILD_STRUCTURE.value, 0)], 0)
+        self.assertEqual(mask[0, action_index(Action.DISCARD.value, 0)], 1)
+
+    def test_neighbor_choices_for_sale(self):
+        # Every structure cost when the neighbors sell "either/or" productions, each buyable as one of its options
+        env = GameEnvironment(3, seed=0)
+        env.reset()
+        kernel = RulesKernel(1, 3)
+        kernel.reset([0], [wonder_boards(env)])
+        names = dict((structure['name'], structure) for structure in env.catalog.structures)
+        for seat, name in ((0, 'Clay Pool'), (1, 'Tree Farm'), (1, 'Forest Cave'), (2, 'Excavation'),
+                           (2, 'Stone Pit'), (0, 'Caravansery')):
+            env.players[seat].build_structure(names[name], free=True)
+            kernel.construct(np.array([0]), np.array([seat]), np.array([names[name]['id']]))
+
+        sources = np.arange(kernel.tables.structure_count)
+        for seat, player in enumerate(env.players):
+            # Built names cannot be built again
+            expected = [None if structure['name'] in player.construction_names else player.build_cost(structure['cost'])
+                        for structure in env.catalog.structures]
+            costs = kernel.build_costs(0, seat, sources, free_build=False)
+            self.assertEqual(list(costs), [-1 if cost is None else cost for cost in expected])
+
+    def test_play_random_games(self):
+        kernel = RulesKernel(16, 4)
+        scores = play_random_games(kernel, np.random.default_rng(0))
+        self.assertEqual(scores.shape, (16, 4))
+        self.assertTrue(np.all(kernel.structure_type_counts.sum(axis=2) + kernel.wonder_stage <= 18))
+        self.assertTrue(np.all(scores >= 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+from policies import HeuristicPolicy, RandomPolicy
+from tournament import Tournament, elo_ratings, play_games, random_seatings, wilson_interval
+
+
+class TournamentTest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def test_play_games(self):
+        seatings = np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0], [0, 0, 1]])
+        factories = {0: ('random', RandomPolicy), 1: ('heuristic', HeuristicPolicy)}
+        result_seatings, scores, wonder_ids = play_games(factories, seatings, 3, seed=0)
+        np.testing.assert_array_equal(result_seatings, seatings)
+        self.assertEqual(scores.shape, (4, 3))
+        self.assertTrue((scores > 0).all())
+        self.assertTrue(all(len(set(ids)) == 3 for ids in wonder_ids))
+
+    def test_elo_ratings(self):
+        seatings = np.array([[0, 1, 2]] * 20)
+        scores = np.array([[30, 20, 10]] * 20)
+        ratings = elo_ratings(seatings, scores, 3)
+        self.assertGreater(ratings[0], ratings[1])
+        self.assertGreater(ratings[1], ratings[2])
+        self.assertAlmostEqual(ratings.mean(), 1500)
+        # Mirror matches leave the rating unchanged
+        self.assertAlmostEqual(elo_ratings(np.array([[0, 0, 1]]), np.array([[30, 10, 20]]), 2)[1], 1500)
+
+    def test_random_seatings_and_intervals(self):
+        seatings = random_seatings(np.random.default_rng(0), 5, 3, 10)
+        self.assertTrue(all(len(set(seats)) == 3 for seats in seatings))
+        lower, upper = wilson_interval(50, 100)
+        self.assertLess(lower, 0.5)
+        self.assertGreater(upper, 0.5)
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+
+    def test_tournament(self):
+        tournament = Tournament(player_count=3, num_workers=1, games_per_task=8, seed=0)
+        try:
+            tournament.add_entrant('random', RandomPolicy)
+            tournament.add_entrant('heuristic', HeuristicPolicy)
+            tournament.submit(16)
+            self.assertEqual(tournament.poll(wait=True), 0)
+            report = tournament.report(resamples=10)
+        finally:
+            tournament.close()
+        self.assertEqual(report['games'], 16)
+        self.assertEqual(sum(entrant['seats'] for entrant in report['entrants'].values()), 48)
+        self.assertEqual(sum(wonder['seats'] for wonder in report['wonders'].values()), 48)
+        self.assertGreater(report['entrants']['heuristic']['win_rate'], report['entrants']['random']['win_rate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tf_agents.trajectories import time_step
+
+from batched_environment import BatchedGameEnvironment
+from catalog import load_catalog
+from collector import episode_length
+from environment import action_count
+
+initial_rating = 1500
+elo_k = 32
+# Two sided 95% normal quantile
+confidence_z = 1.96
+
+# Policies loaded by a pool process, reused by its later tasks
+loaded_policies = {}
+
+
+class SavedPolicy:
+    # A policy written by policy_saver.PolicySaver, with the batched action interface of policies.py. checkpoint_path
+    # loads the variables of a later version, as written by PolicySaver.save_checkpoint or PolicyPublisher.
+
+    weights_required = False
+
+    def __init__(self, path, checkpoint_path=None):
+        import tensorflow as tf
+        self.tf = tf
+        self.policy = tf.saved_model.load(path)
+        if checkpoint_path is not None:
+            file_prefix = os.path.join(checkpoint_path, tf.saved_model.VARIABLES_DIRECTORY,
+                                       tf.saved_model.VARIABLES_FILENAME)
+            tf.train.Checkpoint(policy=self.policy).read(file_prefix).assert_existing_objects_matched().expect_partial()
+
+    def load(self, weights):
+        pass
+
+    def action(self, observation):
+        tf = self.tf
+        batch_size = len(observation['age'])
+        current_time_step = time_step.TimeStep(
+            step_type=tf.fill([batch_size], time_step.StepType.MID),
+            reward=tf.zeros([batch_size], tf.float32),
+            discount=tf.ones([batch_size], tf.float32),
+            observation=dict((key, tf.convert_to_tensor(value, tf.float32)) for key, value in observation.items()))
+        policy_step = self.policy.action(current_time_step, self.policy.get_initial_state(batch_size))
+        return (policy_step.action.numpy().astype(np.int32),
+                np.zeros((batch_size, action_count), dtype=np.float32))
+
+
+def play_games(factories, seatings, player_count, seed, board_observations=False, wonder_side='A'):
+    # Plays all seatings in lockstep on one BatchedGameEnvironment. Every step the games are grouped by the entrant
+    # on the move, so each entrant answers with one batched policy call. factories maps an entrant index to a
+    # (name, policy factory) pair.
+    seatings = np.asarray(seatings)
+    batch_size = len(seatings)
+    policies = {}
+    for entrant, (name, factory) in factories.items():
+        if name not in loaded_policies:
+            loaded_policies[name] = factory()
+        policies[entrant] = loaded_policies[name]
+
+    env = BatchedGameEnvironment(batch_size, player_count, seed, board_observations=board_observations,
+                                 wonder_side=wonder_side)
+    game_indexes = np.arange(batch_size)
+    actions = np.zeros(batch_size, dtype=np.int32)
+    current_time_step = env.reset()
+    for _ in range(episode_length(player_count)):
+        entrants = seatings[game_indexes, env.current_player_index]
+        for entrant in np.unique(entrants):
+            games = np.flatnonzero(entrants == entrant)
+            observation = dict((key, value[games]) for key, value in current_time_step.observation.items())
+            actions[games], _ = policies[entrant].action(observation)
+        current_time_step = env.step(actions)
+
+    return seatings, env.kernel.scores().astype(np.int32), env.wonder_ids.copy()
+
+
+def random_seatings(rng, entrant_count, player_count, games, entrants=None):
+    # Each game seats player_count entrants in random order, distinct while there are enough of them
+    entrants = np.arange(entrant_count) if entrants is None else np.asarray(entrants)
+    replace = len(entrants) < player_count
+    return np.array([rng.choice(entrants, player_count, replace=replace) for _ in range(games)], dtype=np.int32)
+
+
+def win_shares(scores):
+    # 1 for the winner of a game, split between tied winners
+    winners = scores == scores.max(axis=1, keepdims=True)
+    return winners / winners.sum(axis=1, keepdims=True)
+
+
+def wilson_interval(successes, trials, z=confidence_z):
+    if trials == 0:
+        return 0.0, 1.0
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def elo_ratings(seatings, scores, entrant_count, k=elo_k, order=None):
+    # Multiplayer Elo: a game counts as a match between every pair of seats, each seat's change divided by the number
+    # of opponents. Mirror seats of the same entrant cancel out.
+    ratings = np.full(entrant_count, float(initial_rating))
+    player_count = seatings.shape[1]
+    first, second = np.triu_indices(player_count, 1)
+    for game in (range(len(seatings)) if order is None else order):
+        seats = seatings[game]
+        expected = 1 / (1 + 10 ** ((ratings[seats[second]] - ratings[seats[first]]) / 400))
+        result = (np.sign(scores[game, first] - scores[game, second]) + 1) / 2
+        change = k * (result - expected) / (player_count - 1)
+        np.add.at(ratings, seats[first], change)
+        np.add.at(ratings, seats[second], -change)
+    return ratings
+
+
+def elo_intervals(seatings, scores, entrant_count, rng, resamples=100, k=elo_k):
+    # Percentile bootstrap over the games, each resample played in a random order
+    samples = np.array([elo_ratings(seatings, scores, entrant_count, k, rng.integers(0, len(seatings), len(seatings)))
+                        for _ in range(resamples)])
+    return np.percentile(samples, 2.5, axis=0), np.percentile(samples, 97.5, axis=0)
+
+
+class Tournament:
+    # Plays entrants, saved policies and scripted baselines, against each other on a pool of spawned processes. submit
+    # returns at once, so the learner can keep training while otherwise idle cores play; poll gathers finished games.
+
+    def __init__(self, player_count=3, num_workers=1, games_per_task=64, seed=None, catalog=None,
+                 board_observations=False, wonder_side='A'):
+        self.player_count = player_count
+        self.board_observations = board_observations
+        self.wonder_side = wonder_side
+        self.games_per_task = games_per_task
+        self.catalog = catalog if catalog is not None else load_catalog()
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
+        self.entrants = []
+        self.factories = []
+        self.pool = ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.pending = []
+
+        self.seatings = np.zeros((0, player_count), dtype=np.int32)
+        self.scores = np.zeros((0, player_count), dtype=np.int32)
+        self.wonder_ids = np.zeros((0, player_count), dtype=np.int32)
+
+    def add_entrant(self, name, factory):
+        # factory must pickle, like a policy class or a functools.partial of one
+        if name in self.entrants:
+            raise ValueError('entrant %s already plays' % name)
+        self.entrants.append(name)
+        self.factories.append(factory)
+        return len(self.entrants) - 1
+
+    def submit(self, games, entrants=None, seatings=None):
+        # Random seatings of the named entrants, or all of them, unless seatings of entrant indexes are given
+        if seatings is None:
+            indexes = None if entrants is None else [self.entrants.index(name) for name in entrants]
+            seatings = random_seatings(self.rng, len(self.entrants), self.player_count, games, indexes)
+        seatings = np.asarray(seatings, dtype=np.int32)
+        for start in range(0, len(seatings), self.games_per_task):
+            task_seatings = seatings[start:start + self.games_per_task]
+            factories = dict((int(entrant), (self.entrants[entrant], self.factories[entrant]))
+                             for entrant in np.unique(task_seatings))
+            seed = int(self.seed_sequence.spawn(1)[0].generate_state(1)[0])
+            self.pending.append(self.pool.submit(play_games, factories, task_seatings, self.player_count, seed,
+                                                 self.board_observations, self.wonder_side))
+
+    def poll(self, wait=False):
+        # Adds the games of finished tasks, returns the number of tasks still running
+        running = []
+        for future in self.pending:
+            if wait or future.done():
+                self.add_games(*future.result())
+            else:
+                running.append(future)
+        self.pending = running
+        return len(running)
+
+    def add_games(self, seatings, scores, wonder_ids):
+        self.seatings = np.concatenate([self.seatings, seatings])
+        self.scores = np.concatenate([self.scores, scores])
+        self.wonder_ids = np.concatenate([self.wonder_ids, wonder_ids])
+
+    def ratings(self):
+        return dict(zip(self.entrants, elo_ratings(self.seatings, self.scores, len(self.entrants))))
+
+    def report(self, resamples=100):
+        shares = win_shares(self.scores)
+        lower, upper = elo_intervals(self.seatings, self.scores, len(self.entrants), self.rng, resamples)
+        ratings = elo_ratings(self.seatings, self.scores, len(self.entrants))
+
+        entrants = {}
+        for index, name in enumerate(self.entrants):
+            seats = self.seatings == index
+            seat_count = int(seats.sum())
+            wins = float(shares[seats].sum())
+            entrants[name] = {
+                'elo': float(ratings[index]),
+                'elo_interval': (float(lower[index]), float(upper[index])),
+                'seats': seat_count,
+                'win_rate': wins / seat_count if seat_count else 0.0,
+                'win_rate_interval': wilson_interval(wins, seat_count),
+                'mean_score': float(self.scores[seats].mean()) if seat_count else 0.0,
+            }
+
+        wonders = {}
+        for wonder_id, wonder in enumerate(self.catalog.wonders):
+            seats = self.wonder_ids == wonder_id
+            seat_count = int(seats.sum())
+            if seat_count:
+                wins = float(shares[seats].sum())
+                wonders[wonder['name']] = {
+                    'seats': seat_count,
+                    'win_rate': wins / seat_count,
+                    'win_rate_interval': wilson_interval(wins, seat_count),
+                }
+
+        return {'games': len(self.seatings), 'entrants': entrants, 'wonders': wonders}
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)